@@ -0,0 +1,221 @@
+"""Admission control: concurrency limits, a bounded wait queue and rate limits.
+
+Under a spike every request that gets in holds a database connection or CPU
+time while it waits, so latency climbs for everyone, bookings included.
+``AdmissionMiddleware`` decides before routing whether an ``/api`` request
+runs now, waits, or is turned away:
+
+- each client (by address) has a token bucket of ``burst`` requests refilled
+  at ``rate`` per second; an empty bucket is a 429;
+- routes listed in ``route_limits`` run at most that many requests at once;
+- all API requests together run at most ``max_concurrent`` at once, and when
+  a slot frees up, waiting writes get it before waiting reads.
+
+A request that finds ``queue_size`` requests of its kind already waiting, or
+that waits longer than ``queue_timeout``, gets a 503 with ``Retry-After``
+instead of piling up.
+"""
+import asyncio
+import time
+from collections import deque
+
+from starlette.routing import Match
+
+from metrics import registry
+from serialization import dumps, json_response
+
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+MAX_TRACKED_CLIENTS = 10000
+
+admission_rejected = registry.counter(
+    "admission_rejected_total", "API requests turned away by admission control.", ("limiter", "reason")
+)
+admission_wait = registry.histogram(
+    "admission_wait_seconds", "Time API requests waited for a slot.", ("priority",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+
+def parse_route_limits(value):
+    """Parse ``"/api/a=8,/api/b=2"`` into ``{"/api/a": 8, "/api/b": 2}``."""
+    limits = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            route, _, limit = item.rpartition("=")
+            limits[route.strip()] = int(limit)
+    return limits
+
+
+class Limiter:
+    """At most ``limit`` holders at once; up to ``queue_size`` waiters per priority.
+
+    A released slot goes to the longest-waiting write, then the
+    longest-waiting read.
+    """
+
+    def __init__(self, name, limit, queue_size, queue_timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = {"write": deque(), "read": deque()}
+
+    def queued(self, priority=None):
+        if priority is not None:
+            return len(self._waiters[priority])
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def acquire(self, priority):
+        """Take a slot; returns the reason for refusing, or ``None`` once held."""
+        if self.active < self.limit and not self.queued():
+            self.active += 1
+            return None
+        waiters = self._waiters[priority]
+        if len(waiters) >= self.queue_size:
+            return "queue_full"
+        slot = asyncio.get_running_loop().create_future()
+        waiters.append(slot)
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await slot
+            return None
+        except BaseException as e:
+            if slot.done() and not slot.cancelled():
+                # Handed a slot just as the wait ended
+                self.release()
+            else:
+                slot.cancel()
+                if slot in waiters:
+                    waiters.remove(slot)
+            if isinstance(e, TimeoutError):
+                return "timeout"
+            raise
+
+    def release(self):
+        for priority in ("write", "read"):
+            waiters = self._waiters[priority]
+            while waiters:
+                slot = waiters.popleft()
+                if not slot.done():
+                    # The slot passes to the waiter without being freed
+                    slot.set_result(None)
+                    return
+        self.active -= 1
+
+
+class TokenBuckets:
+    """Per-client token buckets: ``burst`` requests, refilled at ``rate`` a second."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._buckets = {}
+
+    def take(self, client):
+        """Spend a token; returns 0 if there was one, else seconds until there is."""
+        now = self._clock()
+        tokens, updated = self._buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[client] = (tokens, now)
+            return (1 - tokens) / self.rate
+        if client not in self._buckets and len(self._buckets) >= MAX_TRACKED_CLIENTS:
+            self._prune(now)
+        self._buckets[client] = (tokens - 1, now)
+        return 0
+
+    def _prune(self, now):
+        # Buckets that have refilled are the same as no bucket
+        full_after = self.burst / self.rate
+        self._buckets = {
+            client: (tokens, updated) for client, (tokens, updated) in self._buckets.items()
+            if now - updated < full_after
+        }
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent, route_limits=None, queue_size=100, queue_timeout=2.0,
+                 rate=0.0, burst=0, retry_after=1):
+        self.retry_after = retry_after
+        self.shared = Limiter("all", max_concurrent, queue_size, queue_timeout) if max_concurrent > 0 else None
+        self.routes = {
+            route: Limiter(route, limit, queue_size, queue_timeout)
+            for route, limit in (route_limits or {}).items() if limit > 0
+        }
+        self.buckets = TokenBuckets(rate, max(burst, 1)) if rate > 0 else None
+
+    def limiters(self):
+        return ([self.shared] if self.shared else []) + list(self.routes.values())
+
+    def stats(self):
+        return {
+            "limiters": [
+                {"name": limiter.name, "limit": limiter.limit, "active": limiter.active,
+                 "queued_writes": limiter.queued("write"), "queued_reads": limiter.queued("read")}
+                for limiter in self.limiters()
+            ],
+            "tracked_clients": len(self.buckets) if self.buckets else 0,
+        }
+
+
+def find_route(scope):
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+
+def rejection(status_code, detail, retry_after):
+    response = json_response(dumps({"detail": detail}), {"Retry-After": str(max(1, round(retry_after)))})
+    response.status_code = status_code
+    return response
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an ``AdmissionController`` to ``/api`` routes."""
+
+    def __init__(self, app, controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        controller = self.controller
+        route = find_route(scope)
+        if route is not None:
+            # Labels the request's metrics even when it is turned away here
+            scope["route"] = route
+        if controller.buckets is not None and scope.get("client"):
+            wait = controller.buckets.take(scope["client"][0])
+            if wait:
+                admission_rejected.inc(("client", "rate_limited"))
+                await rejection(429, "Too many requests", wait)(scope, receive, send)
+                return
+
+        priority = "write" if scope["method"] in WRITE_METHODS else "read"
+        limiters = [controller.routes.get(getattr(route, "path", None)), controller.shared]
+        held = []
+        started = time.perf_counter()
+        try:
+            for limiter in limiters:
+                if limiter is None:
+                    continue
+                refused = await limiter.acquire(priority)
+                if refused is not None:
+                    admission_rejected.inc((limiter.name, refused))
+                    await rejection(503, "Server is busy, retry later", controller.retry_after)(scope, receive, send)
+                    return
+                held.append(limiter)
+            admission_wait.observe((priority,), time.perf_counter() - started)
+            await self.app(scope, receive, send)
+        finally:
+            for limiter in reversed(held):
+                limiter.release()
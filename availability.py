@@ -0,0 +1,435 @@
+"""In-process room availability index backing /api/available-rooms.
+
+Rooms are loaded once with their hotel and chain details, and every room keeps
+a calendar of occupied date intervals (active bookings and rentings). Searches
+are answered from memory; the write handlers in main.py keep the index current
+after each successful commit.
+"""
+import asyncio
+import bisect
+import heapq
+import threading
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+ROOMS_QUERY = """
+SELECT r.roomid,
+       r.hotelid,
+       r.price,
+       r.capacity,
+       r.view,
+       r.amenities,
+       r.problems,
+       r.extendable,
+       h.haddress as address,
+       h.hemail as hotel_email,
+       h.hphone as hotel_phone,
+       h.num_of_rooms,
+       hc.cname as chain_name,
+       hc.cemail as chain_email,
+       hc.cphone as chain_phone
+FROM "hotel chains".rooms r
+JOIN "hotel chains".hotels h ON r.hotelid = h.hotelid
+JOIN "hotel chains".hotelchains hc ON h.chainid = hc.chainid
+"""
+
+# Longest stay the schema accepts (the *_stay_length constraints). A stay still
+# running on a given day started at most this many nights earlier, which bounds
+# startdate and lets Postgres skip older bookings and rentings partitions.
+MAX_STAY_NIGHTS = 180
+
+# Only stays that have not ended yet can block a search, so older history is
+# never loaded. Searches starting before the load date go to the SQL path.
+OCCUPANCY_QUERY = f"""
+SELECT 'booking' as kind, bookingid as id, roomid, startdate, enddate
+FROM "hotel chains".bookings
+WHERE status = 'Booked' AND enddate >= CURRENT_DATE AND startdate >= CURRENT_DATE - {MAX_STAY_NIGHTS}
+UNION ALL
+SELECT 'renting' as kind, rentingid as id, roomid, startdate, enddate
+FROM "hotel chains".rentings
+WHERE status IS DISTINCT FROM 'CheckedOut' AND enddate >= CURRENT_DATE AND startdate >= CURRENT_DATE - {MAX_STAY_NIGHTS}
+"""
+
+
+def room_to_dict(row):
+    return {
+        "roomid": row.roomid,
+        "hotelid": row.hotelid,
+        "price": float(row.price) if row.price else None,
+        "capacity": row.capacity,
+        "view": row.view,
+        "amenities": row.amenities,
+        "problems": row.problems,
+        "extendable": row.extendable,
+        "hotel_address": row.address,
+        "hotel_email": row.hotel_email,
+        "hotel_phone": row.hotel_phone,
+        "hotel_category": row.num_of_rooms,
+        "chain_name": row.chain_name,
+        "chain_email": row.chain_email,
+        "chain_phone": row.chain_phone,
+        "is_available": True
+    }
+
+
+class RoomCalendar:
+    """Occupied intervals of one room, sorted by start date.
+
+    ``reach[i]`` is the latest end date among the first ``i + 1`` intervals, so
+    an overlap test is a single bisect regardless of how intervals nest.
+    Intervals are inclusive on both ends, like the SQL overlap predicate.
+    """
+    __slots__ = ("starts", "ends", "keys", "reach")
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.keys = []
+        self.reach = []
+
+    def add(self, key, start, end):
+        self.discard(key)
+        idx = bisect.bisect_right(self.starts, start)
+        self.starts.insert(idx, start)
+        self.ends.insert(idx, end)
+        self.keys.insert(idx, key)
+        self._rebuild_reach(idx)
+
+    def discard(self, key):
+        try:
+            idx = self.keys.index(key)
+        except ValueError:
+            return False
+        del self.starts[idx]
+        del self.ends[idx]
+        del self.keys[idx]
+        self._rebuild_reach(idx)
+        return True
+
+    def is_free(self, start, end):
+        idx = bisect.bisect_right(self.starts, end)
+        return idx == 0 or self.reach[idx - 1] < start
+
+    def free_starts(self, first, last, nights):
+        """Inclusive ranges of start dates in ``first..last`` for which a stay of ``nights`` is free.
+
+        One pass over the intervals: the gap before each interval admits the
+        starts that finish before it begins, and the next gap opens after the
+        latest end seen so far.
+        """
+        length = timedelta(days=nights)
+        ranges = []
+        # Intervals whose reach ends before ``first`` cannot block anything
+        idx = bisect.bisect_left(self.reach, first)
+        candidate = first
+        for start, end in zip(self.starts[idx:], self.ends[idx:]):
+            if start > last + length:
+                break
+            latest = min(last, start - length - timedelta(days=1))
+            if latest >= candidate:
+                ranges.append((candidate, latest))
+            candidate = max(candidate, end + timedelta(days=1))
+        if candidate <= last:
+            ranges.append((candidate, last))
+        return ranges
+
+    def _rebuild_reach(self, idx):
+        del self.reach[idx:]
+        current = self.reach[-1] if self.reach else None
+        for end in self.ends[idx:]:
+            if current is None or end > current:
+                current = end
+            self.reach.append(current)
+
+
+def normalize_amenity(name):
+    """Vocabulary key for an amenity: case and spacing vary in the data ('Wifi'/'WiFi')."""
+    return " ".join(name.split()).lower()
+
+
+class AmenityVocabulary:
+    """Gives every normalized amenity a bit, so a room's amenities are one integer mask."""
+
+    def __init__(self):
+        self._bits = {}
+
+    def encode(self, amenities):
+        mask = 0
+        for name in amenities or ():
+            key = normalize_amenity(name)
+            bit = self._bits.get(key)
+            if bit is None:
+                bit = self._bits[key] = 1 << len(self._bits)
+            mask |= bit
+        return mask
+
+    def lookup(self, names):
+        """Mask of the known ``names`` and whether all of them were known."""
+        mask = 0
+        known = True
+        for name in names:
+            bit = self._bits.get(normalize_amenity(name))
+            if bit is None:
+                known = False
+            else:
+                mask |= bit
+        return mask, known
+
+
+class AvailabilityEngine:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._vocabulary = AmenityVocabulary()
+        self._rooms = {}
+        self._room_ids = []
+        self._calendars = {}
+        # Changes reported while a load reads its snapshot, replayed on top of it
+        self._journal = None
+        # One load at a time, since they share the journal
+        self._loading = asyncio.Lock()
+        self.loaded_on = None
+
+    @property
+    def ready(self):
+        return self.loaded_on is not None
+
+    def covers(self, start: date):
+        return self.ready and start >= self.loaded_on
+
+    async def load(self, db):
+        async with self._loading:
+            await self._load(db)
+
+    async def _load(self, db):
+        with self._lock:
+            self._journal = []
+        try:
+            rooms = {row.roomid: room_to_dict(row) for row in await db.execute(text(ROOMS_QUERY))}
+            vocabulary = AmenityVocabulary()
+            for room in rooms.values():
+                room["amenity_mask"] = vocabulary.encode(room["amenities"])
+            calendars = {room_id: RoomCalendar() for room_id in rooms}
+            for row in await db.execute(text(OCCUPANCY_QUERY)):
+                calendar = calendars.get(row.roomid)
+                if calendar is not None:
+                    calendar.add((row.kind, row.id), row.startdate, row.enddate)
+            with self._lock:
+                # Adding and discarding are idempotent, so changes the snapshot
+                # already saw are harmless to replay
+                rooms_changed = False
+                for change in self._journal:
+                    if change[0] == "rooms":
+                        rooms_changed = True
+                        continue
+                    calendar = calendars.get(change[3])
+                    if calendar is None:
+                        continue
+                    if change[0] == "occupy":
+                        calendar.add((change[1], change[2]), change[4], change[5])
+                    else:
+                        calendar.discard((change[1], change[2]))
+                self._vocabulary = vocabulary
+                self._rooms = rooms
+                self._room_ids = sorted(rooms)
+                self._calendars = calendars
+                self.loaded_on = date.today()
+        finally:
+            with self._lock:
+                self._journal = None
+        if rooms_changed:
+            await self.refresh_rooms(db)
+
+    async def refresh_rooms(self, db, room_id=None, hotel_id=None):
+        """Reload catalogue data after room or hotel writes."""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(("rooms",))
+        if not self.ready:
+            return
+        query = ROOMS_QUERY
+        params = {}
+        if room_id is not None:
+            query += " WHERE r.roomid = :room_id"
+            params["room_id"] = room_id
+        elif hotel_id is not None:
+            query += " WHERE r.hotelid = :hotel_id"
+            params["hotel_id"] = hotel_id
+        rows = {row.roomid: room_to_dict(row) for row in await db.execute(text(query), params)}
+        with self._lock:
+            if room_id is not None:
+                stale = {room_id}
+            elif hotel_id is not None:
+                stale = {rid for rid, room in self._rooms.items() if room["hotelid"] == hotel_id}
+            else:
+                stale = set(self._rooms)
+            for rid in stale - rows.keys():
+                if self._rooms.pop(rid, None) is not None:
+                    self._room_ids.remove(rid)
+                self._calendars.pop(rid, None)
+            for rid, room in rows.items():
+                room["amenity_mask"] = self._vocabulary.encode(room["amenities"])
+                if rid not in self._rooms:
+                    bisect.insort(self._room_ids, rid)
+                self._rooms[rid] = room
+                self._calendars.setdefault(rid, RoomCalendar())
+
+    def occupy(self, kind, entity_id, room_id, start: date, end: date):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(("occupy", kind, entity_id, room_id, start, end))
+            calendar = self._calendars.get(room_id)
+            if calendar is not None:
+                calendar.add((kind, entity_id), start, end)
+
+    def release(self, kind, entity_id, room_id):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(("release", kind, entity_id, room_id))
+            calendar = self._calendars.get(room_id)
+            if calendar is not None:
+                calendar.discard((kind, entity_id))
+
+    def room(self, room_id):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            return {k: v for k, v in room.items() if k != "amenity_mask"} if room is not None else None
+
+    def is_free(self, room_id, start: date, end: date):
+        with self._lock:
+            calendar = self._calendars.get(room_id)
+            return calendar is not None and calendar.is_free(start, end)
+
+    def _filter(self, capacity=None, area=None, hotel_chain=None, max_price=None, amenities=None,
+                match_any=False, exclude_problems=False):
+        mask = None
+        if amenities:
+            mask, known = self._vocabulary.lookup(amenities)
+            if not known and not match_any:
+                # A room cannot have an amenity no room has
+                return lambda room: False
+        return room_filter(capacity, area, hotel_chain, max_price, mask, match_any, exclude_problems)
+
+    def search(self, start: date, end: date, capacity=None, area=None, hotel_chain=None, max_price=None,
+               after=None, limit=None, amenities=None, match_any=False, exclude_problems=False):
+        """Free rooms matching the filters in room id order, starting after room ``after``.
+
+        The returned dicts are the index's own records and must not be modified.
+        """
+        results = []
+        with self._lock:
+            matches = self._filter(capacity, area, hotel_chain, max_price, amenities, match_any, exclude_problems)
+            first = bisect.bisect_right(self._room_ids, after) if after is not None else 0
+            for room_id in self._room_ids[first:]:
+                if limit is not None and len(results) >= limit:
+                    break
+                room = self._rooms[room_id]
+                if not matches(room) or not self._calendars[room_id].is_free(start, end):
+                    continue
+                results.append(room)
+        return results
+
+    def free_starts(self, first: date, last: date, nights, capacity=None, area=None, hotel_chain=None,
+                    max_price=None, amenities=None, match_any=False, exclude_problems=False):
+        """``[(room, ranges)]`` for matching rooms that can start a stay of ``nights`` in ``first..last``."""
+        results = []
+        with self._lock:
+            matches = self._filter(capacity, area, hotel_chain, max_price, amenities, match_any, exclude_problems)
+            for room_id in self._room_ids:
+                room = self._rooms[room_id]
+                if not matches(room):
+                    continue
+                ranges = self._calendars[room_id].free_starts(first, last, nights)
+                if ranges:
+                    results.append((room, ranges))
+        return results
+
+
+def room_fits(room, capacity=None, max_price=None):
+    """The capacity and price filters of ``room_search_filters`` in main.py.
+
+    A filter left out or given as 0 matches every room. A room without a
+    capacity or price matches no filter on it; a price of 0 counts as none,
+    as in search results.
+    """
+    if capacity and (room["capacity"] is None or room["capacity"] < capacity):
+        return False
+    if max_price and (room["price"] is None or room["price"] > max_price):
+        return False
+    return True
+
+
+def room_filter(capacity=None, area=None, hotel_chain=None, max_price=None, amenity_mask=None, match_any=False,
+                exclude_problems=False):
+    """Predicate over index records with the same semantics as the SQL search filters.
+
+    ``amenity_mask`` is matched against each room's ``amenity_mask``: every bit
+    must be set, or with ``match_any`` at least one.
+    """
+    area = area.lower() if area else None
+    hotel_chain = hotel_chain.lower() if hotel_chain else None
+
+    def matches(room):
+        if amenity_mask is not None:
+            shared = room["amenity_mask"] & amenity_mask
+            if (match_any and not shared) or (not match_any and shared != amenity_mask):
+                return False
+        if exclude_problems and room["problems"]:
+            return False
+        if not room_fits(room, capacity, max_price):
+            return False
+        if area and area not in (room["hotel_address"] or "").lower():
+            return False
+        if hotel_chain and hotel_chain not in (room["chain_name"] or "").lower():
+            return False
+        return True
+    return matches
+
+
+def _nightly_price(room):
+    return room["price"] if room["price"] is not None else float("inf")
+
+
+def group_stays(free, room_count, limit=None):
+    """Cheapest way to put ``room_count`` rooms of one hotel on the same dates, per hotel.
+
+    ``free`` is ``[(room, ranges)]`` as returned by ``free_starts``. Each
+    hotel's ranges are swept in date order, keeping the set of rooms free for
+    every start date between two events; wherever at least ``room_count`` are
+    free, the cheapest of them form a candidate. Returns one
+    ``(rooms, first_start, last_start)`` per hotel, cheapest first and then
+    earliest, at most ``limit`` of them.
+    """
+    events_by_hotel = {}
+    for room, ranges in free:
+        events = events_by_hotel.setdefault(room["hotelid"], [])
+        for first, last in ranges:
+            events.append((first, 1, room["roomid"], room))
+            events.append((last + timedelta(days=1), -1, room["roomid"], room))
+
+    best = []
+    for events in events_by_hotel.values():
+        # A room leaving and another arriving on the same day are both applied
+        # before that day is evaluated
+        events.sort(key=lambda event: event[:3])
+        active = {}
+        candidate = None
+        for idx, (day, delta, room_id, room) in enumerate(events):
+            if delta > 0:
+                active[room_id] = room
+            else:
+                del active[room_id]
+            if idx + 1 == len(events) or events[idx + 1][0] == day or len(active) < room_count:
+                continue
+            rooms = heapq.nsmallest(room_count, active.values(), key=lambda r: (_nightly_price(r), r["roomid"]))
+            price = sum(_nightly_price(r) for r in rooms)
+            last_start = events[idx + 1][0] - timedelta(days=1)
+            if candidate is None or price < candidate[0]:
+                candidate = (price, day, last_start, rooms)
+            elif candidate[2] + timedelta(days=1) == day and candidate[3] == rooms:
+                # The same rooms stay cheapest into the next segment
+                candidate = (price, candidate[1], last_start, rooms)
+        if candidate is not None:
+            best.append(candidate)
+    best.sort(key=lambda c: (c[0], c[1], c[3][0]["hotelid"]))
+    return [(rooms, first, last) for _, first, last, rooms in best[:limit]]
@@ -0,0 +1,126 @@
+"""Concurrency benchmark for booking/customer ID allocation.
+
+Runs the same concurrent insert workload twice against a scratch table: once
+allocating IDs with ``SELECT COALESCE(MAX(id), 0) + 1`` (the old API code) and
+once with ``nextval`` on a sequence. Reports the primary-key collision rate
+and latency percentiles for each strategy.
+
+    python benchmarks/id_allocation.py --workers 32 --inserts 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from database import make_async_engine
+
+SETUP = [
+    'DROP TABLE IF EXISTS "hotel chains".id_bench',
+    'DROP SEQUENCE IF EXISTS "hotel chains".id_bench_seq',
+    'CREATE SEQUENCE "hotel chains".id_bench_seq',
+    'CREATE UNLOGGED TABLE "hotel chains".id_bench (id integer PRIMARY KEY, payload text)',
+]
+TEARDOWN = [
+    'DROP TABLE IF EXISTS "hotel chains".id_bench',
+    'DROP SEQUENCE IF EXISTS "hotel chains".id_bench_seq',
+]
+
+STRATEGIES = {
+    "max_plus_one": [
+        'SELECT COALESCE(MAX(id), 0) + 1 FROM "hotel chains".id_bench',
+        'INSERT INTO "hotel chains".id_bench (id, payload) VALUES (:id, :payload)',
+    ],
+    "sequence": [
+        None,
+        'INSERT INTO "hotel chains".id_bench (id, payload) '
+        "VALUES (nextval('\"hotel chains\".id_bench_seq'), :payload)",
+    ],
+}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+async def worker(engine, strategy, inserts, latencies, counters):
+    id_query, insert_query = STRATEGIES[strategy]
+    for i in range(inserts):
+        started = time.perf_counter()
+        async with engine.connect() as conn:
+            try:
+                params = {"payload": f"row {i}"}
+                if id_query:
+                    params["id"] = (await conn.execute(text(id_query))).scalar()
+                await conn.execute(text(insert_query), params)
+                await conn.commit()
+                counters["ok"] += 1
+            except IntegrityError:
+                await conn.rollback()
+                counters["collisions"] += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def run_strategy(engine, strategy, workers, inserts):
+    async with engine.begin() as conn:
+        for statement in SETUP:
+            await conn.execute(text(statement))
+    latencies = []
+    counters = {"ok": 0, "collisions": 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(engine, strategy, inserts, latencies, counters) for _ in range(workers)))
+    elapsed = time.perf_counter() - started
+    attempts = counters["ok"] + counters["collisions"]
+    return {
+        "strategy": strategy,
+        "attempts": attempts,
+        "collisions": counters["collisions"],
+        "collision_rate": counters["collisions"] / attempts if attempts else 0.0,
+        "throughput_per_s": attempts / elapsed if elapsed else None,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies) if latencies else None,
+    }
+
+
+async def main(args):
+    engine = make_async_engine()
+    try:
+        results = []
+        for strategy in ("max_plus_one", "sequence"):
+            results.append(await run_strategy(engine, strategy, args.workers, args.inserts))
+    finally:
+        async with engine.begin() as conn:
+            for statement in TEARDOWN:
+                await conn.execute(text(statement))
+        await engine.dispose()
+
+    for result in results:
+        print(
+            f"{result['strategy']:>13}: {result['attempts']} inserts, "
+            f"collision rate {result['collision_rate']:.2%}, "
+            f"p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+            f"{result['throughput_per_s']:.0f} inserts/s"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"workers": args.workers, "inserts_per_worker": args.inserts, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=16, help="concurrent connections")
+    parser.add_argument("--inserts", type=int, default=100, help="inserts per worker")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,347 @@
+"""Replay mixed API workloads and record a machine-readable performance baseline.
+
+Concurrent workers send a weighted mix of requests for ``--duration`` seconds,
+either to the app in-process (the default, through httpx's ASGI transport) or
+to a running server given with ``--url``. Request parameters are drawn from
+the data in ``DATABASE_URL``, so seed it first with ``benchmarks/seed.py``.
+
+For every operation the report has throughput, p50/p95/p99 latency and status
+counts, and, in-process, the number of SQL statements each request ran.
+``--output`` writes it as JSON; ``--compare`` checks a run against such a file
+and exits non-zero when an operation's p95 latency regressed by more than
+``--tolerance``.
+
+    python benchmarks/seed.py --replace
+    python benchmarks/load.py --workload search --output baseline.json
+    python benchmarks/load.py --workload search --compare baseline.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+from sqlalchemy import event, text
+
+from database import make_async_engine
+
+# Relative weights of the operations in each workload
+WORKLOADS = {
+    "search": {"search": 80, "hotels": 8, "history": 8, "book": 4},
+    "booking-burst": {"book": 60, "search": 30, "history": 10},
+    "admin": {"search": 40, "update_room": 15, "update_customer": 10, "report": 20, "hotels": 15},
+    "mixed": {"search": 55, "book": 15, "history": 10, "hotels": 8, "report": 5, "update_room": 4, "update_customer": 3},
+}
+
+POOLS_QUERIES = {
+    "rooms": 'SELECT roomid, hotelid FROM "hotel chains".rooms ORDER BY roomid',
+    "customers": 'SELECT customerid FROM "hotel chains".customers ORDER BY customerid',
+    "chains": 'SELECT chainid FROM "hotel chains".hotelchains ORDER BY chainid',
+    "cities": """
+        SELECT DISTINCT trim(split_part(haddress, ',', 2)) FROM "hotel chains".hotels
+        WHERE haddress LIKE '%,%'
+    """,
+}
+
+DATASET_QUERY = """
+SELECT (SELECT count(*) FROM "hotel chains".hotels) AS hotels,
+       (SELECT count(*) FROM "hotel chains".rooms) AS rooms,
+       (SELECT count(*) FROM "hotel chains".customers) AS customers,
+       (SELECT count(*) FROM "hotel chains".bookings) AS bookings,
+       (SELECT count(*) FROM "hotel chains".rentings) AS rentings
+"""
+
+current_operation = contextvars.ContextVar("current_operation", default=None)
+
+
+class Pools:
+    """Ids and values the operations draw their parameters from."""
+
+    def __init__(self, rows):
+        self.rooms = [tuple(row) for row in rows["rooms"]]
+        self.customers = [row[0] for row in rows["customers"]]
+        self.chains = [row[0] for row in rows["chains"]]
+        self.cities = sorted(row[0] for row in rows["cities"] if row[0])
+        if not self.rooms or not self.customers:
+            sys.exit("No rooms or customers found; seed the database with benchmarks/seed.py first")
+        self.today = date.today()
+
+    def hot_room(self, rng):
+        # Cubing a uniform draw concentrates requests on the first rooms
+        return self.rooms[int(len(self.rooms) * rng.random() ** 3)]
+
+    def customer(self, rng):
+        return self.customers[int(len(self.customers) * rng.random() ** 2)]
+
+
+def search(rng, pools):
+    start = pools.today + timedelta(days=rng.randint(1, 300))
+    params = {
+        "start_date": start.isoformat(),
+        "end_date": (start + timedelta(days=rng.randint(1, 6))).isoformat(),
+        "limit": 50,
+    }
+    if pools.cities and rng.random() < 0.6:
+        params["area"] = rng.choice(pools.cities)
+    if rng.random() < 0.3:
+        params["capacity"] = rng.randint(1, 4)
+    if rng.random() < 0.3:
+        params["max_price"] = rng.choice([100, 150, 200, 300])
+    return "GET", "/api/available-rooms", {"params": params}
+
+
+def book(rng, pools):
+    room_id, _ = pools.hot_room(rng)
+    start = pools.today + timedelta(days=rng.randint(1, 30))
+    return "POST", "/api/bookings", {"json": {
+        "room_id": room_id,
+        "customer_id": pools.customer(rng),
+        "start_date": start.isoformat(),
+        "end_date": (start + timedelta(days=rng.randint(1, 4))).isoformat(),
+    }}
+
+
+def history(rng, pools):
+    return "GET", f"/api/customers/{pools.customer(rng)}/bookings", {"params": {"limit": 20}}
+
+
+def hotels(rng, pools):
+    params = {"chain_id": rng.choice(pools.chains)} if pools.chains and rng.random() < 0.8 else {}
+    return "GET", "/api/hotels", {"params": params}
+
+
+def report(rng, pools):
+    return "GET", rng.choice(["/api/views/room-capacity", "/api/views/room-area"]), {}
+
+
+def update_room(rng, pools):
+    room_id, hotel_id = rng.choice(pools.rooms)
+    return "PUT", f"/api/rooms/{room_id}", {"json": {
+        "hotel_id": hotel_id,
+        "price": round(rng.uniform(60, 400), 2),
+        "capacity": None,
+        "view": None,
+        "extendable": None,
+        "problems": None,
+    }}
+
+
+def update_customer(rng, pools):
+    return "PUT", f"/api/customers/{pools.customer(rng)}", {"json": {
+        "firstname": rng.choice(["Alex", "Sam", "Jordan"]),
+        "lastname": rng.choice(["Smith", "Lee", "Roy"]),
+        "address": f"{rng.randint(1, 9999)} Customer Ave",
+    }}
+
+
+OPERATIONS = {
+    "search": search,
+    "book": book,
+    "history": history,
+    "hotels": hotels,
+    "report": report,
+    "update_room": update_room,
+    "update_customer": update_customer,
+}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.queries = {}
+
+    def record(self, operation, status, elapsed_ms):
+        self.latencies.setdefault(operation, []).append(elapsed_ms)
+        counts = self.statuses.setdefault(operation, {})
+        counts[status] = counts.get(status, 0) + 1
+
+    def count_query(self, *args):
+        operation = current_operation.get()
+        if operation is not None:
+            self.queries[operation] = self.queries.get(operation, 0) + 1
+
+    @staticmethod
+    def summary(samples, statuses, elapsed, queries):
+        count = len(samples)
+        errors = sum(n for status, n in statuses.items() if status == "error" or status >= 500)
+        return {
+            "requests": count,
+            "throughput_per_s": count / elapsed if elapsed else None,
+            "p50_ms": percentile(samples, 50),
+            "p95_ms": percentile(samples, 95),
+            "p99_ms": percentile(samples, 99),
+            "mean_ms": statistics.fmean(samples) if samples else None,
+            "errors": errors,
+            "statuses": {str(status): n for status, n in sorted(statuses.items(), key=lambda item: str(item[0]))},
+            "queries_per_request": queries / count if queries is not None and count else None,
+        }
+
+    def report(self, elapsed, count_queries):
+        operations = {
+            op: self.summary(samples, self.statuses[op], elapsed, self.queries.get(op, 0) if count_queries else None)
+            for op, samples in sorted(self.latencies.items())
+        }
+        all_samples = [ms for samples in self.latencies.values() for ms in samples]
+        all_statuses = {}
+        for counts in self.statuses.values():
+            for status, n in counts.items():
+                all_statuses[status] = all_statuses.get(status, 0) + n
+        total = self.summary(all_samples, all_statuses, elapsed, sum(self.queries.values()) if count_queries else None)
+        return operations, total
+
+
+async def worker(client, pools, weights, rng, deadline, recorder, warmup_until):
+    names = list(weights)
+    population = [weights[name] for name in names]
+    while time.perf_counter() < deadline:
+        operation = rng.choices(names, population)[0]
+        method, path, kwargs = OPERATIONS[operation](rng, pools)
+        measuring = time.perf_counter() >= warmup_until
+        token = current_operation.set(operation if measuring else None)
+        started = time.perf_counter()
+        try:
+            status = (await client.request(method, path, **kwargs)).status_code
+        except httpx.HTTPError:
+            status = "error"
+        finally:
+            current_operation.reset(token)
+        if measuring:
+            recorder.record(operation, status, (time.perf_counter() - started) * 1000)
+
+
+async def load_pools():
+    engine = make_async_engine()
+    try:
+        async with engine.connect() as conn:
+            rows = {name: (await conn.execute(text(query))).all() for name, query in POOLS_QUERIES.items()}
+            dataset = dict((await conn.execute(text(DATASET_QUERY))).mappings().one())
+    finally:
+        await engine.dispose()
+    return Pools(rows), dataset
+
+
+async def run(args):
+    pools, dataset = await load_pools()
+    recorder = Recorder()
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        app = None
+    else:
+        # main.py mounts static/ and frontend/ relative to the working directory
+        os.chdir(ROOT)
+        import database
+        import main as app_module
+        app = app_module.app
+        event.listen(database.async_engine.sync_engine, "before_cursor_execute", recorder.count_query)
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        # Measure the steady state, with the in-memory indexes loaded
+        await app_module.startup_state["indexes"]
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://load-test", timeout=args.timeout
+        )
+
+    weights = WORKLOADS[args.workload]
+    started = time.perf_counter()
+    warmup_until = started + args.warmup
+    deadline = warmup_until + args.duration
+    try:
+        async with client:
+            await asyncio.gather(*(
+                worker(client, pools, weights, random.Random(f"{args.seed}-{i}"), deadline, recorder, warmup_until)
+                for i in range(args.concurrency)
+            ))
+    finally:
+        if app is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    operations, total = recorder.report(args.duration, count_queries=app is not None)
+    return {
+        "workload": args.workload,
+        "mode": "http" if args.url else "in-process",
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "warmup_s": args.warmup,
+        "seed": args.seed,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "dataset": dataset,
+        "operations": operations,
+        "total": total,
+    }
+
+
+def print_report(result):
+    print(f"{result['workload']} workload, {result['mode']}, {result['concurrency']} workers, {result['duration_s']} s")
+    rows = list(result["operations"].items()) + [("total", result["total"])]
+    for name, stats in rows:
+        queries = stats["queries_per_request"]
+        print(
+            f"{name:>16}: {stats['requests']:>7} req {stats['throughput_per_s']:8.1f}/s  "
+            f"p50 {stats['p50_ms']:7.1f}  p95 {stats['p95_ms']:7.1f}  p99 {stats['p99_ms']:7.1f} ms  "
+            f"errors {stats['errors']}" + (f"  {queries:.1f} queries/req" if queries is not None else "")
+        )
+
+
+def compare(result, baseline, tolerance, min_requests=20):
+    """Print p95 and throughput changes against ``baseline``; return the regressed operations."""
+    regressed = []
+    for name, stats in result["operations"].items():
+        before = baseline.get("operations", {}).get(name)
+        if not before or before["requests"] < min_requests or stats["requests"] < min_requests:
+            continue
+        p95_change = stats["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        throughput_change = (
+            stats["throughput_per_s"] / before["throughput_per_s"] - 1 if before["throughput_per_s"] else 0.0
+        )
+        flag = "REGRESSED" if p95_change > tolerance else ""
+        print(f"{name:>16}: p95 {p95_change:+7.1%}  throughput {throughput_change:+7.1%}  {flag}")
+        if flag:
+            regressed.append(name)
+    return regressed
+
+
+def main(args):
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--url", help="base URL of a running server; the app runs in-process if omitted")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent workers")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout in seconds")
+    parser.add_argument("--seed", default="0", help="seed for the request mix and parameters")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 increase before failing")
+    main(parser.parse_args())
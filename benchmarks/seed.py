@@ -0,0 +1,250 @@
+"""Generate a large synthetic hotel dataset for load testing.
+
+Replaces every row in the "hotel chains" schema with chains, hotels, rooms,
+employees and customers plus bookings and rentings covering the past
+``--days-back`` and next ``--days-ahead`` days. Demand is skewed: a few chains
+own most hotels, some cities and hotels are far busier than others, summer and
+December fill up faster, and a minority of customers make most stays. The
+same ``--seed`` always produces the same data.
+
+Stays are generated per room in weekly blocks with at most one stay per
+block, so they never overlap. Finished stays become checked-out rentings,
+stays in progress become active rentings, and future stays become bookings.
+
+    python benchmarks/seed.py --replace --hotels 1000 --rooms-per-hotel 40
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+from database import make_sync_engine
+
+CITIES = [
+    "Ottawa", "Toronto", "Montreal", "Vancouver", "Calgary", "Edmonton", "Quebec City", "Winnipeg",
+    "Halifax", "Victoria", "New York", "Boston", "Chicago", "Seattle", "Miami", "Denver", "Austin",
+    "San Diego", "Portland", "Nashville", "London", "Paris", "Berlin", "Madrid", "Rome", "Lisbon",
+    "Dublin", "Vienna", "Prague", "Athens",
+]
+STREETS = ["Main St", "King St", "Queen St", "Elgin St", "Bank St", "Park Ave", "Lake Rd", "Harbour Way", "Hill Cres", "Market Sq"]
+AMENITIES = ["WiFi", "TV", "Minibar", "Air conditioning", "Kitchenette", "Safe", "Balcony", "Coffee maker"]
+PROBLEMS = ["broken lamp", "stained curtains", "noisy fridge", "leaky faucet"]
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn"]
+LAST_NAMES = ["Smith", "Tremblay", "Martin", "Roy", "Wilson", "Lee", "Brown", "Gagnon", "Taylor", "Singh"]
+
+EMPLOYEES_PER_HOTEL = 4
+
+STEPS = [
+    ("clear tables", [
+        'TRUNCATE "hotel chains".rentings, "hotel chains".bookings, "hotel chains".employees, '
+        '"hotel chains".rooms, "hotel chains".hotels, "hotel chains".hotelchains, '
+        '"hotel chains".customers RESTART IDENTITY CASCADE',
+    ]),
+    ("chains", [
+        """
+        INSERT INTO "hotel chains".hotelchains (chainid, cname, num_of_hotels, caddress, rating, cemail, cphone)
+        SELECT i, 'Chain ' || i, 0, i || ' Corporate Way', 1 + i % 5, 'chain' || i || '@example.com', lpad(i::text, 7, '0')
+        FROM generate_series(1, :chains) i
+        """,
+    ]),
+    ("hotels", [
+        # Squaring a uniform draw skews towards low ids: the first chains and
+        # cities get most of the hotels
+        """
+        INSERT INTO "hotel chains".hotels (hotelid, chainid, haddress, hname, num_of_rooms, hemail, hphone)
+        SELECT i,
+               1 + floor(power(random(), 2) * :chains)::int,
+               (1 + floor(random() * 9999)::int) || ' '
+                   || (CAST(:streets AS text[]))[1 + floor(random() * cardinality(CAST(:streets AS text[])))::int] || ', '
+                   || (CAST(:cities AS text[]))[1 + floor(power(random(), 2) * cardinality(CAST(:cities AS text[])))::int],
+               'Hotel ' || i,
+               1 + floor(random() * 5)::int,
+               'hotel' || i || '@example.com',
+               lpad((1000000 + i)::text, 7, '0')
+        FROM generate_series(1, :hotels) i
+        """,
+        """
+        UPDATE "hotel chains".hotelchains hc
+        SET num_of_hotels = counts.n
+        FROM (SELECT chainid, count(*) AS n FROM "hotel chains".hotels GROUP BY chainid) counts
+        WHERE hc.chainid = counts.chainid
+        """,
+    ]),
+    ("rooms", [
+        """
+        INSERT INTO "hotel chains".rooms (roomid, hotelid, price, view, amenities, problems, extendable, capacity)
+        SELECT (h - 1) * :rooms_per_hotel + k,
+               h,
+               round((60 + random() * 340)::numeric, 2),
+               (ARRAY['sea', 'mountain', 'city', 'garden'])[1 + floor(random() * 4)::int],
+               (CAST(:amenities AS text[]))[1:1 + floor(random() * cardinality(CAST(:amenities AS text[])))::int],
+               CASE WHEN random() < 0.1
+                    THEN ARRAY[(CAST(:problems AS text[]))[1 + floor(random() * cardinality(CAST(:problems AS text[])))::int]]
+                    ELSE ARRAY[]::text[] END,
+               random() < 0.3,
+               1 + floor(power(random(), 1.5) * 4)::int
+        FROM generate_series(1, :hotels) h, generate_series(1, :rooms_per_hotel) k
+        """,
+    ]),
+    ("employees", [
+        """
+        INSERT INTO "hotel chains".employees (employeeid, efirstname, elastname, ssnsin, eaddress, hotelid, erole)
+        SELECT (h - 1) * :employees_per_hotel + j,
+               (CAST(:first_names AS text[]))[1 + floor(random() * cardinality(CAST(:first_names AS text[])))::int],
+               (CAST(:last_names AS text[]))[1 + floor(random() * cardinality(CAST(:last_names AS text[])))::int],
+               100000000 + (h - 1) * :employees_per_hotel + j,
+               j || ' Staff Rd',
+               h,
+               CASE WHEN j = 1 THEN 'Manager' ELSE 'Clerk' END
+        FROM generate_series(1, :hotels) h, generate_series(1, :employees_per_hotel) j
+        """,
+        """
+        UPDATE "hotel chains".hotels SET managerid = (hotelid - 1) * :employees_per_hotel + 1
+        """,
+    ]),
+    ("customers", [
+        """
+        INSERT INTO "hotel chains".customers (customerid, firstname, lastname, address, dateofregistration)
+        SELECT i,
+               (CAST(:first_names AS text[]))[1 + floor(random() * cardinality(CAST(:first_names AS text[])))::int],
+               (CAST(:last_names AS text[]))[1 + floor(random() * cardinality(CAST(:last_names AS text[])))::int],
+               (1 + floor(random() * 9999)::int) || ' Customer Ave',
+               CURRENT_DATE - :days_back - floor(random() * 1000)::int
+        FROM generate_series(1, :customers) i
+        """,
+    ]),
+    ("stays", [
+        """
+        CREATE TEMP TABLE seed_demand AS
+        SELECT hotelid, power(random(), 2) AS popularity FROM "hotel chains".hotels
+        """,
+        # Weekly blocks never share a day, and a stay starts in the first three
+        # days of its block and lasts at most four nights
+        """
+        CREATE TEMP TABLE seed_stays AS
+        SELECT roomid, hotelid, startdate, startdate + nights - 1 AS enddate,
+               1 + floor(power(random(), 2) * :customers)::int AS customerid,
+               (hotelid - 1) * :employees_per_hotel + 2 + floor(random() * (:employees_per_hotel - 1))::int AS employeeid,
+               random() < 0.7 AS booked_first,
+               random() < 0.05 AS cancelled
+        FROM (
+            SELECT r.roomid, r.hotelid,
+                   CAST(b.block_start AS date) + floor(random() * 3)::int AS startdate,
+                   1 + floor(random() * 4)::int AS nights,
+                   random() AS roll,
+                   :occupancy * (0.4 + 1.2 * d.popularity)
+                       * CASE WHEN extract(month FROM b.block_start) IN (6, 7, 8, 12) THEN 1.25 ELSE 1 END AS demand
+            FROM "hotel chains".rooms r
+            JOIN seed_demand d ON d.hotelid = r.hotelid
+            CROSS JOIN generate_series(CURRENT_DATE - :days_back, CURRENT_DATE + :days_ahead, interval '7 days') AS b(block_start)
+        ) s
+        WHERE roll < demand
+        """,
+    ]),
+    ("bookings", [
+        """
+        INSERT INTO "hotel chains".bookings (roomid, hotelid, customerid, startdate, enddate, status)
+        SELECT roomid, hotelid, customerid, startdate, enddate,
+               CASE WHEN startdate <= CURRENT_DATE THEN 'CheckedIn'
+                    WHEN cancelled THEN 'Cancelled'
+                    ELSE 'Booked' END
+        FROM seed_stays
+        WHERE startdate > CURRENT_DATE OR booked_first
+        ORDER BY startdate
+        """,
+    ]),
+    ("rentings", [
+        """
+        INSERT INTO "hotel chains".rentings (roomid, hotelid, customerid, employeeid, startdate, enddate, status)
+        SELECT roomid, hotelid, customerid, employeeid, startdate, enddate,
+               CASE WHEN enddate < CURRENT_DATE THEN 'CheckedOut' ELSE 'Active' END
+        FROM seed_stays
+        WHERE startdate <= CURRENT_DATE
+        ORDER BY startdate
+        """,
+    ]),
+    ("sequences", [
+        """SELECT setval('"hotel chains".chain_id_seq', :chains)""",
+        """SELECT setval('"hotel chains".hotel_id_seq', :hotels)""",
+        """SELECT setval('"hotel chains".employee_id_seq', :hotels * :employees_per_hotel)""",
+        """SELECT setval('"hotel chains".customer_id_seq', :customers)""",
+    ]),
+]
+
+SUMMARY = """
+SELECT (SELECT count(*) FROM "hotel chains".hotels) AS hotels,
+       (SELECT count(*) FROM "hotel chains".rooms) AS rooms,
+       (SELECT count(*) FROM "hotel chains".customers) AS customers,
+       (SELECT count(*) FROM "hotel chains".bookings) AS bookings,
+       (SELECT count(*) FROM "hotel chains".rentings) AS rentings,
+       (SELECT sum(enddate - startdate + 1) FROM seed_stays) AS room_nights
+"""
+
+
+def main(args):
+    params = {
+        "chains": args.chains,
+        "hotels": args.hotels,
+        "rooms_per_hotel": args.rooms_per_hotel,
+        "employees_per_hotel": EMPLOYEES_PER_HOTEL,
+        "customers": args.customers,
+        "days_back": args.days_back,
+        "days_ahead": args.days_ahead,
+        "occupancy": args.occupancy,
+        "cities": CITIES,
+        "streets": STREETS,
+        "amenities": AMENITIES,
+        "problems": PROBLEMS,
+        "first_names": FIRST_NAMES,
+        "last_names": LAST_NAMES,
+    }
+    engine = make_sync_engine()
+    with engine.begin() as conn:
+        existing = conn.execute(text('SELECT count(*) FROM "hotel chains".rooms')).scalar()
+        if existing and not args.replace:
+            sys.exit(f"The database already has {existing} rooms; pass --replace to overwrite all hotel data")
+
+        # Bulk steps run far past the API's statement timeout
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        # Seeds random() for the rest of this session
+        conn.execute(text("SELECT setseed(:seed)"), {"seed": args.seed})
+        # Partitioned stays (migrations/008) need partitions for the whole range
+        if conn.execute(text("""SELECT to_regproc('"hotel chains".create_stay_partitions')""")).scalar():
+            for table in ("bookings", "rentings"):
+                conn.execute(
+                    text("""SELECT "hotel chains".create_stay_partitions(:table, CURRENT_DATE - :days_back, CURRENT_DATE + :days_ahead + 7)"""),
+                    {"table": table, "days_back": args.days_back, "days_ahead": args.days_ahead}
+                )
+        for name, statements in STEPS:
+            started = time.perf_counter()
+            for statement in statements:
+                conn.execute(text(statement), params)
+            print(f"{name:>12}: {time.perf_counter() - started:6.1f} s")
+
+        summary = conn.execute(text(SUMMARY)).mappings().one()
+        if conn.execute(text("""SELECT to_regproc('"hotel chains".refresh_room_summaries')""")).scalar():
+            conn.execute(text('SELECT "hotel chains".refresh_room_summaries()'))
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text('ANALYZE "hotel chains".rooms, "hotel chains".hotels, "hotel chains".bookings, "hotel chains".rentings'))
+    engine.dispose()
+
+    print(", ".join(f"{key} {value}" for key, value in summary.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replace", action="store_true", help="delete the existing hotel data first")
+    parser.add_argument("--seed", type=float, default=0.42, help="random seed between -1 and 1")
+    parser.add_argument("--chains", type=int, default=25)
+    parser.add_argument("--hotels", type=int, default=1000)
+    parser.add_argument("--rooms-per-hotel", type=int, default=40)
+    parser.add_argument("--customers", type=int, default=100000)
+    parser.add_argument("--days-back", type=int, default=180, help="days of finished stays")
+    parser.add_argument("--days-ahead", type=int, default=365, help="days of future bookings")
+    parser.add_argument("--occupancy", type=float, default=0.6, help="average share of weekly blocks with a stay")
+    main(parser.parse_args())
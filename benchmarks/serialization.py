@@ -0,0 +1,106 @@
+"""Micro-benchmark of response encoding for large room search results.
+
+Builds synthetic SQLAlchemy rows shaped like an /api/available-rooms result and
+encodes them two ways: the old handler path (copy each row into a dict field
+by field, then ``jsonable_encoder`` and ``json.dumps``) and ``RowEncoder``.
+Reports total time and time per row. No database is needed.
+
+    python benchmarks/serialization.py --rows 10000 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.engine.result import result_tuple
+
+from serialization import RowEncoder
+
+COLUMNS = [
+    "roomid", "hotelid", "price", "capacity", "view", "amenities", "problems", "extendable",
+    "hotel_address", "hotel_email", "hotel_phone", "hotel_category", "chain_name", "chain_email",
+    "chain_phone", "is_available",
+]
+
+
+def make_rows(count):
+    make_row = result_tuple(COLUMNS)
+    return [
+        make_row((
+            i, i // 50, Decimal(f"{100 + i % 400}.00"), 1 + i % 4, "sea" if i % 2 else "mountain",
+            "wifi, tv, minibar", None, bool(i % 3), f"{i % 997} Main St", "hotel@example.com",
+            "555-0100", 3 + i % 3, "Example Chain", "chain@example.com", "555-0199", True,
+        ))
+        for i in range(count)
+    ]
+
+
+def encode_per_row_dicts(rows):
+    formatted = []
+    for row in rows:
+        formatted.append({
+            "roomid": row.roomid,
+            "hotelid": row.hotelid,
+            "price": float(row.price) if row.price else None,
+            "capacity": row.capacity,
+            "view": row.view,
+            "amenities": row.amenities,
+            "problems": row.problems,
+            "extendable": row.extendable,
+            "hotel_address": row.hotel_address,
+            "hotel_email": row.hotel_email,
+            "hotel_phone": row.hotel_phone,
+            "hotel_category": row.hotel_category,
+            "chain_name": row.chain_name,
+            "chain_email": row.chain_email,
+            "chain_phone": row.chain_phone,
+            "is_available": True,
+        })
+    return json.dumps(jsonable_encoder(formatted)).encode()
+
+
+def encode_row_encoder(rows):
+    return RowEncoder(COLUMNS).encode(rows)
+
+
+def measure(encode, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode(rows)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(body)
+
+
+def main(args):
+    results = []
+    for count in args.rows:
+        rows = make_rows(count)
+        for name, encode in (("per_row_dicts", encode_per_row_dicts), ("row_encoder", encode_row_encoder)):
+            seconds, size = measure(encode, rows, args.repeat)
+            results.append({
+                "strategy": name,
+                "rows": count,
+                "seconds": seconds,
+                "us_per_row": seconds / count * 1e6,
+                "bytes": size,
+            })
+            print(f"{name:>13}: {count:>7} rows in {seconds * 1000:8.1f} ms, {seconds / count * 1e6:6.2f} us/row")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"repeat": args.repeat, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="result sizes to encode")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size; the fastest is reported")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    main(parser.parse_args())
@@ -0,0 +1,134 @@
+"""Size-bounded LRU cache with per-key TTL for rarely changing API reads.
+
+Entries hold the encoded response body and its ETag, so a hit costs neither a
+query nor a re-encode, and clients revalidating with If-None-Match get a 304.
+Keys are tuples whose first element is a namespace (for example
+``("hotels", chain_id)``); write handlers invalidate whole namespaces.
+
+A read that started before an invalidation must not store its (possibly
+stale) result afterwards, so callers take a ``version`` token before querying
+and pass it back to ``set``.
+
+``SingleFlight`` covers reads that are too varied to cache: concurrent callers
+with the same key share one in-flight call instead of each running it.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "expires_at", "headers")
+
+    def __init__(self, body, etag, expires_at, headers=None):
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+        self.headers = headers or {}
+
+
+def make_etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+class TTLCache:
+    def __init__(self, maxsize=256, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def version(self, key):
+        with self._lock:
+            return (self._epoch, self._versions.get(key[0], 0))
+
+    def set(self, key, body, ttl=None, version=None, headers=None):
+        entry = CacheEntry(body, make_etag(body), self._clock() + (self.ttl if ttl is None else ttl), headers)
+        with self._lock:
+            if version is not None and version != (self._epoch, self._versions.get(key[0], 0)):
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, *namespaces):
+        """Drop every key in the given namespaces, or everything if none are given."""
+        with self._lock:
+            if not namespaces:
+                self._epoch += 1
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                for namespace in namespaces:
+                    self._versions[namespace] = self._versions.get(namespace, 0) + 1
+                stale = [key for key in self._entries if key[0] in namespaces]
+                for key in stale:
+                    del self._entries[key]
+                dropped = len(stale)
+            self.invalidations += dropped
+            return dropped
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class SingleFlight:
+    """Concurrent ``do`` calls with the same key share one in-flight call.
+
+    The call runs as its own task, so a caller that goes away (a client
+    disconnecting) does not cancel it for the others; ``func`` should therefore
+    not depend on the caller's request-scoped resources.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key, func):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.executed += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "executed": self.executed, "shared": self.shared}
@@ -0,0 +1,106 @@
+"""Database engines and session factories.
+
+The API runs on SQLAlchemy's asyncio engine over asyncpg. A synchronous
+psycopg2 engine with the same settings is kept for command-line tools; it is
+only created when ``engine`` or ``SessionLocal`` is first used. Both set the
+search path and statement timeout as connection startup parameters, so
+requests never spend a round trip on ``SET search_path``. Neither engine
+connects before its first query.
+"""
+import os
+
+import asyncpg
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+load_dotenv()
+
+SEARCH_PATH = '"hotel chains", public'
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL environment variable is not set")
+
+# Optional read replicas for read-only endpoints (see replicas.py), comma-separated
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# Pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+
+def _driver_url(url, driver):
+    return make_url(url).set(drivername=f"postgresql+{driver}")
+
+
+def _server_settings():
+    return {
+        "search_path": SEARCH_PATH,
+        "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+    }
+
+
+def _pool_options():
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def make_async_engine(url=DATABASE_URL):
+    return create_async_engine(
+        _driver_url(url, "asyncpg"),
+        connect_args={"server_settings": _server_settings()},
+        **_pool_options(),
+    )
+
+
+def raw_connect(url=DATABASE_URL):
+    """A plain asyncpg connection outside the pools, for LISTEN (see notifications.py)."""
+    dsn = make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+    return asyncpg.connect(dsn, server_settings=_server_settings())
+
+
+def _libpq_options(settings):
+    # libpq splits options on whitespace, so spaces inside values are escaped
+    return " ".join(
+        "-c {}={}".format(name, value.replace(" ", "\\ ")) for name, value in settings.items()
+    )
+
+
+def make_sync_engine(url=DATABASE_URL):
+    return create_engine(
+        _driver_url(url, "psycopg2"),
+        connect_args={"options": _libpq_options(_server_settings())},
+        **_pool_options(),
+    )
+
+
+async_engine = make_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+replica_engines = [make_async_engine(url) for url in DATABASE_REPLICA_URLS]
+
+_sync = {}
+
+
+def __getattr__(name):
+    # Imported as module attributes, created on first access
+    if name == "engine":
+        if "engine" not in _sync:
+            _sync["engine"] = make_sync_engine()
+        return _sync["engine"]
+    if name == "SessionLocal":
+        if "SessionLocal" not in _sync:
+            _sync["SessionLocal"] = sessionmaker(autocommit=False, autoflush=False, bind=__getattr__("engine"))
+        return _sync["SessionLocal"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,182 @@
+"""Live availability updates for open searches, behind /sse/availability.
+
+A client subscribes with its search (dates, area, chain, capacity, price) and
+gets a ``taken`` event when a booking or renting takes a matching room on
+overlapping dates, and a ``freed`` event when one gives a room back. Events
+come from ``apply_changes`` in main.py, so writes through other workers are
+included (see notifications.py).
+
+Subscriptions are indexed by hotel and week: one whose area or chain filter
+matches some hotels is filed under each of those hotels for every week of its
+dates, and one without such a filter is filed under ``None``. An event looks
+up the keys of its stay's hotel and weeks, so its cost depends on the
+subscriptions that could match rather than on every open connection.
+
+A ``freed`` event carries the room as search results show it. It only goes
+to subscribers for whose dates nothing else still holds the room: the
+availability index answers that when it covers their dates, otherwise one
+query per event fetches the room's remaining stays.
+
+Each subscription has a bounded queue. A client that falls that far behind is
+sent ``reset`` and should search again.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from availability import MAX_STAY_NIGHTS, ROOMS_QUERY, room_fits, room_to_dict
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Stays that still hold a room, as the SQL room search counts them
+HOLDS_QUERY = """
+SELECT startdate, enddate FROM "hotel chains".bookings
+WHERE roomid = :room_id AND status = 'Booked'
+AND startdate BETWEEN :earliest_start AND :end_date AND enddate >= :start_date
+UNION ALL
+SELECT startdate, enddate FROM "hotel chains".rentings
+WHERE roomid = :room_id AND status IS DISTINCT FROM 'CheckedOut'
+AND startdate BETWEEN :earliest_start AND :end_date AND enddate >= :start_date
+"""
+
+feed_events = registry.counter(
+    "availability_feed_events_total", "Events queued for availability subscribers.", ("event",)
+)
+feed_resets = registry.counter(
+    "availability_feed_resets_total", "Subscribers reset after their queue filled up."
+)
+
+
+def weeks(start: date, end: date):
+    """Week numbers from ``start``'s week through ``end``'s."""
+    return range(start.toordinal() // 7, end.toordinal() // 7 + 1)
+
+
+class Subscription:
+    __slots__ = ("start", "end", "capacity", "max_price", "keys", "queue", "overflowed")
+
+    def __init__(self, start, end, capacity, max_price, keys, max_queue):
+        self.start = start
+        self.end = end
+        self.capacity = capacity
+        self.max_price = max_price
+        self.keys = keys
+        self.queue = asyncio.Queue(max_queue)
+        self.overflowed = False
+
+    def wants(self, room, start, end):
+        if start > self.end or end < self.start:
+            return False
+        return room_fits(room, self.capacity, self.max_price)
+
+    def put(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            feed_resets.inc()
+
+
+class AvailabilityFeed:
+    """Subscriptions to room availability changes; used from the event loop only."""
+
+    def __init__(self, availability, session_factory, max_queue=100):
+        self.availability = availability
+        self.session_factory = session_factory
+        self.max_queue = max_queue
+        self._rooms = {}
+        self._hotels = {}
+        self._index = defaultdict(set)
+        self.subscribers = 0
+        self.ready = False
+
+    async def load(self, db):
+        """(Re)load the rooms and hotels that subscriptions and events are matched against."""
+        rooms, hotels = {}, {}
+        for row in await db.execute(text(ROOMS_QUERY)):
+            room = rooms[row.roomid] = room_to_dict(row)
+            hotels[row.hotelid] = ((room["hotel_address"] or "").lower(), (room["chain_name"] or "").lower())
+        self._rooms = rooms
+        self._hotels = hotels
+        self.ready = True
+
+    def subscribe(self, start: date, end: date, area=None, hotel_chain=None, capacity=None, max_price=None):
+        """A new subscription; its queue yields ``(event, data)`` pairs."""
+        hotels = [None]
+        if area or hotel_chain:
+            area = area.lower() if area else None
+            hotel_chain = hotel_chain.lower() if hotel_chain else None
+            hotels = [
+                hotel_id for hotel_id, (address, chain) in self._hotels.items()
+                if (not area or area in address) and (not hotel_chain or hotel_chain in chain)
+            ]
+        keys = [(hotel_id, week) for hotel_id in hotels for week in weeks(start, end)]
+        subscription = Subscription(start, end, capacity, max_price, keys, self.max_queue)
+        for key in keys:
+            self._index[key].add(subscription)
+        self.subscribers += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for key in subscription.keys:
+            subscribers = self._index.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._index[key]
+        self.subscribers -= 1
+
+    async def publish(self, events):
+        """Queue ``("taken" | "freed", room_id, start, end)`` events for matching subscriptions."""
+        if not self._index:
+            return
+        for kind, room_id, start, end in events:
+            room = self._rooms.get(room_id)
+            if room is None:
+                continue
+            matched = set()
+            for week in weeks(start, end):
+                matched.update(self._index.get((room["hotelid"], week), ()))
+                matched.update(self._index.get((None, week), ()))
+            subscriptions = [subscription for subscription in matched if subscription.wants(room, start, end)]
+            data = {"roomid": room_id, "hotelid": room["hotelid"], "startdate": start, "enddate": end}
+            if kind == "freed" and subscriptions:
+                subscriptions = await self._still_free(room_id, subscriptions)
+                data["room"] = room
+            event = (kind, data)
+            for subscription in subscriptions:
+                subscription.put(event)
+            if subscriptions:
+                feed_events.inc((kind,), len(subscriptions))
+
+    async def _still_free(self, room_id, subscriptions):
+        """The subscriptions for whose dates no other stay holds the room."""
+        unknown = [s for s in subscriptions if not self.availability.covers(s.start)]
+        holds = []
+        if unknown:
+            start = min(s.start for s in unknown)
+            end = max(s.end for s in unknown)
+            try:
+                async with self.session_factory() as db:
+                    holds = (await db.execute(text(HOLDS_QUERY), {
+                        "room_id": room_id,
+                        "start_date": start,
+                        "end_date": end,
+                        "earliest_start": start - timedelta(days=MAX_STAY_NIGHTS),
+                    })).all()
+            except SQLAlchemyError as e:
+                logger.error(f"Failed to check room {room_id} for availability subscribers: {str(e)}")
+                unknown = set(unknown)
+                return [s for s in subscriptions if s not in unknown and self.availability.is_free(room_id, s.start, s.end)]
+        return [
+            s for s in subscriptions
+            if (self.availability.is_free(room_id, s.start, s.end) if self.availability.covers(s.start)
+                else not any(hold.startdate <= s.end and hold.enddate >= s.start for hold in holds))
+        ]
@@ -0,0 +1,91 @@
+"""Idempotency-Key support for the create endpoints.
+
+Clients retry POSTs after timeouts; without a key a retry books the room a
+second time or is refused because the first attempt already took it. With a
+key, the first request claims ``(scope, key)`` inside its own transaction and
+stores its response before committing. A retry with the same key and body gets
+the stored response back with an ``Idempotent-Replayed`` header. A concurrent
+retry waits on the claim's row lock until the first request commits or rolls
+back. Only successful responses are stored: a failed request leaves no claim,
+so retrying it runs it again.
+"""
+import hashlib
+import os
+
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from metrics import registry
+from serialization import dumps, json_response
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+MAX_KEY_LENGTH = 255
+
+# Expired keys are taken over in the same statement
+CLAIM_QUERY = """
+INSERT INTO "hotel chains".idempotency_keys (scope, idem_key, request_hash, expires_at)
+VALUES (:scope, :key, :request_hash, now() + make_interval(secs => :ttl))
+ON CONFLICT (scope, idem_key) DO UPDATE
+SET request_hash = EXCLUDED.request_hash, expires_at = EXCLUDED.expires_at, status_code = NULL, response = NULL
+WHERE idempotency_keys.expires_at < now()
+RETURNING idem_key
+"""
+
+STORED_QUERY = """
+SELECT request_hash, status_code, response
+FROM "hotel chains".idempotency_keys
+WHERE scope = :scope AND idem_key = :key
+"""
+
+SAVE_QUERY = """
+UPDATE "hotel chains".idempotency_keys
+SET status_code = :status_code, response = :response
+WHERE scope = :scope AND idem_key = :key
+"""
+
+PURGE_QUERY = 'DELETE FROM "hotel chains".idempotency_keys WHERE expires_at < now()'
+
+idempotent_replays = registry.counter(
+    "idempotent_replays_total", "Create requests answered from a stored Idempotency-Key response.", ("scope",)
+)
+
+
+def request_hash(payload):
+    return hashlib.blake2b(dumps(payload), digest_size=16).digest()
+
+
+async def claim(db, scope, key, payload):
+    """Claim ``key`` for this request, or return the stored response to replay.
+
+    Returns ``None`` when the caller should go ahead; it must then call
+    ``save`` before committing.
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key is limited to {MAX_KEY_LENGTH} characters")
+    digest = request_hash(payload)
+    params = {"scope": scope, "key": key}
+    claimed = await db.execute(text(CLAIM_QUERY), {**params, "request_hash": digest, "ttl": IDEMPOTENCY_TTL_SECONDS})
+    if claimed.first() is not None:
+        return None
+    stored = (await db.execute(text(STORED_QUERY), params)).first()
+    if stored is None or stored.response is None:
+        # The other request's claim expired or rolled back in the meantime
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress; retry")
+    if bytes(stored.request_hash) != digest:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    idempotent_replays.inc((scope,))
+    response = json_response(bytes(stored.response), {"Idempotent-Replayed": "true"})
+    response.status_code = stored.status_code
+    return response
+
+
+async def save(db, scope, key, body, status_code=200):
+    """Store the response for a claimed key, in the caller's transaction."""
+    await db.execute(text(SAVE_QUERY), {
+        "scope": scope, "key": key, "status_code": status_code, "response": dumps(body)
+    })
+
+
+async def purge_expired(db):
+    result = await db.execute(text(PURGE_QUERY))
+    return result.rowcount
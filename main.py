@@ -1,24 +1,73 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import SQLAlchemyError
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from pydantic import BaseModel, validator, Field
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from typing import List, Optional
 import os
+import re
+import asyncio
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
 from dotenv import load_dotenv
 import logging
 
+from admission import AdmissionController, AdmissionMiddleware, parse_route_limits
+from availability import MAX_STAY_NIGHTS, AvailabilityEngine, RoomCalendar, group_stays, normalize_amenity
+from cache import SingleFlight, TTLCache
+from feed import AvailabilityFeed
+from occupancy import OccupancyCube
+from pagination import MAX_PAGE_SIZE, Keyset, paginate, parse_fields
+from serialization import RowEncoder, dumps, json_response
+from suggest import MAX_SUGGESTIONS, SuggestionIndex
+from database import DB_MAX_OVERFLOW, DB_POOL_SIZE, async_engine, AsyncSessionLocal, replica_engines
+from replicas import ReplicaRouter
+import idempotency
+import notifications
+import partitions
+import rollover
+from metrics import MetricsMiddleware, instrument_engine, instrument_sessions, registry
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-app = FastAPI(title="Hotel Chains API")
+@asynccontextmanager
+async def lifespan(app):
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+app = FastAPI(title="Hotel Chains API", lifespan=lifespan)
+
+# Admission control for /api routes (see admission.py): at most
+# ADMISSION_MAX_CONCURRENT requests run at once (0 disables it), by default one
+# per pooled connection, and ADMISSION_ROUTE_LIMITS caps single routes
+# ("route=limit,..."). Up to ADMISSION_QUEUE_SIZE reads and as many writes wait
+# ADMISSION_QUEUE_TIMEOUT_SECONDS for a slot, writes first; the rest get a 503.
+# RATE_LIMIT_PER_SECOND (0 disables it) and RATE_LIMIT_BURST limit each client address.
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+ADMISSION_ROUTE_LIMITS = parse_route_limits(
+    os.getenv("ADMISSION_ROUTE_LIMITS", "/api/available-rooms=16,/api/available-rooms/flexible=4")
+)
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "0"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+admission = AdmissionController(
+    ADMISSION_MAX_CONCURRENT, ADMISSION_ROUTE_LIMITS,
+    queue_size=ADMISSION_QUEUE_SIZE, queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST
+)
+# Added before CORS so that rejections carry CORS headers
+app.add_middleware(AdmissionMiddleware, controller=admission)
 
 # CORS middleware
 app.add_middleware(
@@ -29,6 +78,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency, per-request query counts and the slow-query log (see metrics.py)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(async_engine.sync_engine)
+for replica_engine in replica_engines:
+    instrument_engine(replica_engine.sync_engine)
+instrument_sessions()
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -37,52 +93,421 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 def read_root():
     return FileResponse("static/index.html")
 
-# Database connection
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable is not set")
-
-try:
-    engine = create_engine(DATABASE_URL)
-    with engine.connect() as conn:
-        # Test the connection
-        conn.execute(text("SELECT 1"))
-        logger.info("Database connection test successful")
-        
-        # Set the search path to include our schema
-        conn.execute(text('SET search_path TO "hotel chains", public'))
-        logger.info("Search path set successfully")
-        
-        # Check available schemas
-        result = conn.execute(text("SELECT schema_name FROM information_schema.schemata"))
-        schemas = [row[0] for row in result]
-        logger.info(f"Available schemas: {schemas}")
-        
-        # Check tables in our schema
-        result = conn.execute(text("""
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_schema = 'hotel chains'
-        """))
-        tables = [row[0] for row in result]
-        logger.info(f"Tables in 'hotel chains' schema: {tables}")
-except SQLAlchemyError as e:
-    logger.error(f"Database connection error: {str(e)}")
-    raise
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-def get_db():
-    db = SessionLocal()
+# Startup touches the database only as far as these settings ask: the engines
+# in database.py connect on first use, DB_POOL_WARMUP connections are opened
+# up front, and VERIFY_SCHEMA checks that the tables exist. The in-memory
+# indexes load in the background unless LAZY_INDEX_LOAD is off; until they are
+# ready, searches go to SQL and the analytics and suggestion endpoints answer 503.
+DB_POOL_WARMUP = min(int(os.getenv("DB_POOL_WARMUP", "0")), DB_POOL_SIZE)
+VERIFY_SCHEMA = os.getenv("VERIFY_SCHEMA", "false").lower() in ("1", "true", "yes")
+LAZY_INDEX_LOAD = os.getenv("LAZY_INDEX_LOAD", "true").lower() in ("1", "true", "yes")
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", "2"))
+
+REQUIRED_TABLES = ("hotelchains", "hotels", "rooms", "customers", "employees", "bookings", "rentings")
+
+startup_seconds = registry.gauge(
+    "app_startup_seconds", "Time spent in each startup phase, and in total before serving.", ("phase",)
+)
+startup_state = {"serving": False, "indexes": None}
+
+# Room search backend: "memory" answers from the in-process availability
+# index, "sql" always queries the database.
+AVAILABILITY_BACKEND = os.getenv("AVAILABILITY_BACKEND", "memory").lower()
+availability = AvailabilityEngine()
+
+# Room-by-night occupancy array behind /api/analytics/occupancy; it keeps
+# OCCUPANCY_HISTORY_DAYS of history and is rebuilt every
+# OCCUPANCY_REFRESH_SECONDS (0 disables it) to pick up changes made outside the API
+occupancy = OccupancyCube(history_days=int(os.getenv("OCCUPANCY_HISTORY_DAYS", "730")))
+OCCUPANCY_REFRESH_SECONDS = float(os.getenv("OCCUPANCY_REFRESH_SECONDS", "3600"))
+OCCUPANCY_MAX_DAYS = int(os.getenv("OCCUPANCY_MAX_DAYS", "1096"))
+
+# Typeahead for the area and chain filters, answered from an in-memory trie
+area_suggestions = SuggestionIndex()
+
+# Live updates for open searches over server-sent events (see feed.py). A
+# worker serves at most FEED_MAX_SUBSCRIBERS streams of up to FEED_MAX_DAYS,
+# each queueing FEED_QUEUE_SIZE events; idle streams get a comment every
+# FEED_KEEPALIVE_SECONDS so proxies keep them open.
+FEED_MAX_SUBSCRIBERS = int(os.getenv("FEED_MAX_SUBSCRIBERS", "10000"))
+FEED_MAX_DAYS = int(os.getenv("FEED_MAX_DAYS", "366"))
+FEED_KEEPALIVE_SECONDS = float(os.getenv("FEED_KEEPALIVE_SECONDS", "25"))
+availability_feed = AvailabilityFeed(availability, AsyncSessionLocal, max_queue=int(os.getenv("FEED_QUEUE_SIZE", "100")))
+
+# Hotel chains, hotels and employees rarely change and only through this API,
+# so their list responses are cached and invalidated by the write handlers of
+# every worker (see apply_changes)
+reference_cache = TTLCache(
+    maxsize=int(os.getenv("REFERENCE_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("REFERENCE_CACHE_TTL", "3600"))
+)
+
+def cached_response(request: Request, entry):
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or entry.etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return json_response(entry.body, headers)
+
+# Read-only endpoints read from DATABASE_REPLICA_URLS when set (see
+# replicas.py). A customer's reads stay on the primary for
+# READ_YOUR_WRITES_SECONDS after they write; replicas are checked every
+# REPLICA_CHECK_SECONDS and skipped while down or more than
+# REPLICA_MAX_LAG_SECONDS behind.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "5"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+replicas = ReplicaRouter(
+    AsyncSessionLocal, replica_engines,
+    pin_seconds=READ_YOUR_WRITES_SECONDS, max_lag=REPLICA_MAX_LAG_SECONDS
+)
+
+# Identical searches that arrive while one is running share its query
+search_flights = SingleFlight()
+
+async def fetch_shared(query, params):
+    """All rows of a read-only query, run once for every identical concurrent caller."""
+    async def run():
+        # Runs in its own session: the first caller's request may end first
+        async with replicas.session() as session:
+            return (await session.execute(text(query), params)).all()
+    return await search_flights.do((query, repr(sorted(params.items()))), run)
+
+# Large result sets can be streamed as newline-delimited JSON
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+def wants_ndjson(request: Request, stream: bool):
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def stream_list(rows, encoder):
+    for i in range(0, len(rows), STREAM_BATCH_SIZE):
+        yield encoder.encode_lines(rows[i:i + STREAM_BATCH_SIZE])
+
+async def stream_query(query, params, encoder, limit=None):
+    """Run ``query`` through a server-side cursor and yield NDJSON a batch at a time."""
+    # The request's session is closed before the body is sent, so the stream
+    # holds its own connection until the last row is out
+    sent = 0
     try:
-        # Set search path for this session
-        db.execute(text('SET search_path TO "hotel chains", public'))
-        yield db
-    except SQLAlchemyError as e:
-        logger.error(f"Database session error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        db.close()
+        async with replicas.session() as session:
+            result = await session.stream(text(query), params, execution_options={"yield_per": STREAM_BATCH_SIZE})
+            async for rows in result.partitions():
+                if limit:
+                    rows = rows[:limit - sent]
+                sent += len(rows)
+                yield encoder.encode_lines(rows)
+                if limit and sent >= limit:
+                    break
+    except Exception as e:
+        # Headers are already out, so the client sees a truncated stream
+        logger.error(f"Error while streaming rows: {str(e)}")
+
+# Full rebuild interval for the room summary tables behind /api/views/*
+# (0 disables it; room and hotel writes refresh their own hotels either way)
+ROOM_SUMMARY_REFRESH_SECONDS = float(os.getenv("ROOM_SUMMARY_REFRESH_SECONDS", "900"))
+background_tasks = set()
+
+# How often expired Idempotency-Key responses are deleted (0 disables it;
+# expired keys are reused either way)
+IDEMPOTENCY_PURGE_SECONDS = float(os.getenv("IDEMPOTENCY_PURGE_SECONDS", "3600"))
+
+# How often bookings are checked in and rentings checked out as days roll over
+# (0 disables it), and how many rows each of its transactions takes
+ROLLOVER_INTERVAL_SECONDS = float(os.getenv("ROLLOVER_INTERVAL_SECONDS", "3600"))
+ROLLOVER_BATCH_SIZE = int(os.getenv("ROLLOVER_BATCH_SIZE", "1000"))
+
+# How often partitions are created for the coming PARTITION_MONTHS_AHEAD
+# months of bookings and rentings (0 disables it)
+PARTITION_MAINTENANCE_SECONDS = float(os.getenv("PARTITION_MAINTENANCE_SECONDS", "86400"))
+
+# Largest batch accepted by the bulk booking and renting endpoints
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "1000"))
+
+async def startup():
+    started = time.perf_counter()
+    if DB_POOL_WARMUP > 0:
+        phase_started = time.perf_counter()
+        await warm_pool(DB_POOL_WARMUP)
+        startup_seconds.set(("pool_warmup",), time.perf_counter() - phase_started)
+    if VERIFY_SCHEMA:
+        phase_started = time.perf_counter()
+        await verify_schema()
+        startup_seconds.set(("verify_schema",), time.perf_counter() - phase_started)
+    startup_state["indexes"] = asyncio.create_task(load_indexes())
+    if not LAZY_INDEX_LOAD:
+        await startup_state["indexes"]
+    start_background_tasks()
+    startup_state["serving"] = True
+    startup_seconds.set(("total",), time.perf_counter() - started)
+
+async def shutdown():
+    startup_state["serving"] = False
+    if startup_state["indexes"] is not None:
+        startup_state["indexes"].cancel()
+    await stop_background_tasks()
+    await replicas.dispose()
+    await async_engine.dispose()
+
+async def warm_pool(size):
+    """Open ``size`` pooled connections so the first requests do not pay for connecting."""
+    try:
+        async with AsyncExitStack() as stack:
+            for conn in await asyncio.gather(*(stack.enter_async_context(async_engine.connect()) for _ in range(size))):
+                await conn.execute(text("SELECT 1"))
+        logger.info(f"Opened {size} database connections")
+    except (SQLAlchemyError, OSError) as e:
+        logger.error(f"Failed to warm up the connection pool: {str(e)}")
+
+async def verify_schema():
+    """Fail startup when tables the API needs are missing."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            text("""
+            SELECT name FROM unnest(CAST(:tables AS text[])) AS name
+            WHERE to_regclass(format('"hotel chains".%I', name)) IS NULL
+            """),
+            {"tables": list(REQUIRED_TABLES)}
+        )
+        missing = [row.name for row in result]
+    if missing:
+        raise RuntimeError(f"Tables missing from the 'hotel chains' schema: {', '.join(missing)}")
+    logger.info("Schema verified")
+
+async def load_indexes():
+    started = time.perf_counter()
+    loads = [load_occupancy(), load_area_suggestions(), load_availability_feed()]
+    if AVAILABILITY_BACKEND == "memory":
+        loads.append(load_availability())
+    await asyncio.gather(*loads)
+    startup_seconds.set(("indexes",), time.perf_counter() - started)
+
+async def load_availability():
+    try:
+        async with AsyncSessionLocal() as db:
+            await availability.load(db)
+        logger.info("Availability index loaded")
+    except (SQLAlchemyError, OSError) as e:
+        logger.error(f"Failed to load availability index, using SQL search: {str(e)}")
+
+async def load_occupancy():
+    try:
+        async with AsyncSessionLocal() as db:
+            await occupancy.load(db)
+        logger.info(f"Occupancy array loaded: {occupancy.stats()}")
+    except (SQLAlchemyError, OSError) as e:
+        logger.error(f"Failed to load occupancy array: {str(e)}")
+
+async def load_area_suggestions():
+    try:
+        async with AsyncSessionLocal() as db:
+            await area_suggestions.load(db)
+        logger.info("Area suggestions loaded")
+    except (SQLAlchemyError, OSError) as e:
+        logger.error(f"Failed to load area suggestions: {str(e)}")
+
+async def load_availability_feed():
+    try:
+        async with AsyncSessionLocal() as db:
+            await availability_feed.load(db)
+        logger.info("Availability feed catalogue loaded")
+    except (SQLAlchemyError, OSError) as e:
+        logger.error(f"Failed to load availability feed catalogue: {str(e)}")
+
+def as_date(value):
+    # Dates arrive from other workers as ISO strings
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+async def apply_changes(changes, db=None):
+    """Apply committed changes to this worker's in-memory state.
+
+    Write handlers pass their own changes after committing; the change listener
+    passes those of other workers (see notifications.py). Room and area changes
+    reload from ``db``, or from a session of their own. Rooms taken and freed go
+    to the live availability feed once the whole batch is applied.
+    """
+    events = []
+    async with AsyncExitStack() as stack:
+        for change in changes:
+            kind = change[0]
+            if kind == "occupy":
+                _, entity, entity_id, room_id, start, end = change
+                start, end = as_date(start), as_date(end)
+                availability.occupy(entity, entity_id, room_id, start, end)
+                occupancy.add(room_id, start, end)
+                events.append(("taken", room_id, start, end))
+            elif kind == "release":
+                _, entity, entity_id, room_id, start, end = change
+                availability.release(entity, entity_id, room_id)
+                events.append(("freed", room_id, as_date(start), as_date(end)))
+            elif kind == "cancel":
+                _, booking_id, room_id, start, end = change
+                start, end = as_date(start), as_date(end)
+                availability.release("booking", booking_id, room_id)
+                occupancy.remove(room_id, start, end)
+                events.append(("freed", room_id, start, end))
+            elif kind == "reference":
+                reference_cache.invalidate(*change[1:])
+            elif kind == "pin":
+                replicas.pin(*change[1:])
+            elif kind in ("rooms", "areas"):
+                if db is None:
+                    db = await stack.enter_async_context(AsyncSessionLocal())
+                if kind == "rooms":
+                    await availability.refresh_rooms(db, room_id=change[1], hotel_id=change[2])
+                    await occupancy.refresh_rooms(db)
+                    await availability_feed.load(db)
+                else:
+                    await area_suggestions.load(db)
+    await availability_feed.publish(events)
+
+async def resync():
+    """Rebuild everything after this worker may have missed or failed to apply changes."""
+    reference_cache.invalidate()
+    await load_indexes()
+
+async def apply_committed(changes, db=None):
+    """``apply_changes`` for a write that has already committed.
+
+    The write stands whatever happens here, so a failure is logged and this
+    worker's in-memory state is rebuilt in the background instead of the
+    request failing.
+    """
+    try:
+        await apply_changes(changes, db)
+    except Exception as e:
+        logger.error(f"Failed to apply committed changes, resyncing: {str(e)}", exc_info=True)
+        if not any(task.get_name() == "resync" for task in background_tasks):
+            task = asyncio.create_task(resync(), name="resync")
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
+change_listener = notifications.Listener(apply_changes, resync)
+
+def start_background_tasks():
+    if ROOM_SUMMARY_REFRESH_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(refresh_room_summaries_periodically()))
+    if OCCUPANCY_REFRESH_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(reload_occupancy_periodically()))
+    if IDEMPOTENCY_PURGE_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(purge_idempotency_keys_periodically()))
+    if ROLLOVER_INTERVAL_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(roll_over_periodically()))
+    if PARTITION_MAINTENANCE_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(create_partitions_periodically()))
+    if notifications.CHANGE_NOTIFICATIONS:
+        background_tasks.add(asyncio.create_task(change_listener.run()))
+    if replica_engines and REPLICA_CHECK_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(replicas.check_periodically(REPLICA_CHECK_SECONDS)))
+
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and its event loop answers."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: startup has finished and the database answers within READINESS_TIMEOUT_SECONDS."""
+    pool = async_engine.pool
+    body = {
+        "serving": startup_state["serving"],
+        "database": "ok",
+        "pool": {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow()},
+        "indexes": {
+            "availability": availability.ready,
+            "occupancy": occupancy.ready,
+            "area_suggestions": area_suggestions.ready,
+        },
+        "replicas": replicas.stats()["replicas"],
+        "change_listener": change_listener.connected,
+    }
+    try:
+        async with asyncio.timeout(READINESS_TIMEOUT_SECONDS):
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+    except (SQLAlchemyError, OSError, TimeoutError) as e:
+        body["database"] = str(e) or "timed out"
+    response = json_response(dumps(body))
+    if not (body["serving"] and body["database"] == "ok"):
+        response.status_code = 503
+    return response
+
+async def get_db():
+    # The search path is set once per pooled connection (see database.py)
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except SQLAlchemyError as e:
+            logger.error(f"Database session error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+async def get_read_db():
+    # Read-only endpoints: a replica when one is healthy, else the primary
+    async with replicas.session() as db:
+        try:
+            yield db
+        except SQLAlchemyError as e:
+            logger.error(f"Database session error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+async def get_customer_read_db(customer_id: int):
+    # As get_read_db, but on the primary while the customer's last write is recent
+    async with replicas.session(customer_id) as db:
+        try:
+            yield db
+        except SQLAlchemyError as e:
+            logger.error(f"Database session error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# Booking writes lock each room for the rest of the transaction before checking
+# it for overlaps; partitioned bookings cannot carry an exclusion constraint
+# (see migrations/008_partition_stays.sql). Rooms are locked in id order.
+ROOM_LOCK_QUERY = """
+SELECT pg_advisory_xact_lock(2132, roomid) FROM unnest(CAST(:room_ids AS integer[])) AS roomid
+"""
+
+async def lock_rooms(db, room_ids):
+    await db.execute(text(ROOM_LOCK_QUERY), {"room_ids": sorted(set(room_ids))})
+
+# Postgres SQLSTATE codes of stay writes the database refused: the stay_overlap
+# triggers raise exclusion_violation, and a stay starting outside the monthly
+# partitions (migrations/008_partition_stays.sql) fails a check
+EXCLUSION_VIOLATION = "23P01"
+CHECK_VIOLATION = "23514"
+
+def pg_error_code(e):
+    return getattr(getattr(e, "orig", None), "pgcode", None)
+
+def stay_rejection(e):
+    """The client error for a refused stay write, or ``None`` for other integrity errors."""
+    code = pg_error_code(e)
+    if code == EXCLUSION_VIOLATION:
+        return HTTPException(status_code=409, detail="Room is not available for the selected dates")
+    if code == CHECK_VIOLATION:
+        return HTTPException(
+            status_code=400,
+            detail=f"Stays can start at most {partitions.PARTITION_MONTHS_AHEAD} months ahead"
+        )
+    return None
+
+def earliest_start(start: date):
+    """Earliest start date of a stay that can still be running on ``start``.
+
+    Bounding startdate from below lets Postgres skip the partitions of older stays.
+    """
+    return start - timedelta(days=MAX_STAY_NIGHTS)
+
+def raise_for_outcome(outcome, errors, **values):
+    """Raise the HTTP error a write statement reported in its ``outcome`` column."""
+    if outcome != "ok":
+        status_code, detail = errors[outcome]
+        raise HTTPException(status_code=status_code, detail=detail.format(**values))
 
 # Models
 class RoomSearch(BaseModel):
@@ -139,6 +564,8 @@ class BookingCreate(BaseModel):
             end = datetime.strptime(v, '%Y-%m-%d')
             if end <= start:
                 raise ValueError('End date must be after start date')
+            if (end - start).days > MAX_STAY_NIGHTS:
+                raise ValueError(f'Stays are limited to {MAX_STAY_NIGHTS} nights')
         return v
 
 class RentingCreate(BaseModel):
@@ -164,997 +591,1858 @@ class RentingCreate(BaseModel):
             end = datetime.strptime(v, '%Y-%m-%d')
             if end <= start:
                 raise ValueError('End date must be after start date')
+            if (end - start).days > MAX_STAY_NIGHTS:
+                raise ValueError(f'Stays are limited to {MAX_STAY_NIGHTS} nights')
+        return v
+
+class BulkBookingCreate(BaseModel):
+    items: List[BookingCreate]
+    mode: str = Field("atomic", description="atomic or best_effort")
+
+    @validator('mode')
+    def validate_mode(cls, v):
+        if v not in ('atomic', 'best_effort'):
+            raise ValueError('Mode must be atomic or best_effort')
         return v
 
+    @validator('items')
+    def validate_items(cls, v):
+        if not v:
+            raise ValueError('At least one item is required')
+        if len(v) > BULK_MAX_ITEMS:
+            raise ValueError(f'At most {BULK_MAX_ITEMS} items are allowed per request')
+        return v
+
+class BulkRentingCreate(BulkBookingCreate):
+    items: List[RentingCreate]
+
 @app.get("/api/hotel-chains")
-def get_hotel_chains(db = Depends(get_db)):
+async def get_hotel_chains(request: Request, db = Depends(get_db)):
     try:
-        result = db.execute(text('SELECT * FROM "hotel chains".hotelchains'))
-        rows = []
-        for row in result:
-            row_dict = {
-                "chainid": row.chainid,
-                "cname": row.cname,
-                "num_of_hotels": row.num_of_hotels,
-                "caddress": row.caddress,
-                "cemail": row.cemail,
-                "cphone": row.cphone
-            }
-            rows.append(row_dict)
-        return rows
+        key = ("hotel-chains",)
+        entry = reference_cache.get(key)
+        if entry is not None:
+            return cached_response(request, entry)
+        version = reference_cache.version(key)
+
+        result = await db.execute(text(
+            'SELECT chainid, cname, num_of_hotels, caddress, cemail, cphone FROM "hotel chains".hotelchains'
+        ))
+        body = RowEncoder(result.keys()).encode(result)
+        return cached_response(request, reference_cache.set(key, body, version=version))
     except Exception as e:
         logger.error(f"Error in get_hotel_chains: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+HOTEL_FIELDS = {
+    "hotelid": "h.hotelid",
+    "haddress": "h.haddress",
+    "num_of_rooms": "h.num_of_rooms",
+    "hemail": "h.hemail",
+    "hphone": "h.hphone",
+    "chainid": "h.chainid",
+    "managerid": "h.managerid"
+}
+HOTEL_KEYSET = Keyset(("hotelid", int))
+
 @app.get("/api/hotels")
-def get_hotels(chain_id: Optional[int] = None, db = Depends(get_db)):
+async def get_hotels(
+    request: Request,
+    chain_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    db = Depends(get_db)
+):
     try:
-        query = 'SELECT * FROM "hotel chains".hotels WHERE 1=1'
+        names = parse_fields(fields, HOTEL_FIELDS)
+        key = ("hotels", chain_id, limit, after, tuple(names))
+        entry = reference_cache.get(key)
+        if entry is not None:
+            return cached_response(request, entry)
+        version = reference_cache.version(key)
+
+        query = f'SELECT {HOTEL_KEYSET.select_list(names, HOTEL_FIELDS)} FROM "hotel chains".hotels h WHERE 1=1'
         params = {}
         if chain_id:
-            query += " AND chainid = :chain_id"
+            query += " AND h.chainid = :chain_id"
             params['chain_id'] = chain_id
+        if after:
+            query += f" AND {HOTEL_KEYSET.where(HOTEL_FIELDS)}"
+            params.update(HOTEL_KEYSET.params(after))
+        query += f" ORDER BY {HOTEL_KEYSET.order_by(HOTEL_FIELDS)}"
+        if limit:
+            query += " LIMIT :limit"
+            params["limit"] = limit + 1
         
-        result = db.execute(text(query), params)
-        rows = []
-        for row in result:
-            row_dict = {
-                "hotelid": row.hotelid,
-                "haddress": row.haddress,
-                "num_of_rooms": row.num_of_rooms,
-                "hemail": row.hemail,
-                "hphone": row.hphone,
-                "chainid": row.chainid,
-                "managerid": row.managerid
-            }
-            rows.append(row_dict)
-        return rows
+        result = await db.execute(text(query), params)
+        rows, next_cursor = paginate(result.all(), limit, HOTEL_KEYSET)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return cached_response(request, reference_cache.set(key, RowEncoder(names).encode(rows), version=version, headers=headers))
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Error in get_hotels: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+ROOM_FIELDS = {
+    "roomid": "r.roomid",
+    "hotelid": "r.hotelid",
+    "price": "CAST(NULLIF(r.price, 0) AS double precision)",
+    "capacity": "r.capacity",
+    "view": "r.view",
+    "amenities": "r.amenities",
+    "problems": "r.problems",
+    "extendable": "r.extendable",
+    "hotel_address": "h.haddress",
+    "hotel_email": "h.hemail",
+    "hotel_phone": "h.hphone",
+    "hotel_category": "h.num_of_rooms",
+    "chain_name": "hc.cname",
+    "chain_email": "hc.cemail",
+    "chain_phone": "hc.cphone",
+    "is_available": "true"
+}
+ROOM_KEYSET = Keyset(("roomid", int))
+
+def parse_amenities(amenities: Optional[str], amenities_match: str):
+    """Normalized, de-duplicated amenity names from a comma-separated filter."""
+    if amenities_match not in ("all", "any"):
+        raise HTTPException(status_code=400, detail="amenities_match must be all or any")
+    names = {normalize_amenity(name) for name in amenities.split(",")} if amenities else set()
+    return sorted(names - {""}) or None
+
+def room_search_filters(capacity=None, area=None, hotel_chain=None, max_price=None, amenities=None,
+                        match_any=False, exclude_problems=False):
+    """SQL conditions (each starting with AND) and parameters for the room search filters.
+
+    ``availability.room_filter`` applies the same filters to the in-memory index.
+    """
+    query = ""
+    params = {}
+    if capacity:
+        query += " AND r.capacity >= :capacity"
+        params["capacity"] = capacity
+    if area:
+        query += " AND h.haddress ILIKE :area"
+        params["area"] = f"%{area}%"
+    if hotel_chain:
+        query += " AND hc.cname ILIKE :chain"
+        params["chain"] = f"%{hotel_chain}%"
+    if max_price:
+        # A price of 0 is shown as no price and, as in the in-memory index, never matches
+        query += " AND NULLIF(r.price, 0) <= :max_price"
+        params["max_price"] = max_price
+    if amenities:
+        # Matches the GIN expression index from migrations/005_room_amenity_index.sql
+        operator = "&&" if match_any else "@>"
+        query += f' AND "hotel chains".normalize_amenities(r.amenities) {operator} CAST(:amenities AS text[])'
+        params["amenities"] = amenities
+    if exclude_problems:
+        query += " AND COALESCE(cardinality(r.problems), 0) = 0"
+    return query, params
+
 @app.get("/api/available-rooms")
-def get_available_rooms(
+async def get_available_rooms(
+    request: Request,
     start_date: str,
     end_date: str,
     capacity: Optional[int] = None,
     area: Optional[str] = None,
     hotel_chain: Optional[str] = None,
     max_price: Optional[float] = None,
-    db = Depends(get_db)
+    amenities: Optional[str] = None,
+    amenities_match: str = "all",
+    exclude_problems: bool = False,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    db = Depends(get_read_db)
 ):
     try:
         # Convert string dates to datetime
         start = datetime.strptime(start_date, '%Y-%m-%d').date()
         end = datetime.strptime(end_date, '%Y-%m-%d').date()
+        names = parse_fields(fields, ROOM_FIELDS)
+        cursor = ROOM_KEYSET.params(after) if after else {}
+        wanted = parse_amenities(amenities, amenities_match)
+        match_any = amenities_match == "any"
+        streaming = wants_ndjson(request, stream)
+        encoder = RowEncoder(names)
         
-        # First check if we have any rooms at all
-        room_count = db.execute(text('SELECT COUNT(*) FROM "hotel chains".rooms')).scalar()
-        
-        if room_count == 0:
-            return []
-            
-        # Get all rooms first, then check bookings
-        query = """
-        SELECT r.roomid, 
-               r.hotelid,
-               r.price,
-               r.capacity,
-               r.view,
-               r.amenities,
-               r.problems,
-               r.extendable,
-               h.haddress as address, 
-               h.hemail as hotel_email, 
-               h.hphone as hotel_phone, 
-               h.num_of_rooms,
-               hc.cname as chain_name, 
-               hc.cemail as chain_email, 
-               hc.cphone as chain_phone,
-               b.bookingid
-        FROM "hotel chains".rooms r
-        JOIN "hotel chains".hotels h ON r.hotelid = h.hotelid
-        JOIN "hotel chains".hotelchains hc ON h.chainid = hc.chainid
-        LEFT JOIN "hotel chains".bookings b ON r.roomid = b.roomid
-            AND b.startdate <= :end_date 
-            AND b.enddate >= :start_date
-            AND b.status = 'Booked'
-        WHERE b.bookingid IS NULL
-        """
-        
-        params = {"start_date": start, "end_date": end}
-        
-        # Add filters one by one
-        if capacity:
-            query += " AND r.capacity >= :capacity"
-            params["capacity"] = capacity
-            
-        if area:
-            query += " AND h.haddress ILIKE :area"
-            params["area"] = f"%{area}%"
-            
-        if hotel_chain:
-            query += " AND hc.cname ILIKE :chain"
-            params["chain"] = f"%{hotel_chain}%"
-            
-        if max_price:
-            query += " AND r.price <= :max_price"
-            params["max_price"] = max_price
-            
-        result = db.execute(text(query), params)
-        rooms = list(result)
+        from_index = AVAILABILITY_BACKEND == "memory" and availability.covers(start)
         
-        formatted_rooms = []
-        for row in rooms:
-            room_dict = {
-                "roomid": row.roomid,
-                "hotelid": row.hotelid,
-                "price": float(row.price) if row.price else None,
-                "capacity": row.capacity,
-                "view": row.view,
-                "amenities": row.amenities,
-                "problems": row.problems,
-                "extendable": row.extendable,
-                "hotel_address": row.address,
-                "hotel_email": row.hotel_email,
-                "hotel_phone": row.hotel_phone,
-                "hotel_category": row.num_of_rooms,
-                "chain_name": row.chain_name,
-                "chain_email": row.chain_email,
-                "chain_phone": row.chain_phone,
-                "is_available": True
-            }
-            formatted_rooms.append(room_dict)
+        if from_index:
+            rooms = availability.search(
+                start, end, capacity, area, hotel_chain, max_price,
+                after=cursor.get("cursor_0"), limit=limit + 1 if limit else None,
+                amenities=wanted, match_any=match_any, exclude_problems=exclude_problems
+            )
+        else:
+            query = f"""
+            SELECT {ROOM_KEYSET.select_list(names, ROOM_FIELDS)}
+            FROM "hotel chains".rooms r
+            JOIN "hotel chains".hotels h ON r.hotelid = h.hotelid
+            JOIN "hotel chains".hotelchains hc ON h.chainid = hc.chainid
+            WHERE NOT EXISTS (
+                SELECT 1 FROM "hotel chains".bookings b
+                WHERE b.roomid = r.roomid
+                AND b.startdate BETWEEN :earliest_start AND :end_date
+                AND b.enddate >= :start_date
+                AND b.status = 'Booked'
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM "hotel chains".rentings rt
+                WHERE rt.roomid = r.roomid
+                AND rt.startdate BETWEEN :earliest_start AND :end_date
+                AND rt.enddate >= :start_date
+                AND rt.status IS DISTINCT FROM 'CheckedOut'
+            )
+            """
             
-        return formatted_rooms
+            filters, params = room_search_filters(
+                capacity, area, hotel_chain, max_price, wanted, match_any, exclude_problems
+            )
+            query += filters
+            params.update({"start_date": start, "end_date": end, "earliest_start": earliest_start(start), **cursor})
+
+            if after:
+                query += f" AND {ROOM_KEYSET.where(ROOM_FIELDS)}"
+
+            query += f" ORDER BY {ROOM_KEYSET.order_by(ROOM_FIELDS)}"
+            if limit:
+                query += " LIMIT :limit"
+                params["limit"] = limit + 1
+
+            if streaming:
+                return StreamingResponse(stream_query(query, params, encoder, limit), media_type=NDJSON_MEDIA_TYPE)
+                
+            rooms = await fetch_shared(query, params)
+
+        rooms, next_cursor = paginate(rooms, limit, ROOM_KEYSET)
+        if from_index:
+            rooms = list(encoder.from_mappings(rooms))
+        if streaming:
+            return StreamingResponse(stream_list(rooms, encoder), media_type=NDJSON_MEDIA_TYPE)
+        return json_response(encoder.encode(rooms), {"X-Next-Cursor": next_cursor} if next_cursor else None)
             
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Error in get_available_rooms: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to search rooms: {str(e)}")
 
+@app.get("/sse/availability")
+async def availability_events(
+    request: Request,
+    start_date: str,
+    end_date: str,
+    capacity: Optional[int] = None,
+    area: Optional[str] = None,
+    hotel_chain: Optional[str] = None,
+    max_price: Optional[float] = None
+):
+    """Server-sent ``taken`` and ``freed`` events for rooms matching a search.
+
+    Outside /api, so admission control does not hold a slot for the life of
+    the stream.
+    """
+    try:
+        start = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be given as YYYY-MM-DD")
+    if end < start:
+        raise HTTPException(status_code=400, detail="End date must not be before start date")
+    if (end - start).days > FEED_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Subscriptions are limited to {FEED_MAX_DAYS} days")
+    if not availability_feed.ready:
+        raise HTTPException(status_code=503, detail="Availability feed is loading", headers={"Retry-After": "5"})
+    if availability_feed.subscribers >= FEED_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many availability subscribers", headers={"Retry-After": "30"})
+
+    subscription = availability_feed.subscribe(start, end, area, hotel_chain, capacity, max_price)
+
+    async def events():
+        try:
+            yield ": subscribed\n\n"
+            while True:
+                if subscription.overflowed:
+                    yield "event: reset\ndata: {}\n\n"
+                    return
+                try:
+                    async with asyncio.timeout(FEED_KEEPALIVE_SECONDS):
+                        kind, data = await subscription.queue.get()
+                except TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {kind}\ndata: {dumps(data).decode()}\n\n"
+        finally:
+            availability_feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/areas/suggest")
+def suggest_areas(
+    q: str = Query(..., min_length=1),
+    kind: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS)
+):
+    """Areas and chain names with a word starting with ``q``, for the search filters' typeahead."""
+    if kind not in (None, "area", "chain"):
+        raise HTTPException(status_code=400, detail="Kind must be area or chain")
+    if not area_suggestions.ready:
+        raise HTTPException(status_code=503, detail="Area suggestions are not loaded")
+    return json_response(dumps(area_suggestions.suggest(q, limit, kind)))
+
+# Longest window a flexible-date search may scan
+FLEXIBLE_SEARCH_MAX_DAYS = int(os.getenv("FLEXIBLE_SEARCH_MAX_DAYS", "90"))
+
+# Same rooms and filters as ROOMS_QUERY in availability.py, with each room's
+# occupied intervals inside the window, so the SQL backend can run the same sweep
+FLEXIBLE_ROOMS_QUERY = """
+SELECT r.roomid, r.hotelid, CAST(NULLIF(r.price, 0) AS double precision) as price, r.capacity, r.view,
+       r.amenities, r.problems, r.extendable, h.haddress as hotel_address, hc.cname as chain_name,
+       stays.startdates, stays.enddates
+FROM "hotel chains".rooms r
+JOIN "hotel chains".hotels h ON r.hotelid = h.hotelid
+JOIN "hotel chains".hotelchains hc ON h.chainid = hc.chainid
+CROSS JOIN LATERAL (
+    SELECT array_agg(startdate) as startdates, array_agg(enddate) as enddates
+    FROM (
+        SELECT startdate, enddate FROM "hotel chains".bookings b
+        WHERE b.roomid = r.roomid AND b.status = 'Booked'
+        AND b.startdate BETWEEN :earliest_start AND :window_end AND b.enddate >= :window_start
+        UNION ALL
+        SELECT startdate, enddate FROM "hotel chains".rentings rt
+        WHERE rt.roomid = r.roomid AND rt.status IS DISTINCT FROM 'CheckedOut'
+        AND rt.startdate BETWEEN :earliest_start AND :window_end AND rt.enddate >= :window_start
+    ) occupied
+) stays
+WHERE true
+"""
+FLEXIBLE_ROOM_FIELDS = ("roomid", "price", "capacity", "view", "amenities", "problems", "extendable")
+
+@app.get("/api/available-rooms/flexible")
+async def get_flexible_stays(
+    window_start: str,
+    window_end: str,
+    nights: int = Query(..., ge=1),
+    rooms: int = Query(1, ge=1, le=50),
+    capacity: Optional[int] = None,
+    area: Optional[str] = None,
+    hotel_chain: Optional[str] = None,
+    max_price: Optional[float] = None,
+    amenities: Optional[str] = None,
+    amenities_match: str = "all",
+    exclude_problems: bool = False,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    db = Depends(get_read_db)
+):
+    """Best hotels and dates for ``rooms`` rooms of ``nights`` nights anywhere in the window.
+
+    Each room's free gaps are computed once in a single pass over its stays and
+    the hotels' gaps are swept together (see ``group_stays``), instead of one
+    fixed-date search per candidate start date. Returns the cheapest option per
+    hotel: the rooms, the earliest start date and the latest start date for
+    which the same rooms stay free.
+    """
+    try:
+        first = datetime.strptime(window_start, '%Y-%m-%d').date()
+        window_last = datetime.strptime(window_end, '%Y-%m-%d').date()
+        if (window_last - first).days > FLEXIBLE_SEARCH_MAX_DAYS:
+            raise HTTPException(status_code=400, detail=f"Search window is limited to {FLEXIBLE_SEARCH_MAX_DAYS} days")
+        # Stays must end inside the window
+        last = window_last - timedelta(days=nights)
+        if last < first:
+            raise HTTPException(status_code=400, detail="Window is shorter than the requested stay")
+        wanted = parse_amenities(amenities, amenities_match)
+        match_any = amenities_match == "any"
+
+        if AVAILABILITY_BACKEND == "memory" and availability.covers(first):
+            free = availability.free_starts(
+                first, last, nights, capacity, area, hotel_chain, max_price,
+                amenities=wanted, match_any=match_any, exclude_problems=exclude_problems
+            )
+        else:
+            filters, params = room_search_filters(
+                capacity, area, hotel_chain, max_price, wanted, match_any, exclude_problems
+            )
+            params.update({"window_start": first, "window_end": window_last, "earliest_start": earliest_start(first)})
+            free = []
+            for row in await fetch_shared(FLEXIBLE_ROOMS_QUERY + filters, params):
+                calendar = RoomCalendar()
+                for idx, (start, end) in enumerate(zip(row.startdates or (), row.enddates or ())):
+                    calendar.add(idx, start, end)
+                ranges = calendar.free_starts(first, last, nights)
+                if ranges:
+                    free.append((row._asdict(), ranges))
+
+        stays = []
+        for stay_rooms, first_start, last_start in group_stays(free, rooms, limit):
+            nightly_price = sum(room["price"] or 0 for room in stay_rooms)
+            stays.append({
+                "hotelid": stay_rooms[0]["hotelid"],
+                "hotel_address": stay_rooms[0]["hotel_address"],
+                "chain_name": stay_rooms[0]["chain_name"],
+                "start_date": first_start,
+                "end_date": first_start + timedelta(days=nights),
+                "latest_start_date": last_start,
+                "nights": nights,
+                "nightly_price": nightly_price,
+                "total_price": nightly_price * nights,
+                "rooms": [{field: room[field] for field in FLEXIBLE_ROOM_FIELDS} for room in stay_rooms]
+            })
+        return json_response(dumps(stays))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error in get_flexible_stays: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to search rooms: {str(e)}")
+
+# Write handlers validate and write in a single statement: a "checks" CTE works
+# out the outcome, the data-modifying CTE only runs when it is 'ok', and the
+# outcome is mapped to the API's 404/400/409 errors afterwards.
+# CREATE_BOOKING_QUERY takes the room lock itself. Its checks still see the
+# statement's snapshot from before the lock, so a booking committed while it
+# waited is caught by the overlap trigger from migration 008, which re-checks
+# under the lock and is answered with a 409 like room_taken.
+CREATE_BOOKING_QUERY = """
+WITH room_lock AS (
+    SELECT pg_advisory_xact_lock(2132, CAST(:room_id AS integer))
+), customer AS (
+    SELECT customerid FROM "hotel chains".customers WHERE customerid = :customer_id
+), room AS (
+    SELECT roomid, hotelid FROM "hotel chains".rooms WHERE roomid = :room_id LIMIT 1
+), checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (SELECT 1 FROM customer) THEN 'customer_not_found'
+        WHEN NOT EXISTS (SELECT 1 FROM room) THEN 'room_not_found'
+        WHEN EXISTS (
+            SELECT 1 FROM "hotel chains".bookings
+            WHERE roomid = :room_id AND status = 'Booked'
+            AND startdate BETWEEN :earliest_start AND :end_date AND enddate >= :start_date
+        ) THEN 'room_taken'
+        ELSE 'ok'
+    END AS outcome
+    FROM room_lock
+), inserted AS (
+    INSERT INTO "hotel chains".bookings (bookingid, roomid, hotelid, customerid, startdate, enddate, status)
+    SELECT nextval('"hotel chains".booking_id_seq'), room.roomid, room.hotelid, :customer_id, :start_date, :end_date, 'Booked'
+    FROM room
+    WHERE (SELECT outcome FROM checks) = 'ok'
+    RETURNING bookingid
+)
+SELECT (SELECT outcome FROM checks) AS outcome, (SELECT bookingid FROM inserted) AS bookingid
+"""
+CREATE_BOOKING_ERRORS = {
+    "customer_not_found": (404, "Customer {customer_id} not found"),
+    "room_not_found": (404, "Room {room_id} not found"),
+    "room_taken": (409, "Room is not available for the selected dates"),
+}
+
 @app.post("/api/bookings")
-def create_booking(booking: BookingCreate, db = Depends(get_db)):
+async def create_booking(
+    booking: BookingCreate,
+    idempotency_key: Optional[str] = Header(None),
+    db = Depends(get_db)
+):
     try:
-        # Check if customer exists
-        customer_query = """
-        SELECT customerid FROM "hotel chains".customers 
-        WHERE customerid = :customer_id
-        """
-        result = db.execute(text(customer_query), {"customer_id": booking.customer_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail=f"Customer {booking.customer_id} not found")
-
-        # Check if room exists and get hotel_id
-        hotel_query = """
-        SELECT hotelid FROM "hotel chains".rooms 
-        WHERE roomid = :room_id
-        """
-        result = db.execute(text(hotel_query), {"room_id": booking.room_id})
-        hotel_id = result.scalar()
-        if not hotel_id:
-            raise HTTPException(status_code=404, detail=f"Room {booking.room_id} not found")
-        
-        # Check if room is available
-        availability_query = """
-        SELECT COUNT(*) FROM "hotel chains".bookings 
-        WHERE roomid = :room_id 
-        AND ((startdate <= :end_date AND enddate >= :start_date)
-             OR (startdate >= :start_date AND startdate <= :end_date))
-        AND status = 'Booked'
-        """
-        result = db.execute(text(availability_query), {
-            "room_id": booking.room_id,
-            "start_date": booking.start_date,
-            "end_date": booking.end_date
-        })
-        if result.scalar() > 0:
-            raise HTTPException(status_code=400, detail="Room is not available for the selected dates")
-        
-        # Generate new booking ID
-        booking_id_query = """
-        SELECT COALESCE(MAX(bookingid), 0) + 1 FROM "hotel chains".bookings
-        """
-        result = db.execute(text(booking_id_query))
-        booking_id = result.scalar()
-        
-        # Create booking
-        query = """
-        INSERT INTO "hotel chains".bookings (bookingid, roomid, hotelid, customerid, startdate, enddate, status)
-        VALUES (:booking_id, :room_id, :hotel_id, :customer_id, :start_date, :end_date, 'Booked')
-        RETURNING bookingid
-        """
+        if idempotency_key:
+            replay = await idempotency.claim(db, "bookings", idempotency_key, booking.dict())
+            if replay is not None:
+                return replay
+        start = datetime.strptime(booking.start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(booking.end_date, '%Y-%m-%d').date()
+
+        # The booking ID comes from booking_id_seq and the hotel from the room
         params = {
-            "booking_id": booking_id,
             "room_id": booking.room_id,
-            "hotel_id": hotel_id,
             "customer_id": booking.customer_id,
-            "start_date": booking.start_date,
-            "end_date": booking.end_date
+            "start_date": start,
+            "end_date": end,
+            "earliest_start": earliest_start(start)
         }
-        result = db.execute(text(query), params)
-        new_booking_id = result.scalar()
-        if not new_booking_id:
-            raise HTTPException(status_code=500, detail="Failed to create booking")
-        
-        db.commit()
-        return {"bookingid": new_booking_id}
+        result = (await db.execute(text(CREATE_BOOKING_QUERY), params)).one()
+        raise_for_outcome(result.outcome, CREATE_BOOKING_ERRORS, **params)
+        response = {"bookingid": result.bookingid}
+        if idempotency_key:
+            await idempotency.save(db, "bookings", idempotency_key, response)
+        changes = [
+            ("occupy", "booking", result.bookingid, booking.room_id, start, end),
+            ("pin", booking.customer_id),
+        ]
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
+        return response
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
+    except IntegrityError as e:
+        await db.rollback()
+        rejection = stay_rejection(e)
+        if rejection is not None:
+            raise rejection
+        logger.error(f"Error in create_booking: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create booking: {str(e)}")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in create_booking: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create booking: {str(e)}")
 
+# Checking in a booking is part of the same statement, so the renting and the
+# booking status change commit together. A renting the rollover job created for
+# this stay (no employee yet) is claimed by the desk's check-in rather than
+# counted as a conflict.
+CREATE_RENTING_QUERY = """
+WITH room AS (
+    SELECT roomid, hotelid FROM "hotel chains".rooms WHERE roomid = :room_id LIMIT 1
+), unclaimed AS (
+    SELECT rentingid FROM "hotel chains".rentings
+    WHERE roomid = :room_id AND customerid = :customer_id AND employeeid IS NULL
+    AND startdate = :start_date AND enddate = :end_date
+    AND status IS DISTINCT FROM 'CheckedOut'
+    LIMIT 1
+    FOR UPDATE
+), checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (SELECT 1 FROM room) THEN 'room_not_found'
+        WHEN NOT EXISTS (
+            SELECT 1 FROM "hotel chains".employees WHERE employeeid = :employee_id
+        ) THEN 'employee_not_found'
+        WHEN NOT EXISTS (
+            SELECT 1 FROM "hotel chains".customers WHERE customerid = :customer_id
+        ) THEN 'customer_not_found'
+        WHEN CAST(:booking_id AS integer) IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM "hotel chains".bookings
+            WHERE bookingid = :booking_id AND roomid = :room_id AND customerid = :customer_id
+            AND status <> 'Cancelled'
+            AND startdate BETWEEN :earliest_start AND :end_date AND enddate >= :start_date
+        ) THEN 'booking_mismatch'
+        WHEN EXISTS (
+            SELECT 1 FROM "hotel chains".rentings
+            WHERE roomid = :room_id
+            AND startdate BETWEEN :earliest_start AND :end_date AND enddate >= :start_date
+            AND status IS DISTINCT FROM 'CheckedOut'
+            AND rentingid NOT IN (SELECT rentingid FROM unclaimed)
+        ) THEN 'room_taken'
+        ELSE 'ok'
+    END AS outcome
+), claimed AS (
+    UPDATE "hotel chains".rentings
+    SET employeeid = :employee_id
+    WHERE rentingid = (SELECT rentingid FROM unclaimed) AND (SELECT outcome FROM checks) = 'ok'
+    RETURNING rentingid
+), inserted AS (
+    INSERT INTO "hotel chains".rentings (roomid, hotelid, customerid, employeeid, startdate, enddate)
+    SELECT room.roomid, room.hotelid, :customer_id, :employee_id, :start_date, :end_date
+    FROM room
+    WHERE (SELECT outcome FROM checks) = 'ok' AND NOT EXISTS (SELECT 1 FROM unclaimed)
+    RETURNING rentingid
+), checked_in AS (
+    UPDATE "hotel chains".bookings
+    SET status = 'CheckedIn'
+    WHERE bookingid = :booking_id AND status = 'Booked'
+    AND EXISTS (SELECT 1 FROM inserted UNION ALL SELECT 1 FROM claimed)
+    RETURNING roomid, startdate, enddate
+)
+SELECT (SELECT outcome FROM checks) AS outcome,
+       COALESCE((SELECT rentingid FROM inserted), (SELECT rentingid FROM claimed)) AS rentingid,
+       (SELECT rentingid FROM claimed) IS NOT NULL AS claimed,
+       (SELECT roomid FROM checked_in) AS booked_room,
+       (SELECT startdate FROM checked_in) AS booked_start,
+       (SELECT enddate FROM checked_in) AS booked_end
+"""
+CREATE_RENTING_ERRORS = {
+    "room_not_found": (404, "Room not found"),
+    "employee_not_found": (404, "Employee not found"),
+    "customer_not_found": (404, "Customer {customer_id} not found"),
+    "booking_mismatch": (400, "Booking {booking_id} is not an open booking for this stay"),
+    "room_taken": (409, "Room is not available for the selected dates"),
+}
+
 @app.post("/api/rentings")
-def create_renting(renting: RentingCreate, db = Depends(get_db)):
+async def create_renting(
+    renting: RentingCreate,
+    idempotency_key: Optional[str] = Header(None),
+    db = Depends(get_db)
+):
     try:
-        # Check if room exists and get its hotelid
-        room_query = 'SELECT hotelid FROM "hotel chains".rooms WHERE roomid = :room_id'
-        result = db.execute(text(room_query), {"room_id": renting.room_id})
-        room = result.first()
-        if not room:
-            raise HTTPException(status_code=404, detail="Room not found")
-        
-        # Check if employee exists
-        emp_query = 'SELECT employeeid FROM "hotel chains".employees WHERE employeeid = :employee_id'
-        result = db.execute(text(emp_query), {"employee_id": renting.employee_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail="Employee not found")
-        
-        # Check if room is available for the given dates
-        availability_query = """
-        SELECT COUNT(*) FROM "hotel chains".rentings 
-        WHERE roomid = :room_id 
-        AND ((startdate <= :end_date AND enddate >= :start_date)
-        OR (startdate >= :start_date AND startdate <= :end_date))
-        """
-        result = db.execute(text(availability_query), {
-            "room_id": renting.room_id,
-            "start_date": datetime.strptime(renting.start_date, '%Y-%m-%d').date(),
-            "end_date": datetime.strptime(renting.end_date, '%Y-%m-%d').date()
-        })
-        if result.scalar() > 0:
-            raise HTTPException(status_code=400, detail="Room is not available for the selected dates")
-        
-        # Create the renting
-        query = """
-        INSERT INTO "hotel chains".rentings (roomid, hotelid, customerid, employeeid, startdate, enddate)
-        VALUES (:room_id, :hotel_id, :customer_id, :employee_id, :start_date, :end_date)
-        RETURNING rentingid
-        """
+        if idempotency_key:
+            replay = await idempotency.claim(db, "rentings", idempotency_key, renting.dict())
+            if replay is not None:
+                return replay
+        start = datetime.strptime(renting.start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(renting.end_date, '%Y-%m-%d').date()
         params = {
-            **renting.dict(),
-            "hotel_id": room[0],
-            "start_date": datetime.strptime(renting.start_date, '%Y-%m-%d').date(),
-            "end_date": datetime.strptime(renting.end_date, '%Y-%m-%d').date()
+            "room_id": renting.room_id,
+            "customer_id": renting.customer_id,
+            "employee_id": renting.employee_id,
+            "booking_id": renting.booking_id,
+            "start_date": start,
+            "end_date": end,
+            "earliest_start": earliest_start(start)
         }
-        result = db.execute(text(query), params)
-        db.commit()
-        
-        # If this was from a booking, update the booking status
-        if renting.booking_id:
-            update_query = """
-            UPDATE "hotel chains".bookings 
-            SET status = 'CheckedIn'
-            WHERE bookingid = :booking_id
-            """
-            db.execute(text(update_query), {"booking_id": renting.booking_id})
-            db.commit()
-            
-        return {"rentingid": result.scalar()}
+        result = (await db.execute(text(CREATE_RENTING_QUERY), params)).one()
+        raise_for_outcome(result.outcome, CREATE_RENTING_ERRORS, **params)
+        response = {"rentingid": result.rentingid}
+        if idempotency_key:
+            await idempotency.save(db, "rentings", idempotency_key, response)
+        changes = [("pin", renting.customer_id)]
+        if not result.claimed:
+            # A claimed renting already holds the room
+            changes.append(("occupy", "renting", result.rentingid, renting.room_id, start, end))
+        if result.booked_room is not None:
+            changes.append(
+                ("release", "booking", renting.booking_id, result.booked_room, result.booked_start, result.booked_end)
+            )
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
+        return response
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
+    except IntegrityError as e:
+        await db.rollback()
+        rejection = stay_rejection(e)
+        if rejection is not None:
+            raise rejection
+        logger.error(f"Error in create_renting: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create renting: {str(e)}")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in create_renting: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create renting: {str(e)}")
 
+def parse_stays(items):
+    return [
+        (datetime.strptime(item.start_date, '%Y-%m-%d').date(), datetime.strptime(item.end_date, '%Y-%m-%d').date())
+        for item in items
+    ]
+
+def reject_batch_overlaps(items, stays, results):
+    # Items in the same request may not overlap each other; earlier items win
+    calendars = {}
+    for idx, item in enumerate(items):
+        if results[idx]["status"] != "pending":
+            continue
+        start, end = stays[idx]
+        calendar = calendars.setdefault(item.room_id, RoomCalendar())
+        if not calendar.is_free(start, end):
+            results[idx].update(status="rejected", error="Overlaps another item in this request")
+        else:
+            calendar.add(idx, start, end)
+
+def bulk_outcome(mode, results, kind):
+    rejected = [r for r in results if r["status"] == "rejected"]
+    if mode == "atomic" and rejected:
+        for r in results:
+            if r["status"] != "rejected":
+                r["status"] = "skipped"
+        raise HTTPException(
+            status_code=409,
+            detail={"message": f"No {kind} were created because some items were rejected", "results": results}
+        )
+    return {
+        "mode": mode,
+        "created": sum(1 for r in results if r["status"] == "created"),
+        "rejected": len(rejected),
+        "results": results
+    }
+
+@app.post("/api/bookings/bulk")
+async def create_bookings_bulk(
+    request: BulkBookingCreate,
+    idempotency_key: Optional[str] = Header(None),
+    db = Depends(get_db)
+):
+    try:
+        if idempotency_key:
+            replay = await idempotency.claim(db, "bookings_bulk", idempotency_key, request.dict())
+            if replay is not None:
+                return replay
+        items = request.items
+        stays = parse_stays(items)
+        results = [{"index": idx, "status": "pending"} for idx in range(len(items))]
+
+        # Validate the whole batch against rooms, customers and existing bookings at once,
+        # holding its rooms' locks until the inserts commit
+        await lock_rooms(db, [item.room_id for item in items])
+        check_query = f"""
+        SELECT req.idx,
+               r.hotelid,
+               c.customerid IS NOT NULL as customer_exists,
+               EXISTS (
+                   SELECT 1 FROM "hotel chains".bookings b
+                   WHERE b.roomid = req.roomid
+                   AND b.startdate BETWEEN req.startdate - {MAX_STAY_NIGHTS} AND req.enddate
+                   AND b.enddate >= req.startdate
+                   AND b.status = 'Booked'
+               ) as conflict
+        FROM unnest(CAST(:idx AS integer[]), CAST(:room_ids AS integer[]), CAST(:customer_ids AS integer[]),
+                    CAST(:start_dates AS date[]), CAST(:end_dates AS date[]))
+             AS req(idx, roomid, customerid, startdate, enddate)
+        LEFT JOIN "hotel chains".rooms r ON r.roomid = req.roomid
+        LEFT JOIN "hotel chains".customers c ON c.customerid = req.customerid
+        """
+        result = await db.execute(text(check_query), {
+            "idx": list(range(len(items))),
+            "room_ids": [item.room_id for item in items],
+            "customer_ids": [item.customer_id for item in items],
+            "start_dates": [start for start, _ in stays],
+            "end_dates": [end for _, end in stays]
+        })
+        hotel_ids = {}
+        for row in result:
+            item = items[row.idx]
+            if row.hotelid is None:
+                results[row.idx].update(status="rejected", error=f"Room {item.room_id} not found")
+            elif not row.customer_exists:
+                results[row.idx].update(status="rejected", error=f"Customer {item.customer_id} not found")
+            elif row.conflict:
+                results[row.idx].update(status="rejected", error="Room is not available for the selected dates")
+            else:
+                hotel_ids[row.idx] = row.hotelid
+        reject_batch_overlaps(items, stays, results)
+
+        accepted = [idx for idx in range(len(items)) if results[idx]["status"] == "pending"]
+        if accepted and not (request.mode == "atomic" and len(accepted) < len(items)):
+            # One multi-row insert
+            insert_query = """
+            INSERT INTO "hotel chains".bookings (bookingid, roomid, hotelid, customerid, startdate, enddate, status)
+            SELECT nextval('"hotel chains".booking_id_seq'), req.roomid, req.hotelid, req.customerid,
+                   req.startdate, req.enddate, 'Booked'
+            FROM unnest(CAST(:room_ids AS integer[]), CAST(:hotel_ids AS integer[]), CAST(:customer_ids AS integer[]),
+                        CAST(:start_dates AS date[]), CAST(:end_dates AS date[]))
+                 AS req(roomid, hotelid, customerid, startdate, enddate)
+            RETURNING bookingid, roomid, startdate, enddate
+            """
+            result = await db.execute(text(insert_query), {
+                "room_ids": [items[idx].room_id for idx in accepted],
+                "hotel_ids": [hotel_ids[idx] for idx in accepted],
+                "customer_ids": [items[idx].customer_id for idx in accepted],
+                "start_dates": [stays[idx][0] for idx in accepted],
+                "end_dates": [stays[idx][1] for idx in accepted]
+            })
+            # Accepted items never share a room and overlapping dates, so this key is unique
+            created = {(row.roomid, row.startdate, row.enddate): row.bookingid for row in result}
+            for idx in accepted:
+                results[idx].update(status="created", bookingid=created[(items[idx].room_id, *stays[idx])])
+
+        outcome = bulk_outcome(request.mode, results, "bookings")
+        if idempotency_key:
+            await idempotency.save(db, "bookings_bulk", idempotency_key, outcome)
+        created = [idx for idx, r in enumerate(results) if r["status"] == "created"]
+        changes = [("occupy", "booking", results[idx]["bookingid"], items[idx].room_id, *stays[idx]) for idx in created]
+        if created:
+            changes.append(("pin", *{items[idx].customer_id for idx in created}))
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
+        return outcome
+    except HTTPException as e:
+        await db.rollback()
+        raise e
+    except IntegrityError as e:
+        await db.rollback()
+        rejection = stay_rejection(e)
+        if rejection is not None:
+            raise rejection
+        logger.error(f"Error in create_bookings_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create bookings: {str(e)}")
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error in create_bookings_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create bookings: {str(e)}")
+
+@app.post("/api/rentings/bulk")
+async def create_rentings_bulk(
+    request: BulkRentingCreate,
+    idempotency_key: Optional[str] = Header(None),
+    db = Depends(get_db)
+):
+    try:
+        if idempotency_key:
+            replay = await idempotency.claim(db, "rentings_bulk", idempotency_key, request.dict())
+            if replay is not None:
+                return replay
+        items = request.items
+        stays = parse_stays(items)
+        results = [{"index": idx, "status": "pending"} for idx in range(len(items))]
+        checked_in = []
+
+        # Validate the whole batch against rooms, customers, employees, bookings and existing
+        # rentings at once, holding its rooms' locks until the writes commit. As in
+        # CREATE_RENTING_QUERY, a renting the rollover job created for the stay is claimed.
+        await lock_rooms(db, [item.room_id for item in items])
+        check_query = f"""
+        SELECT req.idx,
+               r.hotelid,
+               c.customerid IS NOT NULL as customer_exists,
+               e.employeeid IS NOT NULL as employee_exists,
+               req.bookingid IS NULL OR EXISTS (
+                   SELECT 1 FROM "hotel chains".bookings b
+                   WHERE b.bookingid = req.bookingid AND b.roomid = req.roomid
+                   AND b.customerid = req.customerid AND b.status <> 'Cancelled'
+                   AND b.startdate BETWEEN req.startdate - {MAX_STAY_NIGHTS} AND req.enddate
+                   AND b.enddate >= req.startdate
+               ) as booking_matches,
+               unclaimed.rentingid as unclaimed,
+               EXISTS (
+                   SELECT 1 FROM "hotel chains".rentings rt
+                   WHERE rt.roomid = req.roomid
+                   AND rt.startdate BETWEEN req.startdate - {MAX_STAY_NIGHTS} AND req.enddate
+                   AND rt.enddate >= req.startdate
+                   AND rt.status IS DISTINCT FROM 'CheckedOut'
+                   AND rt.rentingid IS DISTINCT FROM unclaimed.rentingid
+               ) as conflict
+        FROM unnest(CAST(:idx AS integer[]), CAST(:room_ids AS integer[]), CAST(:customer_ids AS integer[]),
+                    CAST(:employee_ids AS integer[]), CAST(:booking_ids AS integer[]),
+                    CAST(:start_dates AS date[]), CAST(:end_dates AS date[]))
+             AS req(idx, roomid, customerid, employeeid, bookingid, startdate, enddate)
+        LEFT JOIN "hotel chains".rooms r ON r.roomid = req.roomid
+        LEFT JOIN "hotel chains".customers c ON c.customerid = req.customerid
+        LEFT JOIN "hotel chains".employees e ON e.employeeid = req.employeeid
+        LEFT JOIN LATERAL (
+            SELECT rentingid FROM "hotel chains".rentings
+            WHERE roomid = req.roomid AND customerid = req.customerid AND employeeid IS NULL
+            AND startdate = req.startdate AND enddate = req.enddate
+            AND status IS DISTINCT FROM 'CheckedOut'
+            LIMIT 1
+        ) unclaimed ON true
+        """
+        result = await db.execute(text(check_query), {
+            "idx": list(range(len(items))),
+            "room_ids": [item.room_id for item in items],
+            "customer_ids": [item.customer_id for item in items],
+            "employee_ids": [item.employee_id for item in items],
+            "booking_ids": [item.booking_id for item in items],
+            "start_dates": [start for start, _ in stays],
+            "end_dates": [end for _, end in stays]
+        })
+        hotel_ids = {}
+        unclaimed = {}
+        for row in result:
+            item = items[row.idx]
+            if row.hotelid is None:
+                results[row.idx].update(status="rejected", error="Room not found")
+            elif not row.customer_exists:
+                results[row.idx].update(status="rejected", error=f"Customer {item.customer_id} not found")
+            elif not row.employee_exists:
+                results[row.idx].update(status="rejected", error="Employee not found")
+            elif not row.booking_matches:
+                results[row.idx].update(
+                    status="rejected", error=f"Booking {item.booking_id} is not an open booking for this stay"
+                )
+            elif row.conflict:
+                results[row.idx].update(status="rejected", error="Room is not available for the selected dates")
+            else:
+                hotel_ids[row.idx] = row.hotelid
+                if row.unclaimed is not None:
+                    unclaimed[row.idx] = row.unclaimed
+        reject_batch_overlaps(items, stays, results)
+
+        accepted = [idx for idx in range(len(items)) if results[idx]["status"] == "pending"]
+        if accepted and not (request.mode == "atomic" and len(accepted) < len(items)):
+            claims = [idx for idx in accepted if idx in unclaimed]
+            if claims:
+                claim_query = """
+                UPDATE "hotel chains".rentings rt
+                SET employeeid = req.employeeid
+                FROM unnest(CAST(:renting_ids AS integer[]), CAST(:employee_ids AS integer[]))
+                     AS req(rentingid, employeeid)
+                WHERE rt.rentingid = req.rentingid
+                """
+                await db.execute(text(claim_query), {
+                    "renting_ids": [unclaimed[idx] for idx in claims],
+                    "employee_ids": [items[idx].employee_id for idx in claims]
+                })
+                for idx in claims:
+                    results[idx].update(status="created", rentingid=unclaimed[idx])
+
+            inserts = [idx for idx in accepted if idx not in unclaimed]
+            insert_query = """
+            INSERT INTO "hotel chains".rentings (roomid, hotelid, customerid, employeeid, startdate, enddate)
+            SELECT req.roomid, req.hotelid, req.customerid, req.employeeid, req.startdate, req.enddate
+            FROM unnest(CAST(:room_ids AS integer[]), CAST(:hotel_ids AS integer[]), CAST(:customer_ids AS integer[]),
+                        CAST(:employee_ids AS integer[]), CAST(:start_dates AS date[]), CAST(:end_dates AS date[]))
+                 AS req(roomid, hotelid, customerid, employeeid, startdate, enddate)
+            RETURNING rentingid, roomid, startdate, enddate
+            """
+            if inserts:
+                result = await db.execute(text(insert_query), {
+                    "room_ids": [items[idx].room_id for idx in inserts],
+                    "hotel_ids": [hotel_ids[idx] for idx in inserts],
+                    "customer_ids": [items[idx].customer_id for idx in inserts],
+                    "employee_ids": [items[idx].employee_id for idx in inserts],
+                    "start_dates": [stays[idx][0] for idx in inserts],
+                    "end_dates": [stays[idx][1] for idx in inserts]
+                })
+                created = {(row.roomid, row.startdate, row.enddate): row.rentingid for row in result}
+                for idx in inserts:
+                    results[idx].update(status="created", rentingid=created[(items[idx].room_id, *stays[idx])])
+
+            # Check in the bookings these rentings came from, unless the rollover job already did
+            booking_ids = [items[idx].booking_id for idx in accepted if items[idx].booking_id]
+            if booking_ids:
+                update_query = """
+                UPDATE "hotel chains".bookings
+                SET status = 'CheckedIn'
+                WHERE bookingid = ANY(CAST(:booking_ids AS integer[])) AND status = 'Booked'
+                RETURNING bookingid, roomid, startdate, enddate
+                """
+                result = await db.execute(text(update_query), {"booking_ids": booking_ids})
+                checked_in = result.all()
+
+        outcome = bulk_outcome(request.mode, results, "rentings")
+        if idempotency_key:
+            await idempotency.save(db, "rentings_bulk", idempotency_key, outcome)
+        created = [idx for idx, r in enumerate(results) if r["status"] == "created"]
+        # A claimed renting already holds its room
+        changes = [
+            ("occupy", "renting", results[idx]["rentingid"], items[idx].room_id, *stays[idx])
+            for idx in created if idx not in unclaimed
+        ]
+        changes += [
+            ("release", "booking", row.bookingid, row.roomid, row.startdate, row.enddate) for row in checked_in
+        ]
+        if created:
+            changes.append(("pin", *{items[idx].customer_id for idx in created}))
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
+        return outcome
+    except HTTPException as e:
+        await db.rollback()
+        raise e
+    except IntegrityError as e:
+        await db.rollback()
+        rejection = stay_rejection(e)
+        if rejection is not None:
+            raise rejection
+        logger.error(f"Error in create_rentings_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create rentings: {str(e)}")
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error in create_rentings_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create rentings: {str(e)}")
+
+@app.post("/api/bookings/{booking_id}/cancel")
+async def cancel_booking(booking_id: int, db = Depends(get_db)):
+    try:
+        query = """
+        UPDATE "hotel chains".bookings 
+        SET status = 'Cancelled'
+        WHERE bookingid = :booking_id AND status = 'Booked'
+        RETURNING roomid, customerid, startdate, enddate
+        """
+        result = await db.execute(text(query), {"booking_id": booking_id})
+        room = result.first()
+        if not room:
+            raise HTTPException(status_code=404, detail=f"Active booking {booking_id} not found")
+        changes = [("cancel", booking_id, room.roomid, room.startdate, room.enddate), ("pin", room.customerid)]
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
+        return {"message": "Booking cancelled successfully"}
+    except HTTPException as e:
+        await db.rollback()
+        raise e
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error in cancel_booking: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/rentings/{renting_id}/checkout")
+async def checkout_renting(renting_id: int, db = Depends(get_db)):
+    try:
+        query = """
+        UPDATE "hotel chains".rentings 
+        SET status = 'CheckedOut'
+        WHERE rentingid = :renting_id AND status IS DISTINCT FROM 'CheckedOut'
+        RETURNING roomid, customerid, startdate, enddate
+        """
+        result = await db.execute(text(query), {"renting_id": renting_id})
+        room = result.first()
+        if not room:
+            raise HTTPException(status_code=404, detail=f"Active renting {renting_id} not found")
+        changes = [
+            ("release", "renting", renting_id, room.roomid, room.startdate, room.enddate),
+            ("pin", room.customerid),
+        ]
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
+        return {"message": "Renting checked out successfully"}
+    except HTTPException as e:
+        await db.rollback()
+        raise e
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error in checkout_renting: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+EMPLOYEE_FIELDS = {
+    "employeeid": "e.employeeid",
+    "efirstname": "e.efirstname",
+    "elastname": "e.elastname",
+    "ssnsin": "e.ssnsin",
+    "eaddress": "e.eaddress",
+    "hotelid": "e.hotelid",
+    "erole": "e.erole",
+    "ephone": "e.ephone",
+    "eemail": "e.eemail"
+}
+EMPLOYEE_KEYSET = Keyset(("employeeid", int))
+
 @app.get("/api/employees")
-def get_employees(hotel_id: Optional[int] = None, db = Depends(get_db)):
+async def get_employees(
+    request: Request,
+    hotel_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    db = Depends(get_db)
+):
     try:
-        query = 'SELECT * FROM "hotel chains".employees WHERE 1=1'
+        names = parse_fields(fields, EMPLOYEE_FIELDS)
+        key = ("employees", hotel_id, limit, after, tuple(names))
+        entry = reference_cache.get(key)
+        if entry is not None:
+            return cached_response(request, entry)
+        version = reference_cache.version(key)
+
+        query = f'SELECT {EMPLOYEE_KEYSET.select_list(names, EMPLOYEE_FIELDS)} FROM "hotel chains".employees e WHERE 1=1'
         params = {}
         if hotel_id:
-            query += " AND hotelid = :hotel_id"
+            query += " AND e.hotelid = :hotel_id"
             params["hotel_id"] = hotel_id
+        if after:
+            query += f" AND {EMPLOYEE_KEYSET.where(EMPLOYEE_FIELDS)}"
+            params.update(EMPLOYEE_KEYSET.params(after))
+        query += f" ORDER BY {EMPLOYEE_KEYSET.order_by(EMPLOYEE_FIELDS)}"
+        if limit:
+            query += " LIMIT :limit"
+            params["limit"] = limit + 1
         
-        result = db.execute(text(query), params)
-        rows = []
-        for row in result:
-            row_dict = {
-                "employeeid": row.employeeid,
-                "efirstname": row.efirstname,
-                "elastname": row.elastname,
-                "ssnsin": row.ssnsin,
-                "eaddress": row.eaddress,
-                "hotelid": row.hotelid,
-                "erole": row.erole,
-                "ephone": row.ephone,
-                "eemail": row.eemail
-            }
-            rows.append(row_dict)
-        return rows
+        result = await db.execute(text(query), params)
+        rows, next_cursor = paginate(result.all(), limit, EMPLOYEE_KEYSET)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return cached_response(request, reference_cache.set(key, RowEncoder(names).encode(rows), version=version, headers=headers))
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Error in get_employees: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    return {"reference": reference_cache.stats()}
+
+@registry.collector
+def reference_cache_metrics():
+    stats = reference_cache.stats()
+    return [
+        ("reference_cache_hits_total", "counter", "Reference cache hits.", [({}, stats["hits"])]),
+        ("reference_cache_misses_total", "counter", "Reference cache misses.", [({}, stats["misses"])]),
+        ("reference_cache_evictions_total", "counter", "Reference cache LRU evictions.", [({}, stats["evictions"])]),
+        ("reference_cache_entries", "gauge", "Entries in the reference cache.", [({}, stats["size"])]),
+    ]
+
+@registry.collector
+def replica_metrics():
+    stats = replicas.stats()
+    return [
+        ("db_replica_healthy", "gauge", "Whether a read replica is taking reads.",
+         [({"replica": r["name"]}, int(r["healthy"])) for r in stats["replicas"]]),
+        ("db_replica_lag_seconds", "gauge", "Replay lag of a read replica at its last check.",
+         [({"replica": r["name"]}, r["lag_seconds"]) for r in stats["replicas"] if r["lag_seconds"] is not None]),
+        ("db_reads_total", "counter", "Read-only sessions by where they were sent.",
+         [({"target": target}, count) for target, count in stats["reads"].items()]),
+        ("db_pinned_customers", "gauge", "Customers whose reads are pinned to the primary.",
+         [({}, stats["pinned_customers"])]),
+    ]
+
+@registry.collector
+def admission_metrics():
+    stats = admission.stats()
+    return [
+        ("admission_active_requests", "gauge", "API requests holding an admission slot.",
+         [({"limiter": l["name"]}, l["active"]) for l in stats["limiters"]]),
+        ("admission_limit", "gauge", "Concurrent API requests allowed.",
+         [({"limiter": l["name"]}, l["limit"]) for l in stats["limiters"]]),
+        ("admission_queued_requests", "gauge", "API requests waiting for an admission slot.",
+         [({"limiter": l["name"], "priority": priority}, l[f"queued_{priority}s"])
+          for l in stats["limiters"] for priority in ("write", "read")]),
+        ("admission_tracked_clients", "gauge", "Client addresses with a rate limit bucket.",
+         [({}, stats["tracked_clients"])]),
+    ]
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4")
+
+BOOKING_FIELDS = {
+    "bookingid": "b.bookingid",
+    "roomid": "b.roomid",
+    "hotelid": "b.hotelid",
+    "customerid": "b.customerid",
+    "startdate": "b.startdate",
+    "enddate": "b.enddate",
+    "price": "CAST(NULLIF(r.price, 0) AS double precision)",
+    "view": "r.view",
+    "capacity": "r.capacity",
+    "hotel_address": "h.haddress",
+    "hotel_category": "h.num_of_rooms",
+    "customer_name": "CONCAT(c.firstname, ' ', c.lastname)"
+}
+BOOKING_JOINS = [
+    ("r", 'JOIN "hotel chains".rooms r ON b.roomid = r.roomid'),
+    ("h", 'JOIN "hotel chains".hotels h ON b.hotelid = h.hotelid'),
+    ("c", 'JOIN "hotel chains".customers c ON b.customerid = c.customerid')
+]
+BOOKING_KEYSET = Keyset(("startdate", date), ("bookingid", int), descending=True)
+
+def join_clauses(select_list, joins):
+    # Only join the tables the selected columns come from
+    return " ".join(join for alias, join in joins if re.search(rf"\b{alias}\.", select_list))
+
 @app.get("/api/customers/{customer_id}/bookings")
-def get_customer_bookings(customer_id: int, db = Depends(get_db)):
+async def get_customer_bookings(
+    customer_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    db = Depends(get_customer_read_db)
+):
     try:
-        query = """
-        SELECT b.bookingid, b.roomid, b.hotelid, b.customerid, 
-               b.startdate, b.enddate,
-               r.price, r.view, r.capacity,
-               h.haddress as hotel_address, h.num_of_rooms as hotel_category,
-               c.firstname as customer_firstname, c.lastname as customer_lastname
+        names = parse_fields(fields, BOOKING_FIELDS)
+        select_list = BOOKING_KEYSET.select_list(names, BOOKING_FIELDS)
+        query = f"""
+        SELECT {select_list}
         FROM "hotel chains".bookings b
-        JOIN "hotel chains".rooms r ON b.roomid = r.roomid
-        JOIN "hotel chains".hotels h ON b.hotelid = h.hotelid
-        JOIN "hotel chains".customers c ON b.customerid = c.customerid
+        {join_clauses(select_list, BOOKING_JOINS)}
         WHERE b.customerid = :customer_id
-        ORDER BY b.startdate DESC
         """
-        result = db.execute(text(query), {"customer_id": customer_id})
-        rows = []
-        for row in result:
-            row_dict = {
-                "bookingid": row.bookingid,
-                "roomid": row.roomid,
-                "hotelid": row.hotelid,
-                "customerid": row.customerid,
-                "startdate": row.startdate,
-                "enddate": row.enddate,
-                "price": float(row.price) if row.price else None,
-                "view": row.view,
-                "capacity": row.capacity,
-                "hotel_address": row.hotel_address,
-                "hotel_category": row.hotel_category,
-                "customer_name": f"{row.customer_firstname} {row.customer_lastname}"
-            }
-            rows.append(row_dict)
-        return rows
+        params = {"customer_id": customer_id}
+        if after:
+            query += f" AND {BOOKING_KEYSET.where(BOOKING_FIELDS)}"
+            params.update(BOOKING_KEYSET.params(after))
+        query += f" ORDER BY {BOOKING_KEYSET.order_by(BOOKING_FIELDS)}"
+        if limit:
+            query += " LIMIT :limit"
+            params["limit"] = limit + 1
+        result = await db.execute(text(query), params)
+        rows, next_cursor = paginate(result.all(), limit, BOOKING_KEYSET)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return json_response(RowEncoder(names).encode(rows), headers)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Error in get_customer_bookings: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+RENTING_FIELDS = {
+    "rentingid": "r.rentingid",
+    "roomid": "r.roomid",
+    "hotelid": "r.hotelid",
+    "customerid": "r.customerid",
+    "employeeid": "r.employeeid",
+    "startdate": "r.startdate",
+    "enddate": "r.enddate",
+    "price": "CAST(NULLIF(rm.price, 0) AS double precision)",
+    "view": "rm.view",
+    "capacity": "rm.capacity",
+    "hotel_address": "h.haddress",
+    "hotel_category": "h.num_of_rooms",
+    "employee_name": "CASE WHEN e.efirstname IS NOT NULL THEN CONCAT(e.efirstname, ' ', e.elastname) END",
+    "customer_name": "CONCAT(c.firstname, ' ', c.lastname)"
+}
+RENTING_JOINS = [
+    ("rm", 'JOIN "hotel chains".rooms rm ON r.roomid = rm.roomid'),
+    ("h", 'JOIN "hotel chains".hotels h ON r.hotelid = h.hotelid'),
+    ("c", 'JOIN "hotel chains".customers c ON r.customerid = c.customerid'),
+    ("e", 'LEFT JOIN "hotel chains".employees e ON r.employeeid = e.employeeid')
+]
+RENTING_KEYSET = Keyset(("startdate", date), ("rentingid", int), descending=True)
+
 @app.get("/api/customers/{customer_id}/rentings")
-def get_customer_rentings(customer_id: int, db = Depends(get_db)):
+async def get_customer_rentings(
+    customer_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    db = Depends(get_customer_read_db)
+):
     try:
-        query = """
-        SELECT r.rentingid, r.roomid, r.hotelid, r.customerid, 
-               r.employeeid, r.startdate, r.enddate,
-               rm.price, rm.view, rm.capacity,
-               h.haddress as hotel_address, h.num_of_rooms as hotel_category,
-               e.efirstname as employee_firstname, e.elastname as employee_lastname,
-               c.firstname as customer_firstname, c.lastname as customer_lastname
+        names = parse_fields(fields, RENTING_FIELDS)
+        select_list = RENTING_KEYSET.select_list(names, RENTING_FIELDS)
+        query = f"""
+        SELECT {select_list}
         FROM "hotel chains".rentings r
-        JOIN "hotel chains".rooms rm ON r.roomid = rm.roomid
-        JOIN "hotel chains".hotels h ON r.hotelid = h.hotelid
-        JOIN "hotel chains".customers c ON r.customerid = c.customerid
-        LEFT JOIN "hotel chains".employees e ON r.employeeid = e.employeeid
+        {join_clauses(select_list, RENTING_JOINS)}
         WHERE r.customerid = :customer_id
-        ORDER BY r.startdate DESC
         """
-        result = db.execute(text(query), {"customer_id": customer_id})
-        rows = []
-        for row in result:
-            row_dict = {
-                "rentingid": row.rentingid,
-                "roomid": row.roomid,
-                "hotelid": row.hotelid,
-                "customerid": row.customerid,
-                "employeeid": row.employeeid,
-                "startdate": row.startdate,
-                "enddate": row.enddate,
-                "price": float(row.price) if row.price else None,
-                "view": row.view,
-                "capacity": row.capacity,
-                "hotel_address": row.hotel_address,
-                "hotel_category": row.hotel_category,
-                "employee_name": f"{row.employee_firstname} {row.employee_lastname}" if row.employee_firstname else None,
-                "customer_name": f"{row.customer_firstname} {row.customer_lastname}"
-            }
-            rows.append(row_dict)
-        return rows
+        params = {"customer_id": customer_id}
+        if after:
+            query += f" AND {RENTING_KEYSET.where(RENTING_FIELDS)}"
+            params.update(RENTING_KEYSET.params(after))
+        query += f" ORDER BY {RENTING_KEYSET.order_by(RENTING_FIELDS)}"
+        if limit:
+            query += " LIMIT :limit"
+            params["limit"] = limit + 1
+        result = await db.execute(text(query), params)
+        rows, next_cursor = paginate(result.all(), limit, RENTING_KEYSET)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return json_response(RowEncoder(names).encode(rows), headers)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Error in get_customer_rentings: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# The ID comes from customer_id_seq unless one was given; an ID that is already
+# taken inserts nothing
+CREATE_CUSTOMER_QUERY = """
+INSERT INTO "hotel chains".customers (customerid, firstname, lastname, address, dateofregistration)
+VALUES (COALESCE(:customerid, nextval('"hotel chains".customer_id_seq')), :firstname, :lastname, :address, CURRENT_DATE)
+ON CONFLICT (customerid) DO NOTHING
+RETURNING customerid
+"""
+# Keeps later nextval calls from handing out an ID a client chose
+ADVANCE_CUSTOMER_ID_QUERY = """
+SELECT setval('"hotel chains".customer_id_seq', :customerid)
+FROM "hotel chains".customer_id_seq
+WHERE last_value < :customerid OR (last_value = :customerid AND NOT is_called)
+"""
+
 @app.post("/api/customers")
-def create_customer(customer: CustomerCreate, db = Depends(get_db)):
+async def create_customer(customer: CustomerCreate, db = Depends(get_db)):
     try:
-        # If customerid is provided, check if it exists
-        if customer.customerid:
-            check_query = """
-            SELECT customerid FROM "hotel chains".customers 
-            WHERE customerid = :customerid
-            """
-            result = db.execute(text(check_query), {"customerid": customer.customerid})
-            if result.first():
-                raise HTTPException(status_code=400, detail=f"Customer with ID {customer.customerid} already exists")
-        
-        # If no customerid provided, get the next available ID
-        if not customer.customerid:
-            id_query = """
-            SELECT COALESCE(MAX(customerid), 0) + 1 
-            FROM "hotel chains".customers
-            """
-            result = db.execute(text(id_query))
-            customer.customerid = result.scalar()
-        
-        # Insert the customer
-        query = """
-        INSERT INTO "hotel chains".customers (customerid, firstname, lastname, address, dateofregistration)
-        VALUES (:customerid, :firstname, :lastname, :address, CURRENT_DATE)
-        RETURNING customerid
-        """
+        # A missing or zero ID means the database assigns one
+        requested_id = customer.customerid or None
         params = {
-            "customerid": customer.customerid,
+            "customerid": requested_id,
             "firstname": customer.firstname,
             "lastname": customer.lastname,
             "address": customer.address
         }
-        logger.info(f"Executing query: {query} with params: {params}")
-        result = db.execute(text(query), params)
-        customer_id = result.scalar()
-        db.commit()
+        customer_id = (await db.execute(text(CREATE_CUSTOMER_QUERY), params)).scalar()
+        if customer_id is None:
+            if requested_id is not None:
+                raise HTTPException(status_code=400, detail=f"Customer with ID {requested_id} already exists")
+            # migrations/001_id_sequences.sql moves the sequence past existing IDs
+            raise HTTPException(status_code=500, detail="Failed to create customer: customer_id_seq is behind the customers table")
+        if requested_id is not None:
+            await db.execute(text(ADVANCE_CUSTOMER_ID_QUERY), {"customerid": customer_id})
+        await db.commit()
         return {"customerid": customer_id}
+    except HTTPException as e:
+        await db.rollback()
+        raise e
+    except IntegrityError as e:
+        await db.rollback()
+        logger.error(f"Error in create_customer: {str(e)}")
+        raise HTTPException(status_code=400, detail="Customer could not be created")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in create_customer: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to create customer: {str(e)}")
 
+UPDATE_CUSTOMER_QUERY = """
+WITH checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (
+            SELECT 1 FROM "hotel chains".customers WHERE customerid = :customer_id
+        ) THEN 'customer_not_found'
+        WHEN EXISTS (
+            SELECT 1 FROM "hotel chains".bookings WHERE customerid = :customer_id
+        ) OR EXISTS (
+            SELECT 1 FROM "hotel chains".rentings WHERE customerid = :customer_id
+        ) THEN 'customer_active'
+        ELSE 'ok'
+    END AS outcome
+), updated AS (
+    UPDATE "hotel chains".customers
+    SET firstname = :firstname, lastname = :lastname, address = :address
+    WHERE customerid = :customer_id AND (SELECT outcome FROM checks) = 'ok'
+)
+SELECT outcome FROM checks
+"""
+UPDATE_CUSTOMER_ERRORS = {
+    "customer_not_found": (404, "Customer {customer_id} not found"),
+    "customer_active": (400, "Cannot update customer with active bookings or rentings"),
+}
+
 @app.put("/api/customers/{customer_id}")
-def update_customer(customer_id: int, customer: CustomerCreate, db = Depends(get_db)):
+async def update_customer(customer_id: int, customer: CustomerCreate, db = Depends(get_db)):
     try:
-        # Check if customer exists
-        check_query = """
-        SELECT customerid FROM "hotel chains".customers 
-        WHERE customerid = :customer_id
-        """
-        result = db.execute(text(check_query), {"customer_id": customer_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail=f"Customer {customer_id} not found")
-
-        # Check for active bookings or rentings
-        check_active_query = """
-        SELECT 
-            CASE 
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".bookings b
-                    WHERE b.customerid = :customer_id 
-                ) THEN true
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".rentings rt
-                    WHERE rt.customerid = :customer_id 
-                ) THEN true
-                ELSE false
-            END as has_active
-        """
-        result = db.execute(text(check_active_query), {"customer_id": customer_id})
-        if result.scalar():
-            raise HTTPException(
-                status_code=400, 
-                detail="Cannot update customer with active bookings or rentings"
-            )
-        
-        # Update customer
-        query = """
-        UPDATE "hotel chains".customers 
-        SET firstname = :firstname, lastname = :lastname, address = :address
-        WHERE customerid = :customer_id
-        """
-        params = {**customer.dict(), "customer_id": customer_id}
-        result = db.execute(text(query), params)
-        if result.rowcount == 0:
-            raise HTTPException(status_code=404, detail=f"Customer {customer_id} not found")
-        db.commit()
+        params = {
+            "customer_id": customer_id,
+            "firstname": customer.firstname,
+            "lastname": customer.lastname,
+            "address": customer.address
+        }
+        outcome = (await db.execute(text(UPDATE_CUSTOMER_QUERY), params)).scalar()
+        raise_for_outcome(outcome, UPDATE_CUSTOMER_ERRORS, customer_id=customer_id)
+        await db.commit()
         return {"message": "Customer updated successfully"}
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in update_customer: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+DELETE_CUSTOMER_QUERY = """
+WITH checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (
+            SELECT 1 FROM "hotel chains".customers WHERE customerid = :customer_id
+        ) THEN 'customer_not_found'
+        WHEN EXISTS (
+            SELECT 1 FROM "hotel chains".bookings WHERE customerid = :customer_id
+        ) OR EXISTS (
+            SELECT 1 FROM "hotel chains".rentings WHERE customerid = :customer_id
+        ) THEN 'customer_active'
+        ELSE 'ok'
+    END AS outcome
+), deleted AS (
+    DELETE FROM "hotel chains".customers
+    WHERE customerid = :customer_id AND (SELECT outcome FROM checks) = 'ok'
+)
+SELECT outcome FROM checks
+"""
+DELETE_CUSTOMER_ERRORS = {
+    "customer_not_found": (404, "Customer {customer_id} not found"),
+    "customer_active": (400, "Cannot delete customer with active bookings or rentings"),
+}
+
 @app.delete("/api/customers/{customer_id}")
-def delete_customer(customer_id: int, db = Depends(get_db)):
+async def delete_customer(customer_id: int, db = Depends(get_db)):
     try:
-        # Check if customer exists
-        check_query = """
-        SELECT customerid FROM "hotel chains".customers 
-        WHERE customerid = :customer_id
-        """
-        result = db.execute(text(check_query), {"customer_id": customer_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail=f"Customer {customer_id} not found")
-        
-        # Check for active bookings or rentings
-        check_active_query = """
-        SELECT 
-            CASE 
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".bookings b
-                    WHERE b.customerid = :customer_id 
-                ) THEN true
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".rentings rt
-                    WHERE rt.customerid = :customer_id 
-                ) THEN true
-                ELSE false
-            END as has_active
-        """
-        result = db.execute(text(check_active_query), {"customer_id": customer_id})
-        if result.scalar():
-            raise HTTPException(
-                status_code=400, 
-                detail="Cannot delete customer with active bookings or rentings"
-            )
-        
-        # Delete customer
-        query = 'DELETE FROM "hotel chains".customers WHERE customerid = :customer_id'
-        result = db.execute(text(query), {"customer_id": customer_id})
-        if result.rowcount == 0:
-            raise HTTPException(status_code=404, detail=f"Customer {customer_id} not found")
-        db.commit()
+        outcome = (await db.execute(text(DELETE_CUSTOMER_QUERY), {"customer_id": customer_id})).scalar()
+        raise_for_outcome(outcome, DELETE_CUSTOMER_ERRORS, customer_id=customer_id)
+        await db.commit()
         return {"message": "Customer deleted successfully"}
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in delete_customer: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+ROOM_CAPACITY_QUERY = """
+SELECT h.haddress as hotel_address, COUNT(*) as total_rooms,
+       SUM(CASE WHEN r.capacity = 1 THEN 1 ELSE 0 END) as single_rooms,
+       SUM(CASE WHEN r.capacity = 2 THEN 1 ELSE 0 END) as double_rooms,
+       SUM(CASE WHEN r.capacity = 3 THEN 1 ELSE 0 END) as triple_rooms,
+       SUM(CASE WHEN r.capacity >= 4 THEN 1 ELSE 0 END) as other_rooms
+FROM "hotel chains".hotels h
+JOIN "hotel chains".rooms r ON h.hotelid = r.hotelid
+GROUP BY h.hotelid, h.haddress
+ORDER BY h.haddress
+"""
+
+ROOM_CAPACITY_SUMMARY_QUERY = """
+SELECT hotel_address, total_rooms, single_rooms, double_rooms, triple_rooms, other_rooms
+FROM "hotel chains".room_capacity_summary
+ORDER BY hotel_address
+"""
+
+ROOM_AREA_QUERY = """
+SELECT h.haddress as hotel_address, r.view, COUNT(*) as room_count,
+       MIN(r.price) as min_price, MAX(r.price) as max_price,
+       AVG(r.price) as avg_price
+FROM "hotel chains".hotels h
+JOIN "hotel chains".rooms r ON h.hotelid = r.hotelid
+GROUP BY h.hotelid, h.haddress, r.view
+ORDER BY h.haddress, r.view
+"""
+
+ROOM_AREA_SUMMARY_QUERY = """
+SELECT hotel_address, view, room_count, min_price, max_price, avg_price
+FROM "hotel chains".room_area_summary
+ORDER BY hotel_address, view
+"""
+
+async def refresh_room_summaries(db, hotel_ids=None):
+    # Runs inside the caller's transaction so the summaries commit with the write
+    await db.execute(
+        text('SELECT "hotel chains".refresh_room_summaries(CAST(:hotel_ids AS integer[]))'),
+        {"hotel_ids": sorted({h for h in hotel_ids if h is not None}) if hotel_ids is not None else None}
+    )
+
+async def roll_over_periodically():
+    # Runs at startup too, catching up on days the app was down
+    while True:
+        try:
+            report = await rollover.run(AsyncSessionLocal, ROLLOVER_BATCH_SIZE, on_changes=apply_committed)
+            logger.info(
+                f"Rollover checked in {report['check_in']['rows']} bookings and checked out "
+                f"{report['check_out']['rows']} rentings in {report['seconds']:.2f} s"
+            )
+        except SQLAlchemyError as e:
+            logger.error(f"Rollover failed: {str(e)}")
+        await asyncio.sleep(ROLLOVER_INTERVAL_SECONDS)
+
+async def create_partitions_periodically():
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                created = await partitions.ensure(db)
+                await db.commit()
+            if created:
+                logger.info(f"Created {created} booking and renting partitions")
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to create partitions: {str(e)}")
+        await asyncio.sleep(PARTITION_MAINTENANCE_SECONDS)
+
+async def purge_idempotency_keys_periodically():
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_PURGE_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                purged = await idempotency.purge_expired(db)
+                await db.commit()
+            logger.info(f"Purged {purged} expired idempotency keys")
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to purge idempotency keys: {str(e)}")
+
+async def refresh_room_summaries_periodically():
+    while True:
+        await asyncio.sleep(ROOM_SUMMARY_REFRESH_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                await refresh_room_summaries(db)
+                await db.commit()
+            logger.info("Room summaries refreshed")
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to refresh room summaries: {str(e)}")
+
 @app.get("/api/views/room-capacity")
-def get_room_capacity_view(db = Depends(get_db)):
+async def get_room_capacity_view(fresh: bool = False, db = Depends(get_read_db)):
     try:
-        query = """
-        SELECT h.haddress as hotel_address, COUNT(*) as total_rooms,
-               SUM(CASE WHEN r.capacity = 1 THEN 1 ELSE 0 END) as single_rooms,
-               SUM(CASE WHEN r.capacity = 2 THEN 1 ELSE 0 END) as double_rooms,
-               SUM(CASE WHEN r.capacity = 3 THEN 1 ELSE 0 END) as triple_rooms,
-               SUM(CASE WHEN r.capacity >= 4 THEN 1 ELSE 0 END) as other_rooms
-        FROM "hotel chains".hotels h
-        JOIN "hotel chains".rooms r ON h.hotelid = r.hotelid
-        GROUP BY h.hotelid, h.haddress
-        ORDER BY h.haddress
-        """
-        result = db.execute(text(query))
-        rows = []
-        for row in result:
-            row_dict = {}
-            for idx, col in enumerate(result.keys()):
-                row_dict[col] = row[idx]
-            rows.append(row_dict)
-        return rows
+        query = ROOM_CAPACITY_QUERY if fresh else ROOM_CAPACITY_SUMMARY_QUERY
+        result = await db.execute(text(query))
+        return json_response(RowEncoder(result.keys()).encode(result))
     except Exception as e:
         logger.error(f"Error in get_room_capacity_view: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/views/room-area")
-def get_room_area_view(db = Depends(get_db)):
+async def get_room_area_view(fresh: bool = False, db = Depends(get_read_db)):
     try:
-        query = """
-        SELECT h.haddress as hotel_address, r.area, COUNT(*) as room_count,
-               MIN(r.price) as min_price, MAX(r.price) as max_price,
-               AVG(r.price) as avg_price
-        FROM "hotel chains".hotels h
-        JOIN "hotel chains".rooms r ON h.hotelid = r.hotelid
-        GROUP BY h.hotelid, h.haddress, r.area
-        ORDER BY h.haddress, r.area
-        """
-        result = db.execute(text(query))
-        rows = []
-        for row in result:
-            row_dict = {}
-            for idx, col in enumerate(result.keys()):
-                row_dict[col] = row[idx]
-            rows.append(row_dict)
-        return rows
+        query = ROOM_AREA_QUERY if fresh else ROOM_AREA_SUMMARY_QUERY
+        result = await db.execute(text(query))
+        return json_response(RowEncoder(result.keys()).encode(result))
     except Exception as e:
         logger.error(f"Error in get_room_area_view: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def reload_occupancy_periodically():
+    while True:
+        await asyncio.sleep(OCCUPANCY_REFRESH_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                await occupancy.load(db)
+            logger.info("Occupancy array reloaded")
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to reload occupancy array: {str(e)}")
+
+@app.get("/api/analytics/occupancy")
+async def get_occupancy(
+    start_date: date,
+    end_date: date,
+    group_by: str = "hotel",
+    hotel_id: Optional[int] = None,
+    chain_id: Optional[int] = None
+):
+    """Occupancy rate, ADR and RevPAR per hotel, chain and/or night.
+
+    ``group_by`` is a comma-separated subset of ``hotel`` or ``chain`` and
+    ``day``; an empty value returns a single total.
+    """
+    groups = {g.strip() for g in group_by.split(",") if g.strip()}
+    if groups - {"hotel", "chain", "day"}:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by: {', '.join(sorted(groups - {'hotel', 'chain', 'day'}))}")
+    if {"hotel", "chain"} <= groups:
+        raise HTTPException(status_code=400, detail="Group by hotel or by chain, not both")
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="End date must not be before start date")
+    if (end_date - start_date).days + 1 > OCCUPANCY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range is limited to {OCCUPANCY_MAX_DAYS} days")
+    if not occupancy.ready:
+        raise HTTPException(status_code=503, detail="Occupancy data is not loaded")
+    try:
+        # The aggregation is CPU-bound, so keep it off the event loop
+        rows = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: occupancy.aggregate(start_date, end_date, groups, hotel_id=hotel_id, chain_id=chain_id)
+        )
+        return json_response(dumps(rows))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in get_occupancy: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@registry.collector
+def search_flight_metrics():
+    stats = search_flights.stats()
+    return [
+        ("search_queries_executed_total", "counter", "Search queries run against the database.", [({}, stats["executed"])]),
+        ("search_queries_shared_total", "counter", "Searches answered by joining an identical in-flight query.",
+         [({}, stats["shared"])]),
+    ]
+
+@registry.collector
+def availability_feed_metrics():
+    return [
+        ("availability_feed_subscribers", "gauge", "Open /sse/availability streams.",
+         [({}, availability_feed.subscribers)]),
+    ]
+
+@registry.collector
+def occupancy_metrics():
+    stats = occupancy.stats()
+    return [
+        ("occupancy_array_rooms", "gauge", "Rooms in the occupancy array.", [({}, stats["rooms"])]),
+        ("occupancy_array_days", "gauge", "Nights covered by the occupancy array.", [({}, stats["days"])]),
+        ("occupancy_array_bytes", "gauge", "Memory held by the occupancy array.", [({}, stats["bytes"])]),
+    ]
+
+UPDATE_HOTEL_QUERY = """
+WITH checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (
+            SELECT 1 FROM "hotel chains".hotels WHERE hotelid = :hotel_id
+        ) THEN 'hotel_not_found'
+        WHEN CAST(:change_chain AS boolean) AND NOT EXISTS (
+            SELECT 1 FROM "hotel chains".hotelchains WHERE chainid = :chain_id
+        ) THEN 'chain_not_found'
+        WHEN CAST(:change_manager AS boolean) AND NOT EXISTS (
+            SELECT 1 FROM "hotel chains".employees WHERE employeeid = :manager_id
+        ) THEN 'manager_not_found'
+        WHEN CAST(:change_chain AS boolean) AND (EXISTS (
+            SELECT 1 FROM "hotel chains".bookings b
+            JOIN "hotel chains".rooms r ON b.roomid = r.roomid
+            WHERE r.hotelid = :hotel_id
+        ) OR EXISTS (
+            SELECT 1 FROM "hotel chains".rentings rt
+            JOIN "hotel chains".rooms r ON rt.roomid = r.roomid
+            WHERE r.hotelid = :hotel_id
+        )) THEN 'hotel_active'
+        ELSE 'ok'
+    END AS outcome
+), updated AS (
+    UPDATE "hotel chains".hotels
+    SET chainid = COALESCE(:chain_id, chainid),
+        haddress = COALESCE(:address, haddress),
+        num_of_rooms = COALESCE(:num_of_rooms, num_of_rooms),
+        hemail = COALESCE(:email, hemail),
+        hphone = COALESCE(:phone, hphone),
+        managerid = COALESCE(:manager_id, managerid)
+    WHERE hotelid = :hotel_id AND (SELECT outcome FROM checks) = 'ok'
+)
+SELECT outcome FROM checks
+"""
+UPDATE_HOTEL_ERRORS = {
+    "hotel_not_found": (404, "Hotel {hotel_id} not found"),
+    "chain_not_found": (404, "Hotel chain {chain_id} not found"),
+    "manager_not_found": (404, "Employee {manager_id} not found"),
+    "hotel_active": (400, "Cannot change hotel chain while there are active bookings or rentings"),
+}
+HOTEL_UPDATE_FIELDS = ("chain_id", "address", "num_of_rooms", "email", "phone", "manager_id")
+
 @app.put("/api/hotels/{hotel_id}")
-def update_hotel(hotel_id: int, hotel_data: dict, db = Depends(get_db)):
+async def update_hotel(hotel_id: int, hotel_data: dict, db = Depends(get_db)):
     try:
-        # Check if hotel exists
-        check_query = """
-        SELECT hotelid FROM "hotel chains".hotels 
-        WHERE hotelid = :hotel_id
-        """
-        result = db.execute(text(check_query), {"hotel_id": hotel_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail=f"Hotel {hotel_id} not found")
-        
-        # Check if chain exists
-        if "chain_id" in hotel_data:
-            chain_query = """
-            SELECT chainid FROM "hotel chains".hotelchains 
-            WHERE chainid = :chain_id
-            """
-            result = db.execute(text(chain_query), {"chain_id": hotel_data["chain_id"]})
-            if not result.first():
-                raise HTTPException(status_code=404, detail=f"Hotel chain {hotel_data['chain_id']} not found")
-        
-        # Check if manager exists
-        if "manager_id" in hotel_data:
-            manager_query = """
-            SELECT employeeid FROM "hotel chains".employees 
-            WHERE employeeid = :manager_id
-            """
-            result = db.execute(text(manager_query), {"manager_id": hotel_data["manager_id"]})
-            if not result.first():
-                raise HTTPException(status_code=404, detail=f"Employee {hotel_data['manager_id']} not found")
-        
-        # Check for active bookings or rentings if trying to change chain
-        if "chain_id" in hotel_data:
-            check_active_query = """
-            SELECT 
-                CASE 
-                    WHEN EXISTS (
-                        SELECT 1 FROM "hotel chains".bookings b
-                        JOIN "hotel chains".rooms r ON b.roomid = r.roomid
-                        WHERE r.hotelid = :hotel_id 
-                    ) THEN true
-                    WHEN EXISTS (
-                        SELECT 1 FROM "hotel chains".rentings rt
-                        JOIN "hotel chains".rooms r ON rt.roomid = r.roomid
-                        WHERE r.hotelid = :hotel_id 
-                    ) THEN true
-                    ELSE false
-                END as has_active
-            """
-            result = db.execute(text(check_active_query), {"hotel_id": hotel_id})
-            if result.scalar():
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Cannot change hotel chain while there are active bookings or rentings"
-                )
-        
-        # Update hotel
-        query = """
-        UPDATE "hotel chains".hotels 
-        SET chainid = COALESCE(:chain_id, chainid),
-            haddress = COALESCE(:address, haddress),
-            num_of_rooms = COALESCE(:num_of_rooms, num_of_rooms),
-            hemail = COALESCE(:email, hemail),
-            hphone = COALESCE(:phone, hphone),
-            managerid = COALESCE(:manager_id, managerid)
-        WHERE hotelid = :hotel_id
-        """
-        params = {**hotel_data, "hotel_id": hotel_id}
-        result = db.execute(text(query), params)
-        if result.rowcount == 0:
-            raise HTTPException(status_code=404, detail=f"Hotel {hotel_id} not found")
-        db.commit()
+        # The chain and manager are only checked when the request sets them
+        params = {
+            **{field: hotel_data.get(field) for field in HOTEL_UPDATE_FIELDS},
+            "hotel_id": hotel_id,
+            "change_chain": "chain_id" in hotel_data,
+            "change_manager": "manager_id" in hotel_data
+        }
+        outcome = (await db.execute(text(UPDATE_HOTEL_QUERY), params)).scalar()
+        raise_for_outcome(outcome, UPDATE_HOTEL_ERRORS, **params)
+        await refresh_room_summaries(db, [hotel_id])
+        changes = [("reference", "hotels"), ("rooms", None, hotel_id), ("areas",)]
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
         return {"message": "Hotel updated successfully"}
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in update_hotel: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+DELETE_HOTEL_QUERY = """
+WITH checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (
+            SELECT 1 FROM "hotel chains".hotels WHERE hotelid = :hotel_id
+        ) THEN 'hotel_not_found'
+        WHEN EXISTS (
+            SELECT 1 FROM "hotel chains".bookings b
+            JOIN "hotel chains".rooms r ON b.roomid = r.roomid
+            WHERE r.hotelid = :hotel_id
+        ) OR EXISTS (
+            SELECT 1 FROM "hotel chains".rentings rt
+            JOIN "hotel chains".rooms r ON rt.roomid = r.roomid
+            WHERE r.hotelid = :hotel_id
+        ) THEN 'hotel_active'
+        ELSE 'ok'
+    END AS outcome
+), deleted AS (
+    DELETE FROM "hotel chains".hotels
+    WHERE hotelid = :hotel_id AND (SELECT outcome FROM checks) = 'ok'
+)
+SELECT outcome FROM checks
+"""
+DELETE_HOTEL_ERRORS = {
+    "hotel_not_found": (404, "Hotel {hotel_id} not found"),
+    "hotel_active": (400, "Cannot delete hotel with active bookings or rentings"),
+}
+
 @app.delete("/api/hotels/{hotel_id}")
-def delete_hotel(hotel_id: int, db = Depends(get_db)):
+async def delete_hotel(hotel_id: int, db = Depends(get_db)):
     try:
-        # Check if hotel exists
-        check_query = """
-        SELECT hotelid FROM "hotel chains".hotels 
-        WHERE hotelid = :hotel_id
-        """
-        result = db.execute(text(check_query), {"hotel_id": hotel_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail=f"Hotel {hotel_id} not found")
-        
-        # Check for active bookings or rentings
-        check_active_query = """
-        SELECT 
-            CASE 
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".bookings b
-                    JOIN "hotel chains".rooms r ON b.roomid = r.roomid
-                    WHERE r.hotelid = :hotel_id 
-                ) THEN true
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".rentings rt
-                    JOIN "hotel chains".rooms r ON rt.roomid = r.roomid
-                    WHERE r.hotelid = :hotel_id 
-                ) THEN true
-                ELSE false
-            END as has_active
-        """
-        result = db.execute(text(check_active_query), {"hotel_id": hotel_id})
-        if result.scalar():
-            raise HTTPException(
-                status_code=400, 
-                detail="Cannot delete hotel with active bookings or rentings"
-            )
-        
-        # Delete hotel
-        query = 'DELETE FROM "hotel chains".hotels WHERE hotelid = :hotel_id'
-        result = db.execute(text(query), {"hotel_id": hotel_id})
-        if result.rowcount == 0:
-            raise HTTPException(status_code=404, detail=f"Hotel {hotel_id} not found")
-        db.commit()
+        outcome = (await db.execute(text(DELETE_HOTEL_QUERY), {"hotel_id": hotel_id})).scalar()
+        raise_for_outcome(outcome, DELETE_HOTEL_ERRORS, hotel_id=hotel_id)
+        await refresh_room_summaries(db, [hotel_id])
+        changes = [("reference", "hotels", "employees"), ("rooms", None, hotel_id), ("areas",)]
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
         return {"message": "Hotel deleted successfully"}
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in delete_hotel: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+UPDATE_ROOM_QUERY = """
+WITH room AS (
+    SELECT hotelid FROM "hotel chains".rooms WHERE roomid = :room_id LIMIT 1
+), checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (SELECT 1 FROM room) THEN 'room_not_found'
+        WHEN CAST(:change_hotel AS boolean) AND NOT EXISTS (
+            SELECT 1 FROM "hotel chains".hotels WHERE hotelid = :hotel_id
+        ) THEN 'hotel_not_found'
+        WHEN CAST(:change_hotel AS boolean) AND (EXISTS (
+            SELECT 1 FROM "hotel chains".bookings WHERE roomid = :room_id
+        ) OR EXISTS (
+            SELECT 1 FROM "hotel chains".rentings WHERE roomid = :room_id
+        )) THEN 'room_active'
+        ELSE 'ok'
+    END AS outcome
+), updated AS (
+    UPDATE "hotel chains".rooms
+    SET hotelid = COALESCE(:hotel_id, hotelid),
+        price = COALESCE(:price, price),
+        capacity = COALESCE(:capacity, capacity),
+        view = COALESCE(:view, view),
+        extendable = COALESCE(:extendable, extendable),
+        problems = COALESCE(:problems, problems)
+    WHERE roomid = :room_id AND (SELECT outcome FROM checks) = 'ok'
+)
+SELECT (SELECT outcome FROM checks) AS outcome, (SELECT hotelid FROM room) AS hotelid
+"""
+UPDATE_ROOM_ERRORS = {
+    "room_not_found": (404, "Room {room_id} not found"),
+    "hotel_not_found": (404, "Hotel {hotel_id} not found"),
+    "room_active": (400, "Cannot change room's hotel while there are active bookings or rentings"),
+}
+ROOM_UPDATE_FIELDS = ("hotel_id", "price", "capacity", "view", "extendable", "problems")
+
 @app.put("/api/rooms/{room_id}")
-def update_room(room_id: int, room_data: dict, db = Depends(get_db)):
+async def update_room(room_id: int, room_data: dict, db = Depends(get_db)):
     try:
-        # Check if room exists
-        check_query = """
-        SELECT roomid FROM "hotel chains".rooms 
-        WHERE roomid = :room_id
-        """
-        result = db.execute(text(check_query), {"room_id": room_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail=f"Room {room_id} not found")
-        
-        # Check if hotel exists if trying to change hotel
-        if "hotel_id" in room_data:
-            hotel_query = """
-            SELECT hotelid FROM "hotel chains".hotels 
-            WHERE hotelid = :hotel_id
-            """
-            result = db.execute(text(hotel_query), {"hotel_id": room_data["hotel_id"]})
-            if not result.first():
-                raise HTTPException(status_code=404, detail=f"Hotel {room_data['hotel_id']} not found")
-        
-        # Check for active bookings or rentings if trying to change hotel
-        if "hotel_id" in room_data:
-            check_active_query = """
-            SELECT 
-                CASE 
-                    WHEN EXISTS (
-                        SELECT 1 FROM "hotel chains".bookings b
-                        WHERE b.roomid = :room_id 
-                    ) THEN true
-                    WHEN EXISTS (
-                        SELECT 1 FROM "hotel chains".rentings rt
-                        WHERE rt.roomid = :room_id 
-                    ) THEN true
-                    ELSE false
-                END as has_active
-            """
-            result = db.execute(text(check_active_query), {"room_id": room_id})
-            if result.scalar():
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Cannot change room's hotel while there are active bookings or rentings"
-                )
-        
-        # Update room
-        query = """
-        UPDATE "hotel chains".rooms 
-        SET hotelid = COALESCE(:hotel_id, hotelid),
-            price = COALESCE(:price, price),
-            capacity = COALESCE(:capacity, capacity),
-            view = COALESCE(:view, view),
-            extendable = COALESCE(:extendable, extendable),
-            problems = COALESCE(:problems, problems)
-        WHERE roomid = :room_id
-        """
-        params = {**room_data, "room_id": room_id}
-        result = db.execute(text(query), params)
-        if result.rowcount == 0:
-            raise HTTPException(status_code=404, detail=f"Room {room_id} not found")
-        db.commit()
+        # The new hotel is only checked when the request sets one
+        params = {
+            **{field: room_data.get(field) for field in ROOM_UPDATE_FIELDS},
+            "room_id": room_id,
+            "change_hotel": "hotel_id" in room_data
+        }
+        room = (await db.execute(text(UPDATE_ROOM_QUERY), params)).one()
+        raise_for_outcome(room.outcome, UPDATE_ROOM_ERRORS, **params)
+        await refresh_room_summaries(db, [room.hotelid, room_data.get("hotel_id")])
+        changes = [("rooms", room_id, None)]
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
         return {"message": "Room updated successfully"}
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in update_room: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+DELETE_ROOM_QUERY = """
+WITH room AS (
+    SELECT hotelid FROM "hotel chains".rooms WHERE roomid = :room_id LIMIT 1
+), checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (SELECT 1 FROM room) THEN 'room_not_found'
+        WHEN EXISTS (
+            SELECT 1 FROM "hotel chains".bookings WHERE roomid = :room_id
+        ) OR EXISTS (
+            SELECT 1 FROM "hotel chains".rentings WHERE roomid = :room_id
+        ) THEN 'room_active'
+        ELSE 'ok'
+    END AS outcome
+), deleted AS (
+    DELETE FROM "hotel chains".rooms
+    WHERE roomid = :room_id AND (SELECT outcome FROM checks) = 'ok'
+)
+SELECT (SELECT outcome FROM checks) AS outcome, (SELECT hotelid FROM room) AS hotelid
+"""
+DELETE_ROOM_ERRORS = {
+    "room_not_found": (404, "Room {room_id} not found"),
+    "room_active": (400, "Cannot delete room with active bookings or rentings"),
+}
+
 @app.delete("/api/rooms/{room_id}")
-def delete_room(room_id: int, db = Depends(get_db)):
+async def delete_room(room_id: int, db = Depends(get_db)):
     try:
-        # Check if room exists
-        check_query = """
-        SELECT roomid FROM "hotel chains".rooms 
-        WHERE roomid = :room_id
-        """
-        result = db.execute(text(check_query), {"room_id": room_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail=f"Room {room_id} not found")
-        
-        # Check for active bookings or rentings
-        check_active_query = """
-        SELECT 
-            CASE 
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".bookings b
-                    WHERE b.roomid = :room_id 
-                ) THEN true
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".rentings rt
-                    WHERE rt.roomid = :room_id 
-                ) THEN true
-                ELSE false
-            END as has_active
-        """
-        result = db.execute(text(check_active_query), {"room_id": room_id})
-        if result.scalar():
-            raise HTTPException(
-                status_code=400, 
-                detail="Cannot delete room with active bookings or rentings"
-            )
-        
-        # Delete room
-        query = 'DELETE FROM "hotel chains".rooms WHERE roomid = :room_id'
-        result = db.execute(text(query), {"room_id": room_id})
-        if result.rowcount == 0:
-            raise HTTPException(status_code=404, detail=f"Room {room_id} not found")
-        db.commit()
+        room = (await db.execute(text(DELETE_ROOM_QUERY), {"room_id": room_id})).one()
+        raise_for_outcome(room.outcome, DELETE_ROOM_ERRORS, room_id=room_id)
+        await refresh_room_summaries(db, [room.hotelid])
+        changes = [("rooms", room_id, None)]
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
         return {"message": "Room deleted successfully"}
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in delete_room: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+UPDATE_EMPLOYEE_QUERY = """
+WITH checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (
+            SELECT 1 FROM "hotel chains".employees WHERE employeeid = :employee_id
+        ) THEN 'employee_not_found'
+        WHEN CAST(:change_hotel AS boolean) AND NOT EXISTS (
+            SELECT 1 FROM "hotel chains".hotels WHERE hotelid = :hotel_id
+        ) THEN 'hotel_not_found'
+        WHEN CAST(:change_hotel AS boolean) AND EXISTS (
+            SELECT 1 FROM "hotel chains".hotels WHERE managerid = :employee_id
+        ) THEN 'employee_is_manager'
+        WHEN CAST(:change_hotel AS boolean) AND EXISTS (
+            SELECT 1 FROM "hotel chains".rentings WHERE employeeid = :employee_id
+        ) THEN 'employee_active'
+        ELSE 'ok'
+    END AS outcome
+), updated AS (
+    UPDATE "hotel chains".employees
+    SET efirstname = COALESCE(:firstname, efirstname),
+        elastname = COALESCE(:lastname, elastname),
+        eaddress = COALESCE(:address, eaddress),
+        hotelid = COALESCE(:hotel_id, hotelid),
+        erole = COALESCE(:role, erole),
+        ephone = COALESCE(:phone, ephone),
+        eemail = COALESCE(:email, eemail),
+        sin = COALESCE(:sin, sin)
+    WHERE employeeid = :employee_id AND (SELECT outcome FROM checks) = 'ok'
+)
+SELECT outcome FROM checks
+"""
+UPDATE_EMPLOYEE_ERRORS = {
+    "employee_not_found": (404, "Employee {employee_id} not found"),
+    "hotel_not_found": (404, "Hotel {hotel_id} not found"),
+    "employee_is_manager": (400, "Cannot change hotel for an employee who is a hotel manager"),
+    "employee_active": (400, "Cannot change hotel for an employee with active rentings"),
+}
+EMPLOYEE_UPDATE_FIELDS = ("firstname", "lastname", "address", "hotel_id", "role", "phone", "email", "sin")
+
 @app.put("/api/employees/{employee_id}")
-def update_employee(employee_id: int, employee_data: dict, db = Depends(get_db)):
+async def update_employee(employee_id: int, employee_data: dict, db = Depends(get_db)):
     try:
-        # Check if employee exists
-        check_query = """
-        SELECT employeeid FROM "hotel chains".employees 
-        WHERE employeeid = :employee_id
-        """
-        result = db.execute(text(check_query), {"employee_id": employee_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail=f"Employee {employee_id} not found")
-        
-        # Check if hotel exists if trying to change hotel
-        if "hotel_id" in employee_data:
-            hotel_query = """
-            SELECT hotelid FROM "hotel chains".hotels 
-            WHERE hotelid = :hotel_id
-            """
-            result = db.execute(text(hotel_query), {"hotel_id": employee_data["hotel_id"]})
-            if not result.first():
-                raise HTTPException(status_code=404, detail=f"Hotel {employee_data['hotel_id']} not found")
-        
-        # Check if employee is a manager and has active rentings if trying to change hotel
-        if "hotel_id" in employee_data:
-            check_manager_query = """
-            SELECT 
-                CASE 
-                    WHEN EXISTS (
-                        SELECT 1 FROM "hotel chains".hotels 
-                        WHERE managerid = :employee_id
-                    ) THEN true
-                    ELSE false
-                END as is_manager
-            """
-            result = db.execute(text(check_manager_query), {"employee_id": employee_id})
-            if result.scalar():
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Cannot change hotel for an employee who is a hotel manager"
-                )
-            
-            check_active_query = """
-            SELECT 
-                CASE 
-                    WHEN EXISTS (
-                        SELECT 1 FROM "hotel chains".rentings 
-                        WHERE employeeid = :employee_id 
-                    ) THEN true
-                    ELSE false
-                END as has_active
-            """
-            result = db.execute(text(check_active_query), {"employee_id": employee_id})
-            if result.scalar():
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Cannot change hotel for an employee with active rentings"
-                )
-        
-        # Update employee
-        query = """
-        UPDATE "hotel chains".employees 
-        SET efirstname = COALESCE(:firstname, efirstname),
-            elastname = COALESCE(:lastname, elastname),
-            eaddress = COALESCE(:address, eaddress),
-            hotelid = COALESCE(:hotel_id, hotelid),
-            erole = COALESCE(:role, erole),
-            ephone = COALESCE(:phone, ephone),
-            eemail = COALESCE(:email, eemail),
-            sin = COALESCE(:sin, sin)
-        WHERE employeeid = :employee_id
-        """
-        params = {**employee_data, "employee_id": employee_id}
-        result = db.execute(text(query), params)
-        if result.rowcount == 0:
-            raise HTTPException(status_code=404, detail=f"Employee {employee_id} not found")
-        db.commit()
+        # The new hotel is only checked when the request sets one
+        params = {
+            **{field: employee_data.get(field) for field in EMPLOYEE_UPDATE_FIELDS},
+            "employee_id": employee_id,
+            "change_hotel": "hotel_id" in employee_data
+        }
+        outcome = (await db.execute(text(UPDATE_EMPLOYEE_QUERY), params)).scalar()
+        raise_for_outcome(outcome, UPDATE_EMPLOYEE_ERRORS, **params)
+        changes = [("reference", "employees")]
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
         return {"message": "Employee updated successfully"}
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in update_employee: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+DELETE_EMPLOYEE_QUERY = """
+WITH checks AS (
+    SELECT CASE
+        WHEN NOT EXISTS (
+            SELECT 1 FROM "hotel chains".employees WHERE employeeid = :employee_id
+        ) THEN 'employee_not_found'
+        WHEN EXISTS (
+            SELECT 1 FROM "hotel chains".hotels WHERE managerid = :employee_id
+        ) THEN 'employee_is_manager'
+        WHEN EXISTS (
+            SELECT 1 FROM "hotel chains".rentings WHERE employeeid = :employee_id
+        ) THEN 'employee_active'
+        ELSE 'ok'
+    END AS outcome
+), deleted AS (
+    DELETE FROM "hotel chains".employees
+    WHERE employeeid = :employee_id AND (SELECT outcome FROM checks) = 'ok'
+)
+SELECT outcome FROM checks
+"""
+DELETE_EMPLOYEE_ERRORS = {
+    "employee_not_found": (404, "Employee {employee_id} not found"),
+    "employee_is_manager": (400, "Cannot delete an employee who is a hotel manager"),
+    "employee_active": (400, "Cannot delete employee with active rentings"),
+}
+
 @app.delete("/api/employees/{employee_id}")
-def delete_employee(employee_id: int, db = Depends(get_db)):
+async def delete_employee(employee_id: int, db = Depends(get_db)):
     try:
-        # Check if employee exists
-        check_query = """
-        SELECT employeeid FROM "hotel chains".employees 
-        WHERE employeeid = :employee_id
-        """
-        result = db.execute(text(check_query), {"employee_id": employee_id})
-        if not result.first():
-            raise HTTPException(status_code=404, detail=f"Employee {employee_id} not found")
-        
-        # Check if employee is a manager
-        check_manager_query = """
-        SELECT 
-            CASE 
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".hotels 
-                    WHERE managerid = :employee_id
-                ) THEN true
-                ELSE false
-            END as is_manager
-        """
-        result = db.execute(text(check_manager_query), {"employee_id": employee_id})
-        if result.scalar():
-            raise HTTPException(
-                status_code=400, 
-                detail="Cannot delete an employee who is a hotel manager"
-            )
-        
-        # Check for active rentings
-        check_active_query = """
-        SELECT 
-            CASE 
-                WHEN EXISTS (
-                    SELECT 1 FROM "hotel chains".rentings 
-                    WHERE employeeid = :employee_id 
-                ) THEN true
-                ELSE false
-            END as has_active
-        """
-        result = db.execute(text(check_active_query), {"employee_id": employee_id})
-        if result.scalar():
-            raise HTTPException(
-                status_code=400, 
-                detail="Cannot delete employee with active rentings"
-            )
-        
-        # Delete employee
-        query = 'DELETE FROM "hotel chains".employees WHERE employeeid = :employee_id'
-        result = db.execute(text(query), {"employee_id": employee_id})
-        if result.rowcount == 0:
-            raise HTTPException(status_code=404, detail=f"Employee {employee_id} not found")
-        db.commit()
+        outcome = (await db.execute(text(DELETE_EMPLOYEE_QUERY), {"employee_id": employee_id})).scalar()
+        raise_for_outcome(outcome, DELETE_EMPLOYEE_ERRORS, employee_id=employee_id)
+        changes = [("reference", "employees")]
+        await notifications.publish(db, changes)
+        await db.commit()
+        await apply_committed(changes, db)
         return {"message": "Employee deleted successfully"}
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error in delete_employee: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
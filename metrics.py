@@ -0,0 +1,304 @@
+"""Request and database instrumentation exposed in Prometheus text format.
+
+``MetricsMiddleware`` times every HTTP request and labels it with the route
+template (``/api/customers/{customer_id}/bookings``), so label cardinality stays
+bounded. ``instrument_engine`` hooks SQLAlchemy's cursor events to count the
+statements, database time and rows of the request that ran them, and logs
+statements slower than ``SLOW_QUERY_MS`` with their literals stripped. Pool
+wait is the time between a session asking for its first connection and the
+transaction starting on it.
+
+Everything is plain counters and fixed-bucket histograms kept in memory per
+process; recording a request costs a few dictionary updates.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+
+slow_query_logger = logging.getLogger("slow_query")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+ROW_COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels=(), value=0):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = (("le", _number(bound)),)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, func):
+        """Register ``func() -> [(name, kind, help, [(labels_dict, value)])]``, called on every scrape."""
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for func in self._collectors:
+            for name, kind, help, samples in func():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency, including streaming the body.", ("method", "route")
+)
+http_request_queries = registry.histogram(
+    "http_request_db_queries", "SQL statements run per HTTP request.", ("route",), QUERY_COUNT_BUCKETS
+)
+http_request_rows = registry.histogram(
+    "http_request_db_rows", "Rows returned by SQL statements per HTTP request.", ("route",), ROW_COUNT_BUCKETS
+)
+http_request_db_time = registry.histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per HTTP request.", ("route",)
+)
+http_errors = registry.counter(
+    "http_request_errors_total", "HTTP requests that failed with a 5xx status or an unhandled exception.", ("route",)
+)
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "SQL statement latency by statement type.", ("statement",)
+)
+db_errors = registry.counter("db_errors_total", "SQL statements that raised an error.", ("error",))
+db_slow_queries = registry.counter("db_slow_queries_total", "SQL statements slower than SLOW_QUERY_MS.")
+db_pool_wait = registry.histogram(
+    "db_pool_wait_seconds", "Time a session waited for a pooled connection.", (), POOL_WAIT_BUCKETS
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "rows", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.db_time = 0.0
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def route_label(scope):
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and database use per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            status = 500
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            route = route_label(scope)
+            http_requests.inc((scope["method"], route, str(status)))
+            http_request_duration.observe((scope["method"], route), elapsed)
+            http_request_queries.observe((route,), stats.queries)
+            http_request_rows.observe((route,), stats.rows)
+            http_request_db_time.observe((route,), stats.db_time)
+            if status >= 500:
+                http_errors.inc((route,))
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w$.])-?\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    """Collapse whitespace and replace literals, so similar statements read the same."""
+    statement = _LITERALS.sub("?", statement)
+    statement = _IN_LISTS.sub("(?, ...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def _statement_type(statement):
+    head = statement.lstrip().split(None, 1)
+    return head[0].upper() if head else "OTHER"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    db_query_duration.observe((_statement_type(statement),), elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        if cursor.description is not None and cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        db_slow_queries.inc()
+        slow_query_logger.warning(f"Slow query ({elapsed * 1000:.0f} ms): {normalize_sql(statement)}")
+
+
+def _handle_error(context):
+    stack = context.connection.info.get("query_started") if context.connection is not None else None
+    if stack:
+        stack.pop()
+    db_errors.inc((type(context.original_exception).__name__,))
+
+
+def _session_execute(orm_execute_state):
+    info = orm_execute_state.session.info
+    if "connection_requested" not in info and not orm_execute_state.session.in_transaction():
+        info["connection_requested"] = time.perf_counter()
+
+
+def _session_after_begin(session, transaction, connection):
+    requested = session.info.pop("connection_requested", None)
+    if requested is not None:
+        db_pool_wait.observe((), time.perf_counter() - requested)
+
+
+def instrument_engine(engine):
+    """Attach the statement hooks to a (sync) engine; pass ``async_engine.sync_engine`` for asyncio."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def instrument_sessions(session_class=Session):
+    event.listen(session_class, "do_orm_execute", _session_execute)
+    event.listen(session_class, "after_begin", _session_after_begin)
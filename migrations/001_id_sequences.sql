@@ -0,0 +1,31 @@
+-- Sequence-backed ID allocation for bookings, customers and rentings.
+-- Replaces SELECT COALESCE(MAX(id), 0) + 1 in the API. Safe to re-run.
+
+SET search_path TO "hotel chains", public;
+
+CREATE SEQUENCE IF NOT EXISTS "hotel chains".booking_id_seq;
+CREATE SEQUENCE IF NOT EXISTS "hotel chains".customer_id_seq;
+CREATE SEQUENCE IF NOT EXISTS "hotel chains".renting_id_seq;
+
+-- Move each sequence past the IDs already in use. A sequence is never moved
+-- back, so re-running this cannot hand out an ID nextval already returned.
+SELECT setval('"hotel chains".booking_id_seq', GREATEST(
+    COALESCE((SELECT MAX(bookingid) FROM "hotel chains".bookings), 0),
+    (SELECT last_value FROM "hotel chains".booking_id_seq)
+));
+SELECT setval('"hotel chains".customer_id_seq', GREATEST(
+    COALESCE((SELECT MAX(customerid) FROM "hotel chains".customers), 0),
+    (SELECT last_value FROM "hotel chains".customer_id_seq)
+));
+SELECT setval('"hotel chains".renting_id_seq', GREATEST(
+    COALESCE((SELECT MAX(rentingid) FROM "hotel chains".rentings), 0),
+    (SELECT last_value FROM "hotel chains".renting_id_seq)
+));
+
+ALTER TABLE "hotel chains".bookings ALTER COLUMN bookingid SET DEFAULT nextval('"hotel chains".booking_id_seq');
+ALTER TABLE "hotel chains".customers ALTER COLUMN customerid SET DEFAULT nextval('"hotel chains".customer_id_seq');
+ALTER TABLE "hotel chains".rentings ALTER COLUMN rentingid SET DEFAULT nextval('"hotel chains".renting_id_seq');
+
+ALTER SEQUENCE "hotel chains".booking_id_seq OWNED BY "hotel chains".bookings.bookingid;
+ALTER SEQUENCE "hotel chains".customer_id_seq OWNED BY "hotel chains".customers.customerid;
+ALTER SEQUENCE "hotel chains".renting_id_seq OWNED BY "hotel chains".rentings.rentingid;
@@ -0,0 +1,32 @@
+-- Enforce "no overlapping active bookings per room" with a GiST exclusion
+-- constraint instead of the prevent_double_booking trigger and the API's
+-- COUNT(*) pre-check. Neither of those is safe under concurrent inserts.
+--
+-- Stays are inclusive of both dates, matching the API's overlap predicate
+-- (startdate <= :end_date AND enddate >= :start_date). If the constraint
+-- cannot be created, list the offending rows first:
+--
+--   SELECT a.bookingid, b.bookingid
+--   FROM "hotel chains".bookings a
+--   JOIN "hotel chains".bookings b
+--     ON a.roomid = b.roomid AND a.hotelid = b.hotelid AND a.bookingid < b.bookingid
+--   WHERE a.status = 'Booked' AND b.status = 'Booked'
+--     AND a.startdate <= b.enddate AND a.enddate >= b.startdate;
+
+SET search_path TO "hotel chains", public;
+
+-- Lets plain integer columns take part in a GiST index
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE "hotel chains".bookings
+    ADD COLUMN IF NOT EXISTS stay daterange
+    GENERATED ALWAYS AS (daterange(startdate, enddate, '[]')) STORED;
+
+ALTER TABLE "hotel chains".bookings DROP CONSTRAINT IF EXISTS bookings_no_overlap;
+ALTER TABLE "hotel chains".bookings
+    ADD CONSTRAINT bookings_no_overlap
+    EXCLUDE USING gist (roomid WITH =, hotelid WITH =, stay WITH &&)
+    WHERE (status = 'Booked');
+
+DROP TRIGGER IF EXISTS prevent_double_booking_trigger ON "hotel chains".bookings;
+DROP FUNCTION IF EXISTS "hotel chains".prevent_double_booking();
@@ -0,0 +1,64 @@
+-- Precomputed summaries behind /api/views/room-capacity and /api/views/room-area.
+-- The API refreshes the rows of the affected hotels in the same transaction as
+-- room and hotel writes, and rebuilds everything on a schedule.
+
+SET search_path TO "hotel chains", public;
+
+CREATE TABLE IF NOT EXISTS "hotel chains".room_capacity_summary AS
+SELECT h.hotelid, h.haddress as hotel_address, COUNT(*) as total_rooms,
+       SUM(CASE WHEN r.capacity = 1 THEN 1 ELSE 0 END) as single_rooms,
+       SUM(CASE WHEN r.capacity = 2 THEN 1 ELSE 0 END) as double_rooms,
+       SUM(CASE WHEN r.capacity = 3 THEN 1 ELSE 0 END) as triple_rooms,
+       SUM(CASE WHEN r.capacity >= 4 THEN 1 ELSE 0 END) as other_rooms
+FROM "hotel chains".hotels h
+JOIN "hotel chains".rooms r ON h.hotelid = r.hotelid
+GROUP BY h.hotelid, h.haddress
+WITH NO DATA;
+
+CREATE TABLE IF NOT EXISTS "hotel chains".room_area_summary AS
+SELECT h.hotelid, h.haddress as hotel_address, r.view, COUNT(*) as room_count,
+       MIN(r.price) as min_price, MAX(r.price) as max_price,
+       AVG(r.price) as avg_price
+FROM "hotel chains".hotels h
+JOIN "hotel chains".rooms r ON h.hotelid = r.hotelid
+GROUP BY h.hotelid, h.haddress, r.view
+WITH NO DATA;
+
+CREATE INDEX IF NOT EXISTS idx_room_capacity_summary_hotel ON "hotel chains".room_capacity_summary (hotelid);
+CREATE INDEX IF NOT EXISTS idx_room_area_summary_hotel ON "hotel chains".room_area_summary (hotelid);
+CREATE INDEX IF NOT EXISTS idx_rooms_hotelid ON "hotel chains".rooms (hotelid);
+
+-- Recompute the summaries of the given hotels, or of all hotels when NULL
+CREATE OR REPLACE FUNCTION "hotel chains".refresh_room_summaries(p_hotel_ids integer[] DEFAULT NULL)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    DELETE FROM "hotel chains".room_capacity_summary
+    WHERE p_hotel_ids IS NULL OR hotelid = ANY(p_hotel_ids);
+
+    INSERT INTO "hotel chains".room_capacity_summary
+    SELECT h.hotelid, h.haddress, COUNT(*),
+           SUM(CASE WHEN r.capacity = 1 THEN 1 ELSE 0 END),
+           SUM(CASE WHEN r.capacity = 2 THEN 1 ELSE 0 END),
+           SUM(CASE WHEN r.capacity = 3 THEN 1 ELSE 0 END),
+           SUM(CASE WHEN r.capacity >= 4 THEN 1 ELSE 0 END)
+    FROM "hotel chains".hotels h
+    JOIN "hotel chains".rooms r ON h.hotelid = r.hotelid
+    WHERE p_hotel_ids IS NULL OR h.hotelid = ANY(p_hotel_ids)
+    GROUP BY h.hotelid, h.haddress;
+
+    DELETE FROM "hotel chains".room_area_summary
+    WHERE p_hotel_ids IS NULL OR hotelid = ANY(p_hotel_ids);
+
+    INSERT INTO "hotel chains".room_area_summary
+    SELECT h.hotelid, h.haddress, r.view, COUNT(*),
+           MIN(r.price), MAX(r.price), AVG(r.price)
+    FROM "hotel chains".hotels h
+    JOIN "hotel chains".rooms r ON h.hotelid = r.hotelid
+    WHERE p_hotel_ids IS NULL OR h.hotelid = ANY(p_hotel_ids)
+    GROUP BY h.hotelid, h.haddress, r.view;
+END;
+$$;
+
+SELECT "hotel chains".refresh_room_summaries();
@@ -0,0 +1,18 @@
+-- Trigram indexes for the room search's area and chain filters, which match
+-- with ILIKE '%...%'. A leading wildcard cannot use a btree index, so without
+-- these every search scans hotels and hotel chains. pg_trgm GIN indexes serve
+-- ILIKE directly for patterns of three or more characters; shorter patterns
+-- still scan.
+
+SET search_path TO "hotel chains", public;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_hotels_haddress_trgm
+    ON "hotel chains".hotels USING gin (haddress gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_hotelchains_cname_trgm
+    ON "hotel chains".hotelchains USING gin (cname gin_trgm_ops);
+
+ANALYZE "hotel chains".hotels;
+ANALYZE "hotel chains".hotelchains;
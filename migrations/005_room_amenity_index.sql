@@ -0,0 +1,22 @@
+-- Amenity filters for the room search. Amenity names vary in case and spacing
+-- ('Wifi'/'WiFi', 'Kitchenette'/'kitchenette'), so the search compares
+-- normalized arrays: lower case, whitespace collapsed, duplicates removed. The
+-- API normalizes requested amenities the same way (availability.normalize_amenity).
+-- The GIN expression index serves both @> (all of) and && (any of).
+
+SET search_path TO "hotel chains", public;
+
+CREATE OR REPLACE FUNCTION "hotel chains".normalize_amenities(p_amenities text[])
+RETURNS text[]
+LANGUAGE sql
+IMMUTABLE PARALLEL SAFE
+AS $$
+    SELECT COALESCE(array_agg(DISTINCT lower(btrim(regexp_replace(a, '\s+', ' ', 'g')))), '{}')
+    FROM unnest(p_amenities) a
+    WHERE a IS NOT NULL
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_rooms_amenities_normalized
+    ON "hotel chains".rooms USING gin ("hotel chains".normalize_amenities(amenities));
+
+ANALYZE "hotel chains".rooms;
@@ -0,0 +1,19 @@
+-- Responses of create requests sent with an Idempotency-Key header. A key is
+-- claimed in the same transaction that creates the booking or renting and the
+-- response is stored before commit, so a retried request either waits for the
+-- first one and replays its response, or (if the first one failed and rolled
+-- back) runs again. Rows past expires_at are reclaimed and purged by the API.
+
+SET search_path TO "hotel chains", public;
+
+CREATE TABLE IF NOT EXISTS "hotel chains".idempotency_keys (
+    scope varchar(50) NOT NULL,
+    idem_key varchar(255) NOT NULL,
+    request_hash bytea NOT NULL,
+    status_code integer,
+    response bytea,
+    expires_at timestamptz NOT NULL,
+    PRIMARY KEY (scope, idem_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON "hotel chains".idempotency_keys (expires_at);
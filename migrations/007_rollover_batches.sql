@@ -0,0 +1,31 @@
+-- Retire the per-row rollover triggers in favour of the batch job in
+-- rollover.py (run by the app every ROLLOVER_INTERVAL_SECONDS, or with
+-- `python rollover.py`).
+--
+-- The triggers only fired when a row was updated for some other reason, so
+-- most bookings were never converted and most rentings never checked out. Two
+-- near-identical checkout triggers ran on every rentings update, and the
+-- conversion trigger reused the booking ID as the renting ID, which collides
+-- with renting_id_seq.
+
+SET search_path TO "hotel chains", public;
+
+DROP TRIGGER IF EXISTS auto_checkout ON "hotel chains".rentings;
+DROP TRIGGER IF EXISTS trigger_auto_checkout ON "hotel chains".rentings;
+DROP TRIGGER IF EXISTS trigger_convert_booking ON "hotel chains".bookings;
+DROP FUNCTION IF EXISTS "hotel chains".auto_checkout();
+DROP FUNCTION IF EXISTS "hotel chains".auto_checkout_function();
+DROP FUNCTION IF EXISTS "hotel chains".convert_booking_to_renting();
+
+-- Checked-in bookings are marked 'CheckedIn' (by the job and by
+-- POST /api/rentings with a booking_id). NOT VALID skips checking old rows.
+ALTER TABLE "hotel chains".bookings DROP CONSTRAINT IF EXISTS bookings_status_check;
+ALTER TABLE "hotel chains".bookings
+    ADD CONSTRAINT bookings_status_check
+    CHECK (status IN ('Booked', 'CheckedIn', 'Cancelled')) NOT VALID;
+
+-- Each batch finds its rows without scanning finished stays
+CREATE INDEX IF NOT EXISTS idx_bookings_booked_start
+    ON "hotel chains".bookings (startdate) WHERE status = 'Booked';
+CREATE INDEX IF NOT EXISTS idx_rentings_open_end
+    ON "hotel chains".rentings (enddate) WHERE status IS DISTINCT FROM 'CheckedOut';
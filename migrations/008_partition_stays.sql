@@ -0,0 +1,286 @@
+-- Range-partition bookings and rentings by start date, one partition per
+-- month, so queries with a start date range only scan the months they touch.
+-- Every date-range query in the API bounds startdate on both sides: stays are
+-- limited to 180 nights (the *_stay_length constraints below, MAX_STAY_NIGHTS
+-- in availability.py), so a stay that ends on or after D started on or after
+-- D - 180.
+--
+-- Partitions up to 24 months ahead are created here and kept ahead by the app
+-- (PARTITION_MAINTENANCE_SECONDS) or `python partitions.py ensure`. Inserting
+-- a stay that starts outside the partitions fails with check_violation
+-- (23514), which the API reports as a 400. `python partitions.py archive`
+-- merges finished years into one packed yearly partition each.
+--
+-- Exclusion constraints on a partitioned table must compare the partition key
+-- with equality, and a stay overlaps stays that start in other months, so
+-- bookings_no_overlap (migration 002) cannot be kept. The stay_overlap
+-- triggers below keep the guarantee for every writer instead, for bookings
+-- and now rentings too: each takes the room's transaction-level advisory lock,
+-- pg_advisory_xact_lock(2132, roomid), and raises exclusion_violation (23P01)
+-- if an active stay of the room overlaps. The API's writes take the same locks
+-- up front, in room order.
+--
+-- Rewrites both tables under an exclusive lock; run it during a maintenance
+-- window. Safe to re-run. If a *_stay_length constraint cannot be added, list
+-- the offending rows first:
+--
+--   SELECT * FROM "hotel chains".bookings WHERE enddate - startdate > 180;
+
+SET search_path TO "hotel chains", public;
+
+-- Creates the missing monthly partitions of p_table for the months from p_from
+-- to p_to, skipping years that have been archived
+CREATE OR REPLACE FUNCTION "hotel chains".create_stay_partitions(p_table text, p_from date, p_to date)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month date := date_trunc('month', p_from)::date;
+    v_name text;
+    v_created integer := 0;
+BEGIN
+    WHILE v_month <= p_to LOOP
+        v_name := format('%s_%s', p_table, to_char(v_month, 'YYYY_MM'));
+        IF to_regclass(format('"hotel chains".%I', v_name)) IS NULL
+           AND to_regclass(format('"hotel chains".%I', p_table || '_' || to_char(v_month, 'YYYY'))) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE "hotel chains".%I PARTITION OF "hotel chains".%I FOR VALUES FROM (%L) TO (%L)',
+                v_name, p_table, v_month, (v_month + interval '1 month')::date
+            );
+            v_created := v_created + 1;
+        END IF;
+        v_month := (v_month + interval '1 month')::date;
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+-- Replaces p_table with a partitioned copy holding the same rows, defaults,
+-- checks, foreign keys and non-unique indexes. The primary key becomes
+-- (p_id, startdate), since a partitioned table's unique keys must include the
+-- partition key.
+CREATE OR REPLACE FUNCTION "hotel chains".partition_stay_table(p_table text, p_id text, p_months_ahead integer)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_old regclass := format('"hotel chains".%I', p_table)::regclass;
+    v_old_name text := p_table || '_unpartitioned';
+    v_columns text;
+    v_sequence text;
+    v_first date;
+    v_foreign_keys text[];
+    v_indexes text[];
+    v_statement text;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = v_old) = 'p' THEN
+        RETURN;
+    END IF;
+    EXECUTE format('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE', v_old);
+
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO v_columns
+    FROM pg_attribute
+    WHERE attrelid = v_old AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    v_sequence := pg_get_serial_sequence(v_old::text, p_id);
+    SELECT array_agg(format('ALTER TABLE "hotel chains".%I ADD CONSTRAINT %I %s',
+                            p_table, conname, pg_get_constraintdef(oid)))
+    INTO v_foreign_keys
+    FROM pg_constraint WHERE conrelid = v_old AND contype = 'f';
+    SELECT array_agg(pg_get_indexdef(i.indexrelid))
+    INTO v_indexes
+    FROM pg_index i
+    WHERE i.indrelid = v_old AND NOT i.indisunique AND NOT i.indisexclusion
+    AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid);
+
+    -- Free the index and constraint names for the new table
+    EXECUTE format('ALTER TABLE %s RENAME TO %I', v_old, v_old_name);
+    FOR v_statement IN
+        SELECT format('ALTER TABLE "hotel chains".%I DROP CONSTRAINT %I', v_old_name, conname)
+        FROM pg_constraint WHERE conrelid = v_old AND contype IN ('p', 'u', 'x', 'f')
+    LOOP
+        EXECUTE v_statement;
+    END LOOP;
+    FOR v_statement IN
+        SELECT format('DROP INDEX "hotel chains".%I', c.relname)
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = v_old
+    LOOP
+        EXECUTE v_statement;
+    END LOOP;
+
+    EXECUTE format(
+        'CREATE TABLE "hotel chains".%I (LIKE "hotel chains".%I INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS) '
+        'PARTITION BY RANGE (startdate)', p_table, v_old_name
+    );
+    EXECUTE format('SELECT min(startdate) FROM "hotel chains".%I', v_old_name) INTO v_first;
+    PERFORM "hotel chains".create_stay_partitions(
+        p_table, COALESCE(v_first, CURRENT_DATE), (CURRENT_DATE + make_interval(months => p_months_ahead))::date
+    );
+    EXECUTE format(
+        'INSERT INTO "hotel chains".%I (%s) SELECT %s FROM "hotel chains".%I',
+        p_table, v_columns, v_columns, v_old_name
+    );
+    IF v_sequence IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY "hotel chains".%I.%I', v_sequence, p_table, p_id);
+    END IF;
+    EXECUTE format('DROP TABLE "hotel chains".%I', v_old_name);
+
+    EXECUTE format('ALTER TABLE "hotel chains".%I ADD PRIMARY KEY (%I, startdate)', p_table, p_id);
+    FOREACH v_statement IN ARRAY COALESCE(v_foreign_keys, '{}') || COALESCE(v_indexes, '{}') LOOP
+        EXECUTE v_statement;
+    END LOOP;
+END;
+$$;
+
+-- Merges the monthly partitions of each year that ended before p_before into
+-- one yearly partition, written in (roomid, startdate) order with no free
+-- space, optionally in p_tablespace. Years that still have open stays (booked
+-- bookings, rentings not checked out) are skipped. Returns the new partitions;
+-- VACUUM (FREEZE, ANALYZE) them afterwards.
+CREATE OR REPLACE FUNCTION "hotel chains".archive_stay_partitions(p_table text, p_before date, p_tablespace text DEFAULT NULL)
+RETURNS SETOF text
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_open text := CASE p_table
+        WHEN 'bookings' THEN 'status = ''Booked'''
+        ELSE 'status IS DISTINCT FROM ''CheckedOut''' END;
+    v_columns text;
+    v_year integer;
+    v_archive text;
+    v_months text[];
+    v_month text;
+    v_has_open boolean;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO v_columns
+    FROM pg_attribute
+    WHERE attrelid = format('"hotel chains".%I', p_table)::regclass
+    AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+
+    FOR v_year IN
+        SELECT DISTINCT substring(c.relname FROM length(p_table) + 2 FOR 4)::integer
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = format('"hotel chains".%I', p_table)::regclass
+        AND c.relname ~ ('^' || p_table || '_[0-9]{4}_[0-9]{2}$')
+        ORDER BY 1
+    LOOP
+        EXIT WHEN make_date(v_year + 1, 1, 1) > p_before;
+        v_archive := format('%s_%s', p_table, v_year);
+        SELECT array_agg(c.relname ORDER BY c.relname) INTO v_months
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = format('"hotel chains".%I', p_table)::regclass
+        AND c.relname LIKE format('%s\_%s\_%%', p_table, v_year);
+
+        -- Writers wait until the year is moved; readers are not blocked
+        FOREACH v_month IN ARRAY v_months LOOP
+            EXECUTE format('LOCK TABLE "hotel chains".%I IN SHARE MODE', v_month);
+        END LOOP;
+        EXECUTE format(
+            'SELECT EXISTS (SELECT 1 FROM (%s) months WHERE %s)',
+            (SELECT string_agg(format('SELECT status FROM "hotel chains".%I', m), ' UNION ALL ') FROM unnest(v_months) m),
+            v_open
+        ) INTO v_has_open;
+        IF v_has_open THEN
+            RAISE NOTICE '% % still has open stays; not archived', p_table, v_year;
+            CONTINUE;
+        END IF;
+
+        EXECUTE format(
+            'CREATE TABLE "hotel chains".%I (LIKE "hotel chains".%I INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS) '
+            'WITH (fillfactor = 100)%s',
+            v_archive, p_table, CASE WHEN p_tablespace IS NOT NULL THEN format(' TABLESPACE %I', p_tablespace) ELSE '' END
+        );
+        EXECUTE format(
+            'INSERT INTO "hotel chains".%I (%s) SELECT %s FROM (%s) months ORDER BY roomid, startdate',
+            v_archive, v_columns, v_columns,
+            (SELECT string_agg(format('SELECT * FROM "hotel chains".%I', m), ' UNION ALL ') FROM unnest(v_months) m)
+        );
+        FOREACH v_month IN ARRAY v_months LOOP
+            EXECUTE format('ALTER TABLE "hotel chains".%I DETACH PARTITION "hotel chains".%I', p_table, v_month);
+            EXECUTE format('DROP TABLE "hotel chains".%I', v_month);
+        END LOOP;
+        -- A matching check lets ATTACH skip scanning the rows again
+        EXECUTE format(
+            'ALTER TABLE "hotel chains".%I ADD CONSTRAINT %I CHECK (startdate >= %L AND startdate < %L)',
+            v_archive, v_archive || '_bounds', make_date(v_year, 1, 1), make_date(v_year + 1, 1, 1)
+        );
+        EXECUTE format(
+            'ALTER TABLE "hotel chains".%I ATTACH PARTITION "hotel chains".%I FOR VALUES FROM (%L) TO (%L)',
+            p_table, v_archive, make_date(v_year, 1, 1), make_date(v_year + 1, 1, 1)
+        );
+        EXECUTE format('ALTER TABLE "hotel chains".%I DROP CONSTRAINT %I', v_archive, v_archive || '_bounds');
+        RETURN NEXT v_archive;
+    END LOOP;
+END;
+$$;
+
+-- Rejects a stay overlapping an active stay of the same room in p_table
+-- (TG_ARGV[0]): bookings that are 'Booked', rentings not checked out
+CREATE OR REPLACE FUNCTION "hotel chains".prevent_stay_overlap()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_overlaps boolean;
+BEGIN
+    IF TG_ARGV[0] = 'bookings' THEN
+        IF NEW.status IS DISTINCT FROM 'Booked' THEN
+            RETURN NEW;
+        END IF;
+        PERFORM pg_advisory_xact_lock(2132, NEW.roomid);
+        SELECT EXISTS (
+            SELECT 1 FROM "hotel chains".bookings b
+            WHERE b.roomid = NEW.roomid AND b.bookingid <> NEW.bookingid AND b.status = 'Booked'
+            AND b.startdate BETWEEN NEW.startdate - 180 AND NEW.enddate AND b.enddate >= NEW.startdate
+        ) INTO v_overlaps;
+    ELSE
+        IF NEW.status = 'CheckedOut' THEN
+            RETURN NEW;
+        END IF;
+        PERFORM pg_advisory_xact_lock(2132, NEW.roomid);
+        SELECT EXISTS (
+            SELECT 1 FROM "hotel chains".rentings rt
+            WHERE rt.roomid = NEW.roomid AND rt.rentingid <> NEW.rentingid
+            AND rt.status IS DISTINCT FROM 'CheckedOut'
+            AND rt.startdate BETWEEN NEW.startdate - 180 AND NEW.enddate AND rt.enddate >= NEW.startdate
+        ) INTO v_overlaps;
+    END IF;
+    IF v_overlaps THEN
+        RAISE EXCEPTION 'Room % is taken between % and %', NEW.roomid, NEW.startdate, NEW.enddate
+            USING ERRCODE = 'exclusion_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+-- Exclusion constraints cannot span partitions; see above
+ALTER TABLE "hotel chains".bookings DROP CONSTRAINT IF EXISTS bookings_no_overlap;
+ALTER TABLE "hotel chains".bookings DROP COLUMN IF EXISTS stay;
+
+ALTER TABLE "hotel chains".bookings DROP CONSTRAINT IF EXISTS bookings_stay_length;
+ALTER TABLE "hotel chains".bookings
+    ADD CONSTRAINT bookings_stay_length CHECK (enddate - startdate <= 180);
+ALTER TABLE "hotel chains".rentings DROP CONSTRAINT IF EXISTS rentings_stay_length;
+ALTER TABLE "hotel chains".rentings
+    ADD CONSTRAINT rentings_stay_length CHECK (enddate - startdate <= 180);
+
+SELECT "hotel chains".partition_stay_table('bookings', 'bookingid', 24);
+SELECT "hotel chains".partition_stay_table('rentings', 'rentingid', 24);
+
+-- Created on the partitioned tables, so every partition gets them, including
+-- those created or attached later
+DROP TRIGGER IF EXISTS bookings_stay_overlap ON "hotel chains".bookings;
+CREATE TRIGGER bookings_stay_overlap
+    BEFORE INSERT OR UPDATE OF roomid, startdate, enddate, status ON "hotel chains".bookings
+    FOR EACH ROW EXECUTE FUNCTION "hotel chains".prevent_stay_overlap('bookings');
+DROP TRIGGER IF EXISTS rentings_stay_overlap ON "hotel chains".rentings;
+CREATE TRIGGER rentings_stay_overlap
+    BEFORE INSERT OR UPDATE OF roomid, startdate, enddate, status ON "hotel chains".rentings
+    FOR EACH ROW EXECUTE FUNCTION "hotel chains".prevent_stay_overlap('rentings');
+
+-- Searches look stays up by room and start date in each month scanned
+CREATE INDEX IF NOT EXISTS idx_bookings_room_start ON "hotel chains".bookings (roomid, startdate);
+CREATE INDEX IF NOT EXISTS idx_rentings_room_start ON "hotel chains".rentings (roomid, startdate);
+
+ANALYZE "hotel chains".bookings;
+ANALYZE "hotel chains".rentings;
@@ -0,0 +1,131 @@
+"""Change notifications between app workers over Postgres LISTEN/NOTIFY.
+
+Every worker keeps in-memory state built from the database: the availability
+index, the occupancy array, area suggestions, the reference cache and
+read-your-writes pins. A write through one worker updates only that worker's
+copy, so write handlers also ``publish`` what they changed. The changes go out
+with ``pg_notify`` in the write's own transaction, so they are delivered only
+if it commits, and in commit order. Each worker's ``Listener`` keeps one
+connection outside the pool listening on ``CHANNEL`` and applies the changes
+of every other worker (and of command-line tools such as rollover.py).
+
+A change is a short list whose first element names it (see ``apply_changes``
+in main.py). Dates travel as ISO strings.
+
+A listener that loses its connection may have missed changes, so after
+reconnecting it rebuilds everything through ``on_resync``. So does one that
+fails to apply a notification, whose changes are then only partly applied.
+"""
+import asyncio
+import logging
+import os
+import uuid
+
+import orjson
+from sqlalchemy import text
+
+from database import raw_connect
+from metrics import registry
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+CHANGE_NOTIFICATIONS = os.getenv("CHANGE_NOTIFICATIONS", "true").lower() in ("1", "true", "yes")
+CHANNEL = "hotel_changes"
+# Postgres refuses payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7900
+
+# Tells this process's own notifications apart from other workers'
+WORKER_ID = uuid.uuid4().hex
+
+NOTIFY_QUERY = """
+SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload
+"""
+
+change_notifications = registry.counter(
+    "change_notifications_total",
+    "Change notifications sent to, applied from and failed to apply from other workers.",
+    ("direction",)
+)
+listener_resyncs = registry.counter(
+    "change_listener_resyncs_total", "Full rebuilds after the change listener reconnected or failed to apply changes."
+)
+
+
+def payloads(changes):
+    """Split ``changes`` into as few notification payloads as fit the size limit."""
+    envelope = len(dumps({"worker": WORKER_ID, "changes": []}))
+    chunks, chunk, size = [], [], envelope
+    for change in changes:
+        encoded = dumps(change)
+        if chunk and size + len(encoded) + 1 > MAX_PAYLOAD_BYTES:
+            chunks.append(chunk)
+            chunk, size = [], envelope
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        chunks.append(chunk)
+    worker = dumps(WORKER_ID).decode()
+    return [f'{{"worker":{worker},"changes":[{b",".join(chunk).decode()}]}}' for chunk in chunks]
+
+
+async def publish(db, changes):
+    """Send ``changes`` to the other workers when ``db``'s transaction commits."""
+    if not CHANGE_NOTIFICATIONS or not changes:
+        return
+    batch = payloads(changes)
+    await db.execute(text(NOTIFY_QUERY), {"channel": CHANNEL, "payloads": batch})
+    change_notifications.inc(("sent",), len(batch))
+
+
+class Listener:
+    def __init__(self, on_changes, on_resync, reconnect_seconds=5.0):
+        self.on_changes = on_changes
+        self.on_resync = on_resync
+        self.reconnect_seconds = reconnect_seconds
+        self.connected = False
+
+    async def run(self):
+        resync = False
+        while True:
+            queue = asyncio.Queue()
+            conn = None
+            try:
+                conn = await raw_connect()
+                # None marks a lost connection
+                conn.add_termination_listener(lambda _conn: queue.put_nowait(None))
+                await conn.add_listener(CHANNEL, lambda _conn, _pid, _channel, payload: queue.put_nowait(payload))
+                self.connected = True
+                logger.info(f"Listening for changes on {CHANNEL}")
+                if resync:
+                    listener_resyncs.inc()
+                    await self.on_resync()
+                while (payload := await queue.get()) is not None:
+                    await self._apply(payload)
+                logger.warning("Change listener connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change listener failed: {str(e)}")
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+            resync = True
+            await asyncio.sleep(self.reconnect_seconds)
+
+    async def _apply(self, payload):
+        try:
+            message = orjson.loads(payload)
+            if message["worker"] == WORKER_ID:
+                return
+            await self.on_changes(message["changes"])
+            change_notifications.inc(("applied",))
+        except Exception as e:
+            change_notifications.inc(("failed",))
+            logger.error(f"Failed to apply change notification, resyncing: {str(e)}", exc_info=True)
+            try:
+                listener_resyncs.inc()
+                await self.on_resync()
+            except Exception as e:
+                logger.error(f"Change listener resync failed: {str(e)}", exc_info=True)
@@ -0,0 +1,252 @@
+"""Room-by-day occupancy array behind /api/analytics/occupancy.
+
+Every room is a row and every night a column; a cell counts the bookings and
+rentings covering that night (a checked-in booking and its renting overlap, so
+occupancy is ``count > 0``). Rooms are ordered by chain, hotel and room id, so
+the rooms of a hotel or chain are contiguous and any grouping is a handful of
+vectorized sums over row blocks. Cells take one byte: 40,000 rooms over three
+years is about 45 MB.
+
+The array is built at startup from bookings and rentings that are not
+cancelled, and the write handlers in main.py add and remove stays after each
+commit. Revenue is the room's current price for each occupied night.
+"""
+import threading
+from itertools import chain
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+from availability import MAX_STAY_NIGHTS
+
+ROOMS_QUERY = """
+SELECT r.roomid,
+       r.hotelid,
+       COALESCE(r.price, 0) as price,
+       h.haddress as hotel_address,
+       h.chainid,
+       hc.cname as chain_name
+FROM "hotel chains".rooms r
+JOIN "hotel chains".hotels h ON r.hotelid = h.hotelid
+JOIN "hotel chains".hotelchains hc ON h.chainid = hc.chainid
+ORDER BY h.chainid, r.hotelid, r.roomid
+"""
+
+# A stay occupies the nights from its start date up to the day before its end
+# date; a same-day stay counts as one night. Night offsets are computed in SQL
+# and sent as one pair of arrays per room, which decodes far faster than a row
+# per stay.
+STAYS_QUERY = f"""
+SELECT roomid,
+       array_agg(GREATEST(startdate - CAST(:first_day AS date), 0)) as first_nights,
+       array_agg(GREATEST(enddate, startdate + 1) - CAST(:first_day AS date)) as last_nights
+FROM (
+    SELECT roomid, startdate, enddate FROM "hotel chains".bookings
+    WHERE status IS DISTINCT FROM 'Cancelled'
+    UNION ALL
+    SELECT roomid, startdate, enddate FROM "hotel chains".rentings
+) stays
+WHERE GREATEST(enddate, startdate + 1) > CAST(:first_day AS date)
+AND startdate >= CAST(:first_day AS date) - {MAX_STAY_NIGHTS}
+GROUP BY roomid
+"""
+
+GROUP_KEYS = {
+    "hotel": ("hotelid", "hotel_address", "chainid", "chain_name"),
+    "chain": ("chainid", "chain_name"),
+}
+
+# Columns are allocated this many nights at a time as bookings move forward
+GROWTH_DAYS = 90
+
+
+def _plain(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class OccupancyCube:
+    def __init__(self, history_days=730, horizon_days=365):
+        self.history_days = history_days
+        self.horizon_days = horizon_days
+        self._lock = threading.RLock()
+        self._counts = None
+        self._rooms = None
+        self._rows = {}
+        self.first_day = None
+
+    @property
+    def ready(self):
+        return self.first_day is not None
+
+    @property
+    def days(self):
+        return self._counts.shape[1] if self._counts is not None else 0
+
+    @staticmethod
+    def _catalogue(rows):
+        return {
+            "roomid": np.array([row.roomid for row in rows], dtype=np.int64),
+            "hotelid": np.array([row.hotelid for row in rows], dtype=np.int64),
+            "chainid": np.array([row.chainid for row in rows], dtype=np.int64),
+            "price": np.array([float(row.price) for row in rows], dtype=np.float64),
+            "hotel_address": [row.hotel_address for row in rows],
+            "chain_name": [row.chain_name for row in rows],
+        }
+
+    async def load(self, db):
+        first_day = date.today() - timedelta(days=self.history_days)
+        rooms = self._catalogue((await db.execute(text(ROOMS_QUERY))).all())
+        stays = (await db.execute(text(STAYS_QUERY), {"first_day": first_day})).all()
+
+        row_of = {room_id: idx for idx, room_id in enumerate(rooms["roomid"].tolist())}
+        stays = [stay for stay in stays if stay.roomid in row_of]
+        rows = np.repeat(
+            np.array([row_of[stay.roomid] for stay in stays], dtype=np.int64),
+            [len(stay.first_nights) for stay in stays]
+        )
+        first_nights = np.fromiter(chain.from_iterable(stay.first_nights for stay in stays), np.int64, len(rows))
+        last_nights = np.fromiter(chain.from_iterable(stay.last_nights for stay in stays), np.int64, len(rows))
+        days = max(int(last_nights.max(initial=0)), self.history_days + self.horizon_days)
+
+        # Mark where each stay starts and ends, then one running sum per row
+        # turns the markers into per-night counts
+        counts = np.zeros((len(row_of), days + 1), dtype=np.int8)
+        np.add.at(counts, (rows, first_nights), 1)
+        np.add.at(counts, (rows, last_nights), -1)
+        np.cumsum(counts, axis=1, dtype=np.int8, out=counts)
+
+        with self._lock:
+            self._counts = counts[:, :days]
+            self._rooms = rooms
+            self._rows = row_of
+            self.first_day = first_day
+
+    async def refresh_rooms(self, db):
+        """Reload the room catalogue after room or hotel writes, keeping every room's nights."""
+        if not self.ready:
+            return
+        rooms = self._catalogue((await db.execute(text(ROOMS_QUERY))).all())
+        row_of = {room_id: idx for idx, room_id in enumerate(rooms["roomid"].tolist())}
+        with self._lock:
+            kept = [(row_of[room_id], old) for room_id, old in self._rows.items() if room_id in row_of]
+            counts = np.zeros((len(row_of), self.days), dtype=np.int8)
+            if kept:
+                new_rows, old_rows = (np.array(col) for col in zip(*kept))
+                counts[new_rows] = self._counts[old_rows]
+            self._counts = counts
+            self._rooms = rooms
+            self._rows = row_of
+
+    def _nights(self, start: date, end: date):
+        first = max((start - self.first_day).days, 0)
+        last = (max(end, start + timedelta(days=1)) - self.first_day).days
+        return first, last
+
+    def _grow(self, days):
+        extra = max(days - self.days, GROWTH_DAYS)
+        self._counts = np.pad(self._counts, ((0, 0), (0, extra)))
+
+    def add(self, room_id, start: date, end: date, delta=1):
+        """Count a committed stay; ``delta=-1`` takes a cancelled one back out."""
+        if not self.ready:
+            return
+        with self._lock:
+            row = self._rows.get(room_id)
+            first, last = self._nights(start, end)
+            if row is None or last <= 0:
+                return
+            if last > self.days:
+                self._grow(last)
+            self._counts[row, first:last] += delta
+
+    def remove(self, room_id, start: date, end: date):
+        self.add(room_id, start, end, delta=-1)
+
+    def aggregate(self, start: date, end: date, group_by=(), hotel_id=None, chain_id=None):
+        """Occupancy, ADR and RevPAR for the nights ``start`` through ``end``.
+
+        ``group_by`` holds at most one of ``hotel`` or ``chain`` and optionally
+        ``day``; with neither, the selected rooms form a single group. Raises
+        ``ValueError`` for nights before the start of the array.
+        """
+        if start < self.first_day:
+            raise ValueError(f"Occupancy data starts at {self.first_day.isoformat()}")
+        first = (start - self.first_day).days
+        nights = (end - start).days + 1
+
+        with self._lock:
+            rooms = self._rooms
+            selected = np.ones(len(rooms["roomid"]), dtype=bool)
+            if hotel_id is not None:
+                selected &= rooms["hotelid"] == hotel_id
+            if chain_id is not None:
+                selected &= rooms["chainid"] == chain_id
+            picked = np.flatnonzero(selected)
+            if not len(picked):
+                return []
+            # Nights past the end of the array have no stays yet
+            occupied = np.zeros((len(picked), nights), dtype=bool)
+            stop = min(first + nights, self.days)
+            if stop > first:
+                np.greater(self._counts[picked, first:stop], 0, out=occupied[:, :stop - first])
+
+        # Groups are runs of equal ids, since rooms are sorted by chain and hotel
+        group = next((key for key in GROUP_KEYS if key in group_by), None)
+        starts = np.zeros(1, dtype=np.int64)
+        if group is not None:
+            codes = rooms[f"{group}id"][picked]
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        bounds = np.r_[starts, len(picked)]
+        room_counts = np.diff(bounds)
+        prices = rooms["price"][picked]
+
+        if "day" in group_by:
+            occupied_nights = np.add.reduceat(occupied, starts, axis=0, dtype=np.int64)
+            revenue = np.stack([prices[a:b] @ occupied[a:b] for a, b in zip(bounds[:-1], bounds[1:])])
+            available = np.repeat(room_counts[:, None], nights, axis=1)
+        else:
+            per_room = occupied.sum(axis=1)
+            occupied_nights = np.add.reduceat(per_room, starts)
+            revenue = np.add.reduceat(per_room * prices, starts)
+            available = room_counts * nights
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            columns = {
+                "available_room_nights": available,
+                "occupied_room_nights": occupied_nights,
+                "revenue": np.round(revenue, 2),
+                "occupancy_rate": np.round(occupied_nights / available, 4),
+                "adr": np.round(revenue / occupied_nights, 2),
+                "revpar": np.round(revenue / available, 2),
+            }
+        columns = {name: values.tolist() for name, values in columns.items()}
+        labels = [{}]
+        if group is not None:
+            labels = [
+                {key: _plain(rooms[key][picked[idx]]) for key in GROUP_KEYS[group]}
+                for idx in starts.tolist()
+            ]
+
+        results = []
+        for g, label in enumerate(labels):
+            if "day" in group_by:
+                for d in range(nights):
+                    day = {"day": (start + timedelta(days=d)).isoformat()}
+                    results.append({**label, **day, **{name: values[g][d] for name, values in columns.items()}})
+            else:
+                results.append({**label, **{name: values[g] for name, values in columns.items()}})
+        # ADR is undefined when no room was occupied
+        for row in results:
+            if row["adr"] != row["adr"]:
+                row["adr"] = None
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rooms": len(self._rows),
+                "days": self.days,
+                "bytes": self._counts.nbytes if self._counts is not None else 0,
+                "first_day": self.first_day.isoformat() if self.first_day else None,
+            }
@@ -0,0 +1,90 @@
+"""Maintenance of the monthly bookings and rentings partitions.
+
+migrations/008_partition_stays.sql partitions both tables by start date. New
+months need partitions before the first stay starting in them is inserted, so
+``ensure`` keeps ``PARTITION_MONTHS_AHEAD`` months ready; the app runs it every
+``PARTITION_MAINTENANCE_SECONDS`` (see main.py). ``archive`` merges the months
+of each finished year into one yearly partition, rewritten in room order with
+no free space and frozen, optionally in a slower tablespace::
+
+    python partitions.py ensure --months-ahead 24
+    python partitions.py archive --older-than-months 12 --tablespace cold
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from sqlalchemy import text
+
+from database import AsyncSessionLocal, async_engine
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "24"))
+
+TABLES = ("bookings", "rentings")
+
+ENSURE_QUERY = """
+SELECT "hotel chains".create_stay_partitions(
+    :table, CURRENT_DATE, CAST(CURRENT_DATE + make_interval(months => :months) AS date)
+)
+"""
+
+ARCHIVE_QUERY = """
+SELECT "hotel chains".archive_stay_partitions(
+    :table, CAST(date_trunc('month', CURRENT_DATE) - make_interval(months => :months) AS date), :tablespace
+) AS partition
+"""
+
+
+async def ensure(db, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Create missing partitions up to ``months_ahead`` months out; returns how many were created."""
+    created = 0
+    for table in TABLES:
+        created += (await db.execute(text(ENSURE_QUERY), {"table": table, "months": months_ahead})).scalar()
+    return created
+
+
+async def archive(db, older_than_months=12, tablespace=None):
+    """Merge the months of years that ended ``older_than_months`` ago; returns the new partitions."""
+    archived = []
+    for table in TABLES:
+        result = await db.execute(text(ARCHIVE_QUERY), {
+            "table": table, "months": older_than_months, "tablespace": tablespace
+        })
+        archived += [row.partition for row in result]
+    return archived
+
+
+async def main(args):
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            # Rewriting a year of stays runs past the API's statement timeout
+            await db.execute(text("SET LOCAL statement_timeout = 0"))
+            if args.command == "ensure":
+                created = await ensure(db, args.months_ahead)
+                await db.commit()
+                print(f"Created {created} partitions in {time.perf_counter() - started:.2f} s")
+                return
+            archived = await archive(db, args.older_than_months, args.tablespace)
+            await db.commit()
+        # VACUUM cannot run in a transaction
+        async with async_engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for partition in archived:
+                await conn.execute(text(f'VACUUM (FREEZE, ANALYZE) "hotel chains"."{partition}"'))
+        print(f"Archived {', '.join(archived) or 'nothing'} in {time.perf_counter() - started:.2f} s")
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    ensure_parser = commands.add_parser("ensure", help="create partitions for the coming months")
+    ensure_parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    archive_parser = commands.add_parser("archive", help="merge finished years into yearly partitions")
+    archive_parser.add_argument("--older-than-months", type=int, default=12,
+                                help="archive years that ended at least this many months ago")
+    archive_parser.add_argument("--tablespace", help="tablespace for the yearly partitions")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,135 @@
+"""Routing of read-only queries to read replicas.
+
+Read endpoints take their session from ``ReplicaRouter.session``, which hands
+out replicas round-robin and falls back to the primary when none is healthy.
+A background check marks a replica unhealthy when it does not answer within
+the timeout or its replay lags more than ``max_lag`` seconds behind.
+
+Replicas trail the primary, so a customer who has just written would not see
+the change on their next read. Write handlers ``pin`` the customer, and that
+customer's reads go to the primary for the next ``pin_seconds``. Pins reach the
+other workers as change notifications (see notifications.py).
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# Seconds behind the primary; 0 when everything received has been replayed,
+# NULL on a server that is not replicating
+LAG_QUERY = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END AS lag
+"""
+
+
+class ReplicaRouter:
+    def __init__(self, primary_sessions, replica_engines, pin_seconds=5.0, max_lag=30.0, check_timeout=2.0):
+        self._primary = primary_sessions
+        self._engines = list(replica_engines)
+        self._sessions = [
+            async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+            for engine in self._engines
+        ]
+        self._healthy = [True] * len(self._engines)
+        self._lag = [None] * len(self._engines)
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._pins = {}
+        self.pin_seconds = pin_seconds
+        self.max_lag = max_lag
+        self.check_timeout = check_timeout
+        self.reads = {"primary": 0, "pinned": 0, **{self._name(i): 0 for i in range(len(self._engines))}}
+
+    def _name(self, idx):
+        url = self._engines[idx].url
+        return f"{url.host}:{url.port or 5432}"
+
+    def pin(self, *customer_ids):
+        """Send these customers' reads to the primary for the next ``pin_seconds``."""
+        if not self._engines or self.pin_seconds <= 0:
+            return
+        until = time.monotonic() + self.pin_seconds
+        with self._lock:
+            for customer_id in customer_ids:
+                if customer_id is not None:
+                    self._pins[customer_id] = until
+
+    def pinned(self, customer_id):
+        with self._lock:
+            until = self._pins.get(customer_id)
+            if until is None:
+                return False
+            if until < time.monotonic():
+                del self._pins[customer_id]
+                return False
+            return True
+
+    def session(self, customer_id=None):
+        """A session for a read: the next healthy replica, or the primary."""
+        if customer_id is not None and self.pinned(customer_id):
+            with self._lock:
+                self.reads["pinned"] += 1
+            return self._primary()
+        count = len(self._engines)
+        start = next(self._turn)
+        for offset in range(count):
+            idx = (start + offset) % count
+            if self._healthy[idx]:
+                with self._lock:
+                    self.reads[self._name(idx)] += 1
+                return self._sessions[idx]()
+        with self._lock:
+            self.reads["primary"] += 1
+        return self._primary()
+
+    async def _check(self, idx):
+        try:
+            async with asyncio.timeout(self.check_timeout):
+                async with self._engines[idx].connect() as conn:
+                    lag = (await conn.execute(text(LAG_QUERY))).scalar()
+        except Exception as e:
+            if self._healthy[idx]:
+                logger.warning(f"Replica {self._name(idx)} is unavailable: {str(e) or 'timed out'}")
+            self._healthy[idx] = False
+            self._lag[idx] = None
+            return
+        lag = float(lag) if lag is not None else None
+        healthy = lag is None or lag <= self.max_lag
+        if healthy != self._healthy[idx]:
+            logger.warning(f"Replica {self._name(idx)} is {'back' if healthy else f'lagging by {lag:.1f} s'}")
+        self._healthy[idx] = healthy
+        self._lag[idx] = lag
+
+    async def check(self):
+        await asyncio.gather(*(self._check(idx) for idx in range(len(self._engines))))
+
+    async def check_periodically(self, interval):
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+    async def dispose(self):
+        for engine in self._engines:
+            await engine.dispose()
+
+    def stats(self):
+        with self._lock:
+            reads = dict(self.reads)
+            pins = sum(1 for until in self._pins.values() if until >= time.monotonic())
+        return {
+            "replicas": [
+                {"name": self._name(idx), "healthy": self._healthy[idx], "lag_seconds": self._lag[idx]}
+                for idx in range(len(self._engines))
+            ],
+            "reads": reads,
+            "pinned_customers": pins,
+        }
@@ -0,0 +1,165 @@
+"""Day-rollover state transitions for bookings and rentings.
+
+Bookings whose start date has come are checked in (a renting is created and
+the booking marked ``CheckedIn``, as the rentings endpoint does; the renting has
+no employee until the front desk's check-in claims it), and rentings
+whose end date has passed are checked out. The schema's triggers did this per
+row and only when a row happened to be updated, so untouched rows stayed
+``Booked`` or active forever; migrations/007_rollover_batches.sql retires them.
+
+Each step takes at most ``batch_size`` rows per transaction, locked with
+``SKIP LOCKED``, so a run never holds many locks at once and several app
+workers running it together split the rows instead of waiting on each other.
+
+Each batch publishes its changes to the app workers' in-memory indexes (see
+notifications.py). Runs inside the app (see ``ROLLOVER_INTERVAL_SECONDS`` in
+main.py) or from the command line::
+
+    python rollover.py --batch-size 5000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+
+import notifications
+from database import AsyncSessionLocal, async_engine
+from metrics import registry
+
+# A booking that already has an overlapping renting for its room was checked in
+# without being linked; it is marked checked in without a second renting
+CHECK_IN_QUERY = """
+WITH due AS (
+    SELECT bookingid, roomid, hotelid, customerid, startdate, enddate
+    FROM "hotel chains".bookings
+    WHERE status = 'Booked' AND startdate <= CURRENT_DATE
+    -- Room order, as the API takes room locks, since each renting inserted takes its room's lock
+    ORDER BY roomid
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+), numbered AS (
+    SELECT due.*,
+           CASE WHEN NOT EXISTS (
+               SELECT 1 FROM "hotel chains".rentings rt
+               WHERE rt.roomid = due.roomid
+               AND rt.startdate <= due.enddate AND rt.enddate >= due.startdate
+           ) THEN nextval('"hotel chains".renting_id_seq') END AS rentingid
+    FROM due
+), inserted AS (
+    INSERT INTO "hotel chains".rentings (rentingid, roomid, hotelid, customerid, employeeid, startdate, enddate)
+    SELECT rentingid, roomid, hotelid, customerid, NULL, startdate, enddate
+    FROM numbered
+    WHERE rentingid IS NOT NULL
+), checked_in AS (
+    UPDATE "hotel chains".bookings b
+    SET status = 'CheckedIn'
+    FROM numbered
+    WHERE b.bookingid = numbered.bookingid
+)
+SELECT bookingid, rentingid, roomid, startdate, enddate FROM numbered
+"""
+
+CHECK_OUT_QUERY = """
+WITH due AS (
+    SELECT rentingid
+    FROM "hotel chains".rentings
+    WHERE status IS DISTINCT FROM 'CheckedOut' AND enddate < CURRENT_DATE
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE "hotel chains".rentings rt
+SET status = 'CheckedOut'
+FROM due
+WHERE rt.rentingid = due.rentingid
+RETURNING rt.rentingid, rt.roomid, rt.startdate, rt.enddate
+"""
+
+
+def check_in_changes(rows):
+    changes = []
+    for row in rows:
+        changes.append(("release", "booking", row.bookingid, row.roomid, row.startdate, row.enddate))
+        if row.rentingid is not None:
+            changes.append(("occupy", "renting", row.rentingid, row.roomid, row.startdate, row.enddate))
+    return changes
+
+
+def check_out_changes(rows):
+    return [("release", "renting", row.rentingid, row.roomid, row.startdate, row.enddate) for row in rows]
+
+
+STEPS = {
+    "check_in": (CHECK_IN_QUERY, check_in_changes),
+    "check_out": (CHECK_OUT_QUERY, check_out_changes),
+}
+
+rollover_rows = registry.counter(
+    "rollover_rows_total", "Bookings checked in and rentings checked out by the rollover job.", ("step",)
+)
+rollover_seconds = registry.histogram(
+    "rollover_duration_seconds", "Time taken by a complete rollover run.",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300)
+)
+
+
+async def run_step(session_factory, step, batch_size, on_changes=None):
+    """Run one step to completion; returns ``(rows, batches)``.
+
+    ``on_changes`` is awaited with each committed batch's changes.
+    """
+    query, to_changes = STEPS[step]
+    rows = batches = 0
+    while True:
+        async with session_factory() as db:
+            batch = (await db.execute(text(query), {"batch_size": batch_size})).all()
+            changes = to_changes(batch)
+            await notifications.publish(db, changes)
+            await db.commit()
+        if not batch:
+            return rows, batches
+        rows += len(batch)
+        batches += 1
+        rollover_rows.inc((step,), len(batch))
+        if on_changes is not None:
+            await on_changes(changes)
+        if len(batch) < batch_size:
+            return rows, batches
+
+
+async def run(session_factory, batch_size=1000, on_changes=None):
+    """Check in due bookings, then check out ended rentings.
+
+    Check-in runs first, so a booking whose whole stay passed unnoticed ends
+    up as a checked-out renting in a single run. Returns rows, batches and
+    seconds per step.
+    """
+    started = time.perf_counter()
+    report = {}
+    for step in STEPS:
+        step_started = time.perf_counter()
+        rows, batches = await run_step(session_factory, step, batch_size, on_changes)
+        report[step] = {
+            "rows": rows,
+            "batches": batches,
+            "seconds": round(time.perf_counter() - step_started, 3),
+        }
+    elapsed = time.perf_counter() - started
+    rollover_seconds.observe(value=elapsed)
+    report["seconds"] = round(elapsed, 3)
+    return report
+
+
+async def main(args):
+    try:
+        report = await run(AsyncSessionLocal, args.batch_size)
+    finally:
+        await async_engine.dispose()
+    for step in STEPS:
+        print(f"{step:>9}: {report[step]['rows']} rows in {report[step]['batches']} batches, {report[step]['seconds']:.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per transaction")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+"""Row-to-JSON encoding shared by the list endpoints.
+
+Query results come back as SQLAlchemy rows, which are tuples. A ``RowEncoder``
+pairs them with the column names in C (``dict(zip(...))``) and encodes the
+result with orjson in one call, instead of copying each row into a dict field
+by field and then running the whole list through FastAPI's
+``jsonable_encoder``. Handlers return the encoded body directly as a
+``Response``, so FastAPI does not encode it again.
+
+    python benchmarks/serialization.py
+"""
+from decimal import Decimal
+from operator import itemgetter
+
+import orjson
+from fastapi import Response
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def _default(value):
+    # NUMERIC columns (prices, aggregates) come back as Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(obj):
+    return orjson.dumps(obj, default=_default)
+
+
+def json_response(body, headers=None):
+    return Response(content=body, media_type=JSON_MEDIA_TYPE, headers=headers)
+
+
+class RowEncoder:
+    """Encodes rows whose leading columns are ``names``, in that order.
+
+    Columns past ``names`` (for example the sort keys a pagination cursor
+    needs) are left out of the output.
+    """
+    __slots__ = ("names", "_pick")
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        pick = itemgetter(*self.names)
+        self._pick = pick if len(self.names) > 1 else lambda row: (pick(row),)
+
+    def from_mappings(self, rows):
+        """Rows in ``names`` order from dicts such as the availability index records."""
+        return map(self._pick, rows)
+
+    def records(self, rows):
+        names = self.names
+        return [dict(zip(names, row)) for row in rows]
+
+    def encode(self, rows):
+        return dumps(self.records(rows))
+
+    def encode_lines(self, rows):
+        names = self.names
+        option = orjson.OPT_APPEND_NEWLINE
+        return b"".join(orjson.dumps(dict(zip(names, row)), default=_default, option=option) for row in rows)
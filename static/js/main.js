@@ -2,6 +2,8 @@
 let currentCustomerId = null;
 let currentEmployeeId = null;
 let isEmployee = false;
+let searchRooms = [];
+let availabilityEvents = null;
 
 // Utility functions
 function showLoading() {
@@ -153,7 +155,9 @@ async function handleSearch(e) {
             throw new Error('No data received from server');
         }
         
+        searchRooms = data;
         displaySearchResults(data);
+        watchAvailability(params);
     } catch (error) {
         console.error('Error searching rooms:', error);
         showError('searchResults', `Failed to search rooms: ${error.message}`);
@@ -162,6 +166,35 @@ async function handleSearch(e) {
     }
 }
 
+// Keeps the displayed results current as rooms are taken and freed
+function watchAvailability(params) {
+    if (availabilityEvents) {
+        availabilityEvents.close();
+    }
+    if (!window.EventSource) return;
+
+    availabilityEvents = new EventSource(`/sse/availability?${params}`);
+    availabilityEvents.addEventListener('taken', event => {
+        const { roomid } = JSON.parse(event.data);
+        const remaining = searchRooms.filter(room => room.roomid !== roomid);
+        if (remaining.length !== searchRooms.length) {
+            searchRooms = remaining;
+            displaySearchResults(searchRooms);
+        }
+    });
+    availabilityEvents.addEventListener('freed', event => {
+        const { roomid, room } = JSON.parse(event.data);
+        if (!room || searchRooms.some(r => r.roomid === roomid)) return;
+        searchRooms = [...searchRooms, room].sort((a, b) => a.roomid - b.roomid);
+        displaySearchResults(searchRooms);
+    });
+    availabilityEvents.addEventListener('reset', () => {
+        // Spread out the searches of every page reset by the same burst
+        availabilityEvents.close();
+        setTimeout(() => handleSearch(new Event('submit')), Math.random() * 5000);
+    });
+}
+
 async function displaySearchResults(rooms) {
     const resultsDiv = document.getElementById('searchResults');
     resultsDiv.innerHTML = '';
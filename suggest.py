@@ -0,0 +1,130 @@
+"""In-memory prefix trie behind /api/areas/suggest.
+
+Typeahead sends a request per keystroke, so suggestions never touch the
+database. Hotel addresses, the comma-separated parts of addresses (streets,
+cities) and chain names are loaded once, and every word in them starts a key,
+so "ott" finds "3119 Hill Cres, Ottawa" as well as "Ottawa". Each trie node keeps
+its best ``MAX_SUGGESTIONS`` terms, ranked by the number of hotels they match, so
+a lookup is a walk down the prefix and no subtree search.
+"""
+import asyncio
+import re
+import threading
+
+from sqlalchemy import text
+
+ADDRESSES_QUERY = 'SELECT haddress FROM "hotel chains".hotels WHERE haddress IS NOT NULL'
+
+CHAINS_QUERY = """
+SELECT hc.cname, COUNT(h.hotelid) as hotels
+FROM "hotel chains".hotelchains hc
+LEFT JOIN "hotel chains".hotels h ON h.chainid = hc.chainid
+WHERE hc.cname IS NOT NULL
+GROUP BY hc.cname
+"""
+
+MAX_SUGGESTIONS = 20
+
+_WORD_STARTS = re.compile(r"(?<![0-9a-z])[0-9a-z]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(value):
+    return _SPACES.sub(" ", value.strip().lower())
+
+
+class _Node:
+    __slots__ = ("children", "terms", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.terms = set()
+        self.top = ()
+
+
+class PrefixTrie:
+    """Maps every word-start suffix of a term to the term."""
+
+    def __init__(self):
+        self._root = _Node()
+
+    def insert(self, term, term_id):
+        key = normalize(term)
+        for match in _WORD_STARTS.finditer(key):
+            node = self._root
+            for char in key[match.start():]:
+                node = node.children.setdefault(char, _Node())
+            node.terms.add(term_id)
+
+    def rank(self, sort_key, size=MAX_SUGGESTIONS):
+        """Store the best ``size`` terms under each node, ordered by ``sort_key``."""
+        # Post-order without recursion: the best terms of a node are among its
+        # own terms and its children's best terms
+        stack = [(self._root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values())
+                continue
+            candidates = set(node.terms)
+            for child in node.children.values():
+                candidates.update(child.top)
+            node.top = tuple(sorted(candidates, key=sort_key)[:size])
+
+    def lookup(self, prefix):
+        node = self._root
+        for char in normalize(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return ()
+        return node.top
+
+
+class SuggestionIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._terms = []
+        self._tries = {}
+
+    @property
+    def ready(self):
+        return bool(self._tries)
+
+    async def load(self, db):
+        addresses = [row.haddress for row in await db.execute(text(ADDRESSES_QUERY))]
+        chains = [(row.cname, row.hotels) for row in await db.execute(text(CHAINS_QUERY))]
+        # Building takes a fraction of a second for a thousand hotels; keep it
+        # off the event loop
+        terms, tries = await asyncio.get_running_loop().run_in_executor(None, self._build, addresses, chains)
+        with self._lock:
+            self._terms = terms
+            self._tries = tries
+
+    @staticmethod
+    def _build(addresses, chains):
+        # An area term matches every hotel whose address contains it, as the
+        # search's ILIKE filter does
+        area_hotels = {}
+        for address in addresses:
+            parts = {address.strip()} | {part.strip() for part in address.split(",")}
+            for part in parts - {""}:
+                area_hotels[part] = area_hotels.get(part, 0) + 1
+
+        terms = [("area", term, count) for term, count in area_hotels.items()]
+        terms += [("chain", name, hotels) for name, hotels in chains]
+        tries = {"area": PrefixTrie(), "chain": PrefixTrie()}
+        for term_id, (kind, term, _) in enumerate(terms):
+            tries[kind].insert(term, term_id)
+        for trie in tries.values():
+            trie.rank(lambda term_id: (-terms[term_id][2], terms[term_id][1]))
+        return terms, tries
+
+    def suggest(self, prefix, limit=10, kind=None):
+        """Terms with a word starting with ``prefix``, most hotels first."""
+        with self._lock:
+            terms = self._terms
+            tries = [self._tries[kind]] if kind else list(self._tries.values())
+        found = {term_id for trie in tries for term_id in trie.lookup(prefix)}
+        best = sorted(found, key=lambda term_id: (-terms[term_id][2], terms[term_id][1]))[:limit]
+        return [{"text": terms[i][1], "kind": terms[i][0], "hotels": terms[i][2]} for i in best]
@@ -0,0 +1,113 @@
+"""Rollover check-in followed by the front desk's check-in.
+
+Runs against the database in DATABASE_URL (set up with setup_db.sql and the
+migrations) and is skipped when it is not set or cannot connect.
+"""
+import os
+from datetime import date, timedelta
+
+import pytest
+from dotenv import load_dotenv
+
+load_dotenv()
+if not os.getenv("DATABASE_URL"):
+    pytest.skip("DATABASE_URL is not set", allow_module_level=True)
+os.environ.setdefault("ROLLOVER_INTERVAL_SECONDS", "0")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+import main
+import rollover
+from database import AsyncSessionLocal
+
+FREE_ROOM_QUERY = """
+SELECT r.roomid,
+       (SELECT MIN(customerid) FROM "hotel chains".customers) AS customerid,
+       (SELECT MIN(employeeid) FROM "hotel chains".employees) AS employeeid
+FROM "hotel chains".rooms r
+WHERE NOT EXISTS (
+    SELECT 1 FROM "hotel chains".bookings b
+    WHERE b.roomid = r.roomid AND b.status = 'Booked'
+    AND b.startdate <= :end_date AND b.enddate >= :start_date
+) AND NOT EXISTS (
+    SELECT 1 FROM "hotel chains".rentings rt
+    WHERE rt.roomid = r.roomid AND rt.startdate <= :end_date AND rt.enddate >= :start_date
+)
+ORDER BY r.roomid
+LIMIT 1
+"""
+
+
+async def fetch(query, **params):
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(text(query), params)).all()
+
+
+async def execute(query, **params):
+    async with AsyncSessionLocal() as db:
+        await db.execute(text(query), params)
+        await db.commit()
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        # Startup does not connect, so check the database here
+        try:
+            client.portal.call(lambda: fetch("SELECT 1"))
+        except (OSError, SQLAlchemyError) as e:
+            pytest.skip(f"Database unavailable: {e}")
+        yield client
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+@pytest.mark.parametrize("with_booking_id", [True, False])
+def test_desk_check_in_claims_rollover_renting(client, with_booking_id, bulk):
+    start, end = date.today(), date.today() + timedelta(days=2)
+    rows = client.portal.call(lambda: fetch(FREE_ROOM_QUERY, start_date=start, end_date=end))
+    if not rows:
+        pytest.skip("No room is free for the test dates")
+    room_id, customer_id, employee_id = rows[0]
+    stay = {"room_id": room_id, "customer_id": customer_id,
+            "start_date": start.isoformat(), "end_date": end.isoformat()}
+
+    response = client.post("/api/bookings", json=stay)
+    assert response.status_code == 200, response.text
+    booking_id = response.json()["bookingid"]
+    try:
+        client.portal.call(lambda: rollover.run(AsyncSessionLocal, 1000, on_changes=main.apply_changes))
+        created = client.portal.call(lambda: fetch(
+            'SELECT rentingid, employeeid FROM "hotel chains".rentings '
+            'WHERE roomid = :room_id AND startdate = :start_date AND enddate = :end_date',
+            room_id=room_id, start_date=start, end_date=end
+        ))
+        assert len(created) == 1 and created[0].employeeid is None
+
+        # The search page's renting form does not send the booking
+        renting = {**stay, "employee_id": employee_id, "booking_id": booking_id if with_booking_id else None}
+        if bulk:
+            response = client.post("/api/rentings/bulk", json={"items": [renting]})
+            assert response.status_code == 200, response.text
+            assert response.json()["results"][0]["rentingid"] == created[0].rentingid
+        else:
+            response = client.post("/api/rentings", json=renting)
+            assert response.status_code == 200, response.text
+            assert response.json()["rentingid"] == created[0].rentingid
+
+        rentings = client.portal.call(lambda: fetch(
+            'SELECT rentingid, employeeid FROM "hotel chains".rentings '
+            'WHERE roomid = :room_id AND startdate = :start_date AND enddate = :end_date',
+            room_id=room_id, start_date=start, end_date=end
+        ))
+        assert [(r.rentingid, r.employeeid) for r in rentings] == [(created[0].rentingid, employee_id)]
+        assert not main.availability.covers(start) or not main.availability.is_free(room_id, start, end)
+    finally:
+        client.portal.call(lambda: execute(
+            'DELETE FROM "hotel chains".rentings WHERE roomid = :room_id AND startdate = :start_date AND enddate = :end_date',
+            room_id=room_id, start_date=start, end_date=end
+        ))
+        client.portal.call(lambda: execute(
+            'DELETE FROM "hotel chains".bookings WHERE bookingid = :booking_id', booking_id=booking_id
+        ))